@@ -33,3 +33,9 @@ class Colors:
     BG_CYAN = '\033[46m'
     BG_WHITE = '\033[47m'
 
+    @classmethod
+    def disable(cls):
+        '''Функция которая отключает цвета (например, в пакетном режиме): все коды становятся пустыми строками.'''
+        for name in dir(cls):
+            if name.isupper():
+                setattr(cls, name, '')
@@ -0,0 +1,384 @@
+import collections
+import gzip
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from ansi import Colors
+from fileio import BLOCK_SIZE
+from jobs import check_cancelled
+from operations import undo_operation
+
+# Форматы архивов по расширению имени
+FORMATS = (('.tar.gz', 'tar.gz'), ('.tgz', 'tar.gz'), ('.tar', 'tar'), ('.zip', 'zip'))
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+
+
+def archive_format(name):
+    '''Функция которая определяет формат архива по имени (tar, tar.gz, zip). Неизвестное расширение - ValueError.'''
+    lower = name.lower()
+    for suffix, fmt in FORMATS:
+        if lower.endswith(suffix):
+            return fmt
+    raise ValueError(f"unknown archive format: '{name}' (expected .tar, .tar.gz, .tgz or .zip)")
+
+
+class ParallelGzipWriter:
+    '''
+        Класс потока записи gzip со сжатием в пуле потоков (как pigz).
+
+        Данные режутся на блоки по block_size байт, каждый блок сжимается отдельным членом gzip
+        (zlib отпускает GIL, поэтому блоки сжимаются параллельно), а сжатые блоки пишутся в файл
+        строго по порядку. В работе одновременно не больше 2 * jobs блоков, так что память
+        ограничена независимо от размера архива. Склейка членов - обычный gzip, который читают
+        gzip, tar и этот shell.
+    '''
+    def __init__(self, fileobj, level=6, jobs=None, block_size=1024 * 1024):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. fileobj - Бинарный поток, в который пишется сжатый архив
+                2. level (int) - Уровень сжатия (1-9)
+                3. jobs (int) - Количество потоков сжатия
+                4. block_size (int) - Размер блока несжатых данных
+        '''
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.jobs = jobs or os.cpu_count() or 1
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='gzip')
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(gzip.compress, block, self.level, mtime=0))
+        while len(self._pending) > 2 * self.jobs:
+            self._write_next()
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self.fileobj.write(compressed)
+        self.bytes_out += len(compressed)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        '''Функция которая сжимает остаток буфера и дописывает все блоки по порядку.'''
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_sources(path, arcname, exclude=()):
+    '''
+        Функция которая перебирает элементы дерева для архива: сначала директория, затем её содержимое.
+
+        Принимает:
+            1. path (str) - Путь к файлу или директории
+            2. arcname (str) - Имя элемента в архиве
+            3. exclude - Пути, которые не попадают в архив (сам архив)
+
+        Вывод: генератор пар (путь, имя в архиве).
+    '''
+    stack = [(path, arcname)]
+    while stack:
+        path, arcname = stack.pop()
+        if path in exclude:
+            continue
+        yield path, arcname
+        if os.path.isdir(path) and not os.path.islink(path):
+            with os.scandir(path) as it:
+                names = sorted(entry.name for entry in it)
+            stack.extend((os.path.join(path, name), f"{arcname}/{name}") for name in reversed(names))
+
+
+def write_archive(archive_path, fmt, sources, level=6, jobs=None, block_size=1024 * 1024, exclude=()):
+    '''
+        Функция которая потоково записывает архив: файлы читаются блоками и сразу уходят в архив,
+        ни архив, ни файлы целиком в памяти не держатся.
+
+        Принимает:
+            1. archive_path (str) - Путь к создаваемому архиву
+            2. fmt (str) - Формат (tar, tar.gz, zip)
+            3. sources (list) - Пары (путь, имя в архиве)
+            4. level (int) - Уровень сжатия
+            5. jobs (int) - Количество потоков сжатия (tar.gz)
+            6. block_size (int) - Размер блока параллельного сжатия
+            7. exclude - Пути, которые не попадают в архив
+
+        Вывод: количество байт данных файлов, записанных в архив (int).
+    '''
+    total = 0
+    with open(archive_path, 'wb') as f:
+        if fmt == 'zip':
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as archive:
+                for source, arcname in sources:
+                    for path, name in iter_sources(source, arcname, exclude):
+                        check_cancelled()
+                        archive.write(path, name)
+                        if os.path.isfile(path):
+                            total += os.path.getsize(path)
+            return total
+        stream = ParallelGzipWriter(f, level, jobs, block_size) if fmt == 'tar.gz' else f
+        try:
+            with tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+                for source, arcname in sources:
+                    for path, name in iter_sources(source, arcname, exclude):
+                        check_cancelled()
+                        info = archive.gettarinfo(path, name)
+                        if info.isreg():
+                            with open(path, 'rb') as member:
+                                archive.addfile(info, member)
+                            total += info.size
+                        else:
+                            archive.addfile(info)
+        finally:
+            if stream is not f:
+                stream.close()
+    return total
+
+
+def member_path(name):
+    '''Функция которая проверяет имя элемента архива: абсолютные пути и выход через '..' - OSError.'''
+    path = os.path.normpath(name.replace('\\', '/'))
+    if os.path.isabs(path) or path == '..' or path.startswith('..' + os.sep):
+        raise OSError(f"unsafe path in archive: '{name}'")
+    return path
+
+
+class Extractor:
+    '''
+        Класс потоковой распаковки архива с записью того, что создано, для undo.
+
+        Для каждого элемента находится первый компонент пути, которого до распаковки не было:
+        он и становится элементом операции (как созданный cp файл или директория). Существующие
+        директории сливаются с архивом, а заменяемый файл сначала уходит в корзину, поэтому
+        undo удаляет всё созданное распаковкой и возвращает заменённые файлы.
+    '''
+    def __init__(self, dest, trash):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. dest (str) - Директория назначения
+                2. trash (Trash) - Корзина для заменяемых файлов
+        '''
+        self.dest = dest
+        self.trash = trash
+        self.items = []
+        self.roots = {}
+        self.dir_times = []
+        # Созданная распаковкой директория назначения - единственный элемент операции
+        self.whole = None
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+            self.whole = {'dst_path': dest, 'bytes': 0}
+            self.items.append(self.whole)
+
+    def claim(self, rel, is_dir=False, size=0):
+        '''Функция которая записывает элемент архива rel в данные операции перед его распаковкой.'''
+        if self.whole is not None:
+            self.whole['bytes'] += size
+            return
+        path = self.dest
+        parts = rel.split(os.sep)
+        for i, part in enumerate(parts):
+            path = os.path.join(path, part)
+            item = self.roots.get(path)
+            if item is None and not os.path.lexists(path):
+                item = {'dst_path': path, 'bytes': 0}
+            elif item is None and i == len(parts) - 1 and not (is_dir and os.path.isdir(path)
+                                                              and not os.path.islink(path)):
+                entry = self.trash.put(path)
+                item = {'dst_path': path, 'bytes': 0,
+                        'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']}
+            if item is not None:
+                if path not in self.roots:
+                    self.roots[path] = item
+                    self.items.append(item)
+                item['bytes'] += size
+                return
+
+    def extract_tar(self, f):
+        '''Функция которая распаковывает tar (или tar.gz) из потока f за один проход.'''
+        if f.peek(2)[:2] == GZIP_MAGIC:
+            # GzipFile читает и архивы из нескольких членов gzip (ParallelGzipWriter)
+            f = gzip.GzipFile(fileobj=f, mode='rb')
+        with tarfile.open(fileobj=f, mode='r|') as archive:
+            for member in archive:
+                check_cancelled()
+                rel = member_path(tarfile.data_filter(member, self.dest).name)
+                if rel == os.curdir:
+                    continue
+                self.claim(rel, member.isdir(), member.size if member.isreg() else 0)
+                archive.extract(member, self.dest, filter='data')
+                if member.isdir():
+                    self.dir_times.append((os.path.join(self.dest, rel), member.mtime))
+
+    def zip_target(self, name, rel):
+        '''
+            Функция которая возвращает путь распаковки элемента zip rel. Путь, который через ссылку
+            на директорию, уже лежащую в dest, ведёт за её пределы - OSError (для tar то же самое
+            проверяет tarfile.data_filter).
+        '''
+        target = os.path.join(self.dest, rel)
+        dest = os.path.realpath(self.dest)
+        parent = os.path.realpath(os.path.dirname(target))
+        if parent != dest and not parent.startswith(dest + os.sep):
+            raise OSError(f"unsafe path in archive: '{name}' leads outside '{self.dest}' through a link")
+        return target
+
+    def extract_zip(self, path):
+        '''Функция которая распаковывает zip, копируя каждый элемент блоками.'''
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                check_cancelled()
+                rel = member_path(info.filename)
+                if rel == os.curdir:
+                    continue
+                target = self.zip_target(info.filename, rel)
+                self.claim(rel, info.is_dir(), info.file_size)
+                mtime = _zip_time(info)
+                if info.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    self.dir_times.append((target, mtime))
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # O_NOFOLLOW: ссылка на месте файла не даёт записать его за пределы dest
+                fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o666)
+                with archive.open(info) as src, open(fd, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, BLOCK_SIZE)
+                mode = (info.external_attr >> 16) & 0o777
+                if mode:
+                    os.chmod(target, mode)
+                os.utime(target, (mtime, mtime))
+
+    def extract(self, archive_path):
+        '''Функция которая распаковывает архив, определяя формат по его содержимому.'''
+        with open(archive_path, 'rb') as f:
+            magic = f.peek(4)[:4]
+            if magic in ZIP_MAGIC:
+                self.extract_zip(f)
+            else:
+                self.extract_tar(f)
+        # Время директорий восстанавливается в конце: запись файлов внутри его меняет
+        for path, mtime in reversed(self.dir_times):
+            try:
+                os.utime(path, (mtime, mtime))
+            except OSError:
+                pass
+
+
+def _zip_time(info):
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def pack(shell, archive, *paths, level=None, jobs=None):
+    '''
+        Функция команды pack: создаёт архив tar, tar.gz (.tgz) или zip из файлов и директорий.
+        Архив пишется потоково во временный файл и заменяет цель только после успешной записи;
+        tar.gz сжимается блоками в пуле потоков. Прежний архив с тем же именем уходит в корзину,
+        команду отменяет undo.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. archive (str) - Путь к архиву (формат - по расширению)
+            3. paths (str) - Файлы и директории, которые попадут в архив
+            4. level (int) - Уровень сжатия 1-9 (--level N)
+            5. jobs (int) - Количество потоков сжатия (--jobs N)
+
+        Вывод: None
+    '''
+    from config import ARCHIVE_CONFIG
+    args = ([f"--level={level}"] if level else []) + ([f"--jobs={jobs}"] if jobs else []) + [archive, *paths]
+    archive_path = os.path.join(shell.current_dir, archive)
+    tmp_path = archive_path + '.part'
+    try:
+        fmt = archive_format(archive)
+        sources = []
+        for path in paths:
+            source = os.path.normpath(os.path.join(shell.current_dir, path))
+            if not os.path.lexists(source):
+                raise FileNotFoundError(f"'{path}' doesn't exist")
+            sources.append((source, os.path.basename(source)))
+        total = write_archive(tmp_path, fmt, sources, level or ARCHIVE_CONFIG['level'],
+                              jobs or ARCHIVE_CONFIG['jobs'], ARCHIVE_CONFIG['block_size'],
+                              exclude={os.path.normpath(archive_path), os.path.normpath(tmp_path)})
+        item = {'dst_path': archive_path, 'bytes': total}
+        if os.path.lexists(archive_path):
+            entry = shell.trash.put(archive_path, link=os.path.isfile(archive_path))
+            item.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+        os.replace(tmp_path, archive_path)
+        print(f"{archive}: {total} bytes packed into {os.path.getsize(archive_path)} bytes")
+        shell.finish_batch('pack', args, [item], [])
+    except (OSError, ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        error_msg = f"pack: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"pack {' '.join(args)}", False, error_msg)
+        shell.add_to_history('pack', args, False)
+
+
+def unpack(shell, archive, dest=None):
+    '''
+        Функция команды unpack: потоково распаковывает архив tar, tar.gz или zip в директорию dest.
+        Небезопасные элементы (абсолютные пути, выход через '..', ссылки наружу) отклоняются.
+        Распаковка - одна операция в журнале: undo убирает созданное и возвращает заменённые файлы.
+        При ошибке или отмене задачи уже распакованное откатывается.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. archive (str) - Путь к архиву
+            3. dest (str) - Директория назначения (по умолчанию - текущая)
+
+        Вывод: None
+    '''
+    args = [archive] + ([dest] if dest else [])
+    extractor = None
+    try:
+        archive_path = os.path.join(shell.current_dir, archive)
+        dest_path = os.path.normpath(os.path.join(shell.current_dir, dest or os.curdir))
+        if not os.path.isfile(archive_path):
+            raise FileNotFoundError(f"'{archive}' doesn't exist")
+        if os.path.lexists(dest_path) and not os.path.isdir(dest_path):
+            raise NotADirectoryError(f"'{dest}' is not a directory")
+        extractor = Extractor(dest_path, shell.trash)
+        with shell.trash.batch():
+            try:
+                extractor.extract(archive_path)
+            except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+                raise OSError(f"'{archive}': {e}") from e
+        print(f"{archive}: {sum(item['bytes'] for item in extractor.items)} bytes unpacked")
+        shell.finish_batch('unpack', args, extractor.items, [])
+    except OSError as e:
+        if extractor is not None and extractor.items:
+            try:
+                undo_operation(shell, {'command': 'unpack', 'data': {'items': extractor.items}})
+            except OSError:
+                pass
+            shell.invalidate_listing(*(item['dst_path'] for item in extractor.items))
+        error_msg = f"unpack: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"unpack {' '.join(args)}", False, error_msg)
+        shell.add_to_history('unpack', args, False)
@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Размеры синтетических деревьев: количество файлов в широкой директории, глубина,
+# (директорий x файлов) для дерева мелких файлов, размер больших файлов в МиБ, записей истории
+SIZES = {
+    'small': {'wide': 1000, 'deep': 50, 'small_files': (10, 100), 'huge_mb': 8, 'history': 1000},
+    'medium': {'wide': 10000, 'deep': 200, 'small_files': (50, 200), 'huge_mb': 64, 'history': 10000},
+    'large': {'wide': 100000, 'deep': 500, 'small_files': (200, 500), 'huge_mb': 512, 'history': 100000},
+}
+
+
+def make_wide(root, count):
+    '''Функция которая создаёт широкую директорию из count пустых файлов.'''
+    path = os.path.join(root, 'wide')
+    os.makedirs(path)
+    for i in range(count):
+        open(os.path.join(path, f"file_{i:07d}"), 'w').close()
+    return path
+
+
+def make_deep(root, depth):
+    '''Функция которая создаёт цепочку вложенных директорий глубины depth с одним файлом на уровень.'''
+    path = os.path.join(root, 'deep')
+    current = path
+    for i in range(depth):
+        current = os.path.join(current, f"level_{i}")
+        os.makedirs(current)
+        with open(os.path.join(current, 'file'), 'w') as f:
+            f.write('x' * 100)
+    return path
+
+
+def make_small_files(root, dirs, files):
+    '''Функция которая создаёт дерево из dirs директорий по files мелких файлов.'''
+    path = os.path.join(root, 'small_files')
+    for d in range(dirs):
+        current = os.path.join(path, f"dir_{d}")
+        os.makedirs(current)
+        for i in range(files):
+            with open(os.path.join(current, f"file_{i}"), 'w') as f:
+                f.write(f"{d}:{i}\n" * 16)
+    return path
+
+
+def make_huge(root, size_mb, count=2):
+    '''Функция которая создаёт count больших текстовых файлов по size_mb МиБ.'''
+    path = os.path.join(root, 'huge')
+    os.makedirs(path)
+    line = b"2025-01-01 00:00:00 INFO benchmark line with some payload text\n"
+    block = line * (1024 * 1024 // len(line))
+    for i in range(count):
+        with open(os.path.join(path, f"huge_{i}.log"), 'wb') as f:
+            for _ in range(size_mb):
+                f.write(block)
+    return path
+
+
+def make_history(path, count):
+    '''Функция которая записывает базу истории из count записей одной транзакцией.'''
+    from history_db import HistoryDB
+
+    history = HistoryDB(path)
+    history.begin_batch()
+    for i in range(1, count + 1):
+        history.append({'time': datetime.now().isoformat(), 'command': ('ls', 'cp', 'cat')[i % 3],
+                        'args': [f"file_{i}"], 'status': i % 10 != 0, 'current_dir': '/', 'other_data': {}})
+    history.end_batch()
+    history.close()
+
+
+class Bench:
+    '''Класс который запускает замеры и накапливает результаты.'''
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, size, func, setup=None, teardown=None):
+        '''
+            Функция которая repeat раз выполняет func и сохраняет минимум, медиану и максимум времени.
+
+            Принимает:
+                1. name (str) - Название операции
+                2. size (str) - Размер набора данных
+                3. func (callable) - Замеряемая функция
+                4. setup (callable) - Подготовка перед каждым запуском (не замеряется)
+                5. teardown (callable) - Уборка после каждого запуска (не замеряется)
+        '''
+        times = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - started)
+            if teardown:
+                teardown()
+        result = {'name': name, 'size': size, 'min': min(times), 'median': statistics.median(times),
+                  'max': max(times), 'repeat': self.repeat}
+        self.results.append(result)
+        print(f"{name:<16} {size:<8} min {result['min'] * 1000:10.2f} ms   median {result['median'] * 1000:10.2f} ms",
+              file=sys.stderr)
+
+
+def run_size(bench, size, params, workdir):
+    '''Функция которая создаёт деревья для одного размера и замеряет на них все операции.'''
+    from main import System_Shell
+    from shell_logging import stop_queue_logging
+
+    root = os.path.join(workdir, size)
+    os.makedirs(root)
+    wide = make_wide(root, params['wide'])
+    make_deep(root, params['deep'])
+    small = make_small_files(root, *params['small_files'])
+    huge = make_huge(root, params['huge_mb'])
+    history_path = os.path.join(root, '.history.db')
+    make_history(history_path, params['history'])
+
+    old_cwd = os.getcwd()
+    os.chdir(root)
+    devnull = open(os.devnull, 'w')
+    try:
+        with contextlib.redirect_stdout(devnull):
+            bench.measure('startup', size, lambda: System_Shell().history.close())
+
+            shell = System_Shell()
+            shell.interactive = False
+
+            def load_history():
+                shell.history.close()
+                shell.history = type(shell.history)(history_path)
+                shell.check_history()
+                shell.history.tail(5)
+            bench.measure('history_load', size, load_history)
+            bench.measure('history grep', size, lambda: shell.history.search('file_99', limit=100))
+            bench.measure('history --failed', size, lambda: shell.history.search(failed=True, command='cp', limit=100))
+
+            bench.measure('ls', size, lambda: shell.execute(f"ls {wide}"))
+            bench.measure('ls -l', size, lambda: shell.execute(f"ls -l {wide}"))
+            bench.measure('ls -R', size, lambda: shell.execute("ls -R deep"))
+            # Дополнение по Tab в широкой директории: индекс строится при первом замере, дальше - stat и bisect
+            from completion import CompletionIndex
+            completion = CompletionIndex()
+            bench.measure('complete', size, lambda: completion.complete_path('wide/file_00012', root))
+            bench.measure('cat', size, lambda: shell.execute(f"cat {os.path.join(huge, 'huge_0.log')}"))
+            bench.measure('cat --tail', size, lambda: shell.execute(f"cat --tail=100 {os.path.join(huge, 'huge_0.log')}"))
+
+            copy = os.path.join(root, 'small_copy')
+            bench.measure('cp -r', size, lambda: shell.execute(f"cp -r {small} {copy}"),
+                          teardown=lambda: shutil.rmtree(copy))
+            bench.measure('cp -r huge', size, lambda: shell.execute(f"cp -r {huge} {copy}"),
+                          teardown=lambda: shutil.rmtree(copy))
+
+            archive = os.path.join(root, 'huge.tar.gz')
+            bench.measure('pack tar.gz', size, lambda: shell.execute(f"pack {archive} {huge}"),
+                          teardown=lambda: os.remove(archive))
+            bench.measure('unpack tar.gz', size, lambda: shell.execute(f"unpack {archive} {copy}"),
+                          setup=lambda: shell.execute(f"pack {archive} {huge}"),
+                          teardown=lambda: (shutil.rmtree(copy), os.remove(archive)))
+
+            moved = os.path.join(root, 'moved')
+            bench.measure('mv', size, lambda: shell.execute(f"mv {small} {moved}"),
+                          teardown=lambda: os.rename(moved, small))
+
+            bench.measure('rm -r', size, lambda: shell.execute(f"rm -r {copy}"),
+                          setup=lambda: shutil.copytree(small, copy))
+            bench.measure('undo', size, lambda: shell.execute("undo"),
+                          setup=lambda: shell.execute(f"rm -r {small}"))
+            shell.history.close()
+    finally:
+        os.chdir(old_cwd)
+        devnull.close()
+        stop_queue_logging()
+
+
+def git_commit():
+    '''Функция которая возвращает хэш текущего коммита или None.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_path, new_path, threshold):
+    '''
+        Функция которая сравнивает два файла результатов и выводит отношение медиан.
+
+        Вывод: количество регрессий (операций, ставших медленнее более чем в threshold раз).
+    '''
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    for result in new:
+        old = base.get((result['name'], result['size']))
+        if not old:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else float('inf')
+        mark = ''
+        if ratio > threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+        print(f"{result['name']:<16} {result['size']:<8} {old['median'] * 1000:10.2f} ms -> "
+              f"{result['median'] * 1000:10.2f} ms  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="System_Shell benchmarks on synthetic file trees")
+    parser.add_argument('--sizes', default='small', help="comma separated: " + ','.join(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_results.json', help="where to write JSON results")
+    parser.add_argument('--dir', default=None, help="directory for synthetic trees (default: temp dir)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="compare two result files")
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown ratio reported as regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    bench = Bench(args.repeat)
+    workdir = tempfile.mkdtemp(prefix='shell_bench_', dir=args.dir)
+    try:
+        for size in args.sizes.split(','):
+            run_size(bench, size, SIZES[size], workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'commit': git_commit(), 'timestamp': datetime.now().isoformat(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'results': bench.results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
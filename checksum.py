@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ansi import Colors
+from fileio import write_lines
+
+# Размер блока чтения при подсчёте контрольной суммы и копировании с проверкой
+HASH_BLOCK = 1024 * 1024
+
+
+class ChecksumMismatch(OSError):
+    '''Ошибка проверки копии: контрольные суммы источника и назначения не совпали.'''
+
+
+class HashCache:
+    '''
+        Класс постоянного кэша контрольных сумм файлов.
+
+        Ключ записи - (устройство, inode), запись действительна, пока у файла тот же размер
+        и mtime. Поэтому повторная проверка неизменённого файла не читает его, а переименование
+        на том же устройстве (mv) кэш не сбрасывает. Кэш хранится в JSON файле вместе с
+        названием алгоритма; при смене алгоритма старые записи не используются.
+    '''
+    def __init__(self, path, algorithm='sha256', max_entries=500000):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. path (str) - Путь к файлу кэша
+                2. algorithm (str) - Алгоритм hashlib
+                3. max_entries (int) - Сколько записей хранить (при переполнении удаляются самые старые)
+        '''
+        self.path = os.path.abspath(path)
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.files = None
+        self.changed = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''Функция которая загружает кэш с диска при первом обращении. Повреждённый кэш игнорируется.'''
+        with self._lock:
+            if self.files is not None:
+                return
+            self.files = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get('algorithm') == self.algorithm:
+                    self.files = data.get('files') or {}
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def _key(stat):
+        return f"{stat.st_dev}:{stat.st_ino}"
+
+    def get(self, stat):
+        '''Функция которая возвращает контрольную сумму файла по его stat или None, если записи нет или она устарела.'''
+        self.load()
+        record = self.files.get(self._key(stat))
+        if record and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return record[2]
+        return None
+
+    def put(self, stat, digest):
+        self.load()
+        with self._lock:
+            key = self._key(stat)
+            # Перезаписанная запись переносится в конец, чтобы при переполнении удалялись самые старые
+            self.files.pop(key, None)
+            self.files[key] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.changed = True
+
+    def save(self):
+        '''Функция которая атомарно записывает кэш на диск, если он изменился.'''
+        with self._lock:
+            if not self.changed:
+                return
+            if len(self.files) > self.max_entries:
+                for key in list(self.files)[:len(self.files) - self.max_entries]:
+                    del self.files[key]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'algorithm': self.algorithm, 'files': self.files}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+def open_cache(shell):
+    '''Функция которая возвращает кэш контрольных сумм shell, создавая его при первом обращении.'''
+    if shell.hash_cache is None:
+        from config import VERIFY_CONFIG
+        shell.hash_cache = HashCache(VERIFY_CONFIG['cache_file'], VERIFY_CONFIG['algorithm'],
+                                     VERIFY_CONFIG['max_entries'])
+    return shell.hash_cache
+
+
+def drop_page_cache(fd):
+    '''
+        Функция которая сбрасывает файл на диск и убирает его страницы из кэша ОС,
+        чтобы следующее чтение проверяло данные на диске, а не в памяти. Ошибки игнорируются.
+    '''
+    try:
+        os.fsync(fd)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def hash_file(path, cache, refresh=False):
+    '''
+        Функция которая возвращает контрольную сумму файла.
+
+        Принимает:
+            1. path (str) - Путь к файлу
+            2. cache (HashCache) - Кэш (задаёт алгоритм); неизменённый файл не читается
+            3. refresh (bool) - Прочитать файл, даже если сумма есть в кэше
+
+        Вывод: контрольная сумма (str, hex).
+    '''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        stat = os.fstat(fd)
+        digest = None if refresh else cache.get(stat)
+        if digest is None:
+            hasher = hashlib.new(cache.algorithm)
+            while True:
+                block = os.read(fd, HASH_BLOCK)
+                if not block:
+                    break
+                hasher.update(block)
+            digest = hasher.hexdigest()
+            cache.put(stat, digest)
+    finally:
+        os.close(fd)
+    return digest
+
+
+def copy_file_hashed(src, dst, cache, size=None):
+    '''
+        Функция которая копирует файл, считая контрольную сумму по ходу копирования: каждый блок
+        читается один раз, хэшируется и записывается целиком (короткая запись дописывается).
+        Записанные байты - это ровно хэшированные байты, поэтому сумма служит и суммой копии:
+        она попадает в кэш и для источника, и для копии, и проверка копию не перечитывает.
+        Копия сбрасывается на диск (fsync), чтобы ошибки записи проявились здесь.
+
+        Принимает:
+            1. src (str) - Путь к исходному файлу
+            2. dst (str) - Путь к целевому файлу
+            3. cache (HashCache) - Кэш, в который записывается сумма источника
+            4. size (int) - Размер исходного файла, если уже известен
+
+        Вывод: кортеж (количество скопированных байт, контрольная сумма скопированных данных).
+    '''
+    from copy_engine import preallocate
+    hasher = hashlib.new(cache.algorithm)
+    copied = 0
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        stat = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            preallocate(dst_fd, stat.st_size if size is None else size)
+            while True:
+                block = os.read(src_fd, HASH_BLOCK)
+                if not block:
+                    break
+                hasher.update(block)
+                view = memoryview(block)
+                while view:
+                    view = view[os.write(dst_fd, view):]
+                copied += len(block)
+            os.ftruncate(dst_fd, copied)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    digest = hasher.hexdigest()
+    if copied == stat.st_size:
+        cache.put(stat, digest)
+    shutil.copystat(src, dst)
+    cache.put(os.stat(dst), digest)
+    return copied, digest
+
+
+def verify_copy(src, dst, cache, src_digest=None):
+    '''
+        Функция которая проверяет, что копия совпадает с источником.
+        Копия, сделанная copy_file_hashed (src_digest передан), не перечитывается: её сумма уже в кэше,
+        а изменение копии или источника после копирования видно по их stat (запись кэша устаревает,
+        и файл читается заново). Копия, сделанная без хэширования (reflink, ядро), читается заново:
+        её inode мог достаться от удалённого файла с той же записью в кэше.
+        Жёсткая ссылка на тот же inode не читается.
+
+        Принимает:
+            1. src (str) - Исходный файл
+            2. dst (str) - Копия
+            3. cache (HashCache) - Кэш контрольных сумм
+            4. src_digest (str) - Сумма, посчитанная copy_file_hashed при копировании
+
+        Вывод: контрольная сумма (str). При несовпадении - ChecksumMismatch.
+    '''
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return src_digest or hash_file(src, cache)
+    if src_digest is not None:
+        hashed_while_copying = True
+        if hash_file(src, cache) != src_digest:
+            raise ChecksumMismatch(f"checksum mismatch: '{src}' changed while it was copied to '{dst}'")
+    else:
+        hashed_while_copying = False
+        src_digest = hash_file(src, cache)
+    dst_digest = hash_file(dst, cache, refresh=not hashed_while_copying)
+    if src_digest != dst_digest:
+        raise ChecksumMismatch(f"checksum mismatch: '{src}' -> '{dst}'")
+    return dst_digest
+
+
+def iter_pairs(src, dst):
+    '''Функция которая перебирает пары (файл источника, файл назначения) двух деревьев (или двух файлов).'''
+    if not os.path.isdir(src):
+        yield src, dst
+        return
+    stack = [(src, dst)]
+    while stack:
+        src_dir, dst_dir = stack.pop()
+        with os.scandir(src_dir) as it:
+            for entry in it:
+                target = os.path.join(dst_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, target))
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, target
+
+
+def compare_trees(src, dst, cache, jobs=None):
+    '''
+        Функция которая сравнивает контрольные суммы файлов двух деревьев пулом потоков.
+        Обе стороны берутся из кэша, поэтому повторная проверка неизменённых файлов их не читает.
+
+        Принимает:
+            1. src (str) - Исходный файл или директория
+            2. dst (str) - Копия
+            3. cache (HashCache) - Кэш контрольных сумм
+            4. jobs (int) - Количество потоков
+
+        Вывод: кортеж (количество проверенных файлов, список различий и ошибок (str)).
+        Ошибка чтения одного файла (нет прав и т.п.) попадает в список, а не прерывает проверку.
+    '''
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+
+    def check(src_file, dst_file):
+        rel = os.path.relpath(dst_file, dst) if dst_file != dst else dst
+        try:
+            if hash_file(src_file, cache) != hash_file(dst_file, cache):
+                return f"differs: {rel}"
+        except FileNotFoundError as e:
+            return f"missing: {rel}" if e.filename == dst_file else f"error: {rel}: {e.strerror or e}"
+        except OSError as e:
+            return f"error: {rel}: {e.strerror or e}"
+        return None
+
+    files, differences = 0, []
+    # Как в grep: в работе не больше jobs * 4 файлов, чтобы не держать Future на каждый файл дерева
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        for pair in iter_pairs(src, dst):
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                differences.extend(future.result() for future in done)
+            pending.add(pool.submit(check, *pair))
+            files += 1
+        differences.extend(future.result() for future in wait(pending).done)
+    return files, sorted(result for result in differences if result)
+
+
+def verify(shell, src, dst, jobs=None):
+    '''
+        Функция команды verify: сравнивает контрольные суммы файла или дерева src с копией dst.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. src (str) - Исходный файл или директория
+            3. dst (str) - Копия
+            4. jobs (int) - Количество потоков (--jobs N)
+
+        Вывод: None
+    '''
+    args = ([f"--jobs={jobs}"] if jobs else []) + [src, dst]
+    try:
+        src_path = os.path.join(shell.current_dir, src)
+        dst_path = os.path.join(shell.current_dir, dst)
+        for path, name in ((src_path, src), (dst_path, dst)):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"'{name}' doesn't exist")
+        cache = open_cache(shell)
+        files, differences = compare_trees(src_path, dst_path, cache, jobs)
+        shell.save_hash_cache(cache)
+        write_lines(differences)
+        if differences:
+            raise ChecksumMismatch(f"{len(differences)} of {files} files differ")
+        print(f"{Colors.GREEN}{files} files match ({cache.algorithm}){Colors.RESET}")
+        shell.add_log(f"verify {' '.join(args)}")
+        shell.add_to_history('verify', args, other_data={'files': files})
+    except OSError as e:
+        error_msg = f"verify: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"verify {' '.join(args)}", False, error_msg)
+        shell.add_to_history('verify', args, False)
@@ -0,0 +1,396 @@
+import glob
+import importlib
+import os
+from datetime import datetime, timedelta
+from fileio import parse_range
+
+
+class UsageError(ValueError):
+    '''Ошибка разбора аргументов команды.'''
+
+
+# Операторы строки команды: конвейер и перенаправление вывода
+OPERATORS = ('|', '>>', '>')
+
+
+class Quoted(str):
+    '''Слово строки команды, записанное (целиком или частично) в кавычках: шаблоны в нём не раскрываются.'''
+
+
+def iter_tokens(line):
+    '''
+        Функция которая разбивает строку команды на слова и операторы |, > и >>.
+        Текст в одинарных или двойных кавычках входит в слово как есть (кавычки убираются),
+        поэтому | и > в кавычках - обычные символы. Обратная косая черта не экранирует:
+        регулярные выражения grep (\\s, \\d) пишутся без кавычек.
+
+        Принимает:
+            1. line (str) - Строка команды
+
+        Вывод: генератор кортежей (слово, оператор ли, начало, конец) - позиции в line.
+        Незакрытая кавычка - UsageError.
+    '''
+    i, length = 0, len(line)
+    while i < length:
+        char = line[i]
+        if char.isspace():
+            i += 1
+            continue
+        if char in '|>':
+            operator = '>>' if line.startswith('>>', i) else char
+            yield operator, True, i, i + len(operator)
+            i += len(operator)
+            continue
+        start, parts, quoted = i, [], False
+        while i < length and not line[i].isspace() and line[i] not in '|>':
+            if line[i] in '\'"':
+                end = line.find(line[i], i + 1)
+                if end < 0:
+                    raise UsageError(f"unterminated quote {line[i]}")
+                parts.append(line[i + 1:end])
+                quoted = True
+                i = end + 1
+            else:
+                parts.append(line[i])
+                i += 1
+        word = ''.join(parts)
+        yield Quoted(word) if quoted else word, False, start, i
+
+
+def positive_int(value):
+    '''Функция-конвертер для опций вида --jobs N: целое число больше нуля.'''
+    if not value.isdigit() or int(value) <= 0:
+        raise UsageError(f"invalid number: '{value}'")
+    return int(value)
+
+
+def count(value):
+    '''Функция-конвертер для неотрицательного количества (строк, команд).'''
+    if not value.isdigit():
+        raise UsageError(f"invalid count: '{value}'")
+    return int(value)
+
+
+def compress_level(value):
+    '''Функция-конвертер для --level N: уровень сжатия от 1 до 9.'''
+    if not value.isdigit() or not 1 <= int(value) <= 9:
+        raise UsageError(f"invalid compression level: '{value}' (expected 1-9)")
+    return int(value)
+
+
+def file_range(value):
+    '''Функция-конвертер для диапазонов --bytes / --lines.'''
+    try:
+        return parse_range(value)
+    except ValueError as e:
+        raise UsageError(str(e))
+
+
+def line_range(value):
+    '''Функция-конвертер для --lines: диапазон строк, нумерация с 1.'''
+    start, end = file_range(value)
+    if start == 0:
+        raise UsageError(f"invalid range '{value}': lines are numbered from 1")
+    return start, end
+
+
+def head_range(value):
+    '''Функция-конвертер для --head=N: первые N строк.'''
+    return (1, count(value))
+
+
+def tail_range(value):
+    '''Функция-конвертер для --tail=N: последние N строк.'''
+    n = count(value)
+    return (-n, None) if n else (1, 0)
+
+
+SIZE_UNITS = {'c': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def _condition(value, units=None):
+    sign = value[:1] if value[:1] in '+-' else '='
+    number = value.lstrip('+-')
+    unit = 1
+    if units and number[-1:] in units:
+        number, unit = number[:-1], units[number[-1]]
+    if not number.isdigit():
+        raise UsageError(f"invalid value: '{value}'")
+    return sign, int(number) * unit
+
+
+def size_condition(value):
+    '''Функция-конвертер для --size: [+|-]N[c|k|M|G], '+' - больше, '-' - меньше N.'''
+    return _condition(value, SIZE_UNITS)
+
+
+def age_condition(value):
+    '''Функция-конвертер для --mtime: [+|-]N дней, '+' - старше, '-' - новее N дней.'''
+    return _condition(value)
+
+
+def since_time(value):
+    '''
+        Функция-конвертер для history --since / --until: время ISO (2025-01-01, 2025-01-01T12:00)
+        или возраст Ns / Nm / Nh / Nd назад от текущего момента.
+
+        Вывод: время в формате ISO (str).
+    '''
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[:-1].isdigit() and value[-1] in units:
+        return (datetime.now() - timedelta(seconds=int(value[:-1]) * units[value[-1]])).isoformat()
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise UsageError(f"invalid time: '{value}'")
+
+
+def job_spec(value):
+    '''Функция-конвертер для номера фоновой задачи: %N или N.'''
+    number = value[1:] if value.startswith('%') else value
+    if not number.isdigit() or not int(number):
+        raise UsageError(f"invalid job: '{value}' (expected %N)")
+    return int(number)
+
+
+def reflink_mode(value):
+    '''Функция-конвертер для cp --reflink=auto|always.'''
+    if value not in ('auto', 'always'):
+        raise UsageError(f"invalid reflink mode: '{value}' (expected auto or always)")
+    return value
+
+
+def export_format(value):
+    '''Функция-конвертер для stats --format: prom или json.'''
+    if value not in ('prom', 'json'):
+        raise UsageError(f"invalid format: '{value}' (expected prom or json)")
+    return value
+
+
+def file_type(value):
+    '''Функция-конвертер для --type: f (файл), d (директория) или l (ссылка).'''
+    if value not in ('f', 'd', 'l'):
+        raise UsageError(f"invalid type: '{value}'")
+    return value
+
+
+def expand_globs(args, cwd):
+    '''
+        Функция которая раскрывает шаблоны (*, ?, [..], ** - рекурсивно) в аргументах.
+        Совпадения сортируются; скрытые файлы шаблонами не выбираются. Если шаблону ничего
+        не соответствует, он остаётся как есть (как в bash), и команда сообщит об ошибке.
+
+        Принимает:
+            1. args (list) - Аргументы
+            2. cwd (str) - Директория, относительно которой раскрываются относительные шаблоны
+
+        Вывод: список аргументов (list).
+    '''
+    result = []
+    for arg in args:
+        if isinstance(arg, Quoted) or not glob.has_magic(arg):
+            result.append(arg)
+            continue
+        matches = sorted(glob.glob(arg, root_dir=None if os.path.isabs(arg) else cwd, recursive=True))
+        result.extend(matches or [arg])
+    return result
+
+
+class Command:
+    '''
+        Класс описания команды shell.
+
+        Команда один раз объявляет свои флаги, опции и количество аргументов, а разбор
+        строки для всех команд выполняется одним методом parse. Обработчик указывается строкой
+        и импортируется только при первом вызове команды.
+    '''
+    def __init__(self, name, target, nargs=(0, 0), flags=None, options=None, arg_types=(), validate=None,
+                 glob=False):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. name (str) - Имя команды
+                2. target (str) - Обработчик: "method" - метод System_Shell,
+                   "module:function" - функция function(shell, *args, **kwargs) из модуля
+                3. nargs (tuple) - Минимальное и максимальное количество аргументов (None - без ограничения)
+                4. flags (dict) - Короткие флаги: {'r': 'flag_r'} или {'S': ('sort_by', 'size')}
+                5. options (dict) - Опции со значением: {'jobs': ('jobs', positive_int, 'j')},
+                   третий элемент - необязательный короткий синоним. Если конвертер None,
+                   опция не принимает значения и выставляет True (--no-cache)
+                6. arg_types (tuple) - Конвертеры позиционных аргументов по порядку
+                7. validate (callable) - Дополнительная проверка разобранных kwargs
+            8. glob (bool) - Раскрывать шаблоны в позиционных аргументах
+        '''
+        self.name = name
+        self.target = target
+        self.nargs = nargs
+        self.flags = {}
+        for char, spec in (flags or {}).items():
+            self.flags[char] = spec if isinstance(spec, tuple) else (spec, True)
+        self.options = options or {}
+        self.short_options = {spec[2]: name for name, spec in self.options.items() if len(spec) > 2}
+        self.arg_types = arg_types
+        self.validate = validate
+        self.glob = glob
+        self._handler = None
+
+    def parse(self, argv, cwd=None):
+        '''
+            Функция которая разбирает аргументы команды. Поддерживает группы флагов (-rf),
+            опции --name=value, --name value, -j 4, -j4 и "--" как конец опций.
+
+            Принимает:
+                1. argv (list) - Аргументы команды (без её имени)
+                2. cwd (str) - Текущая директория для раскрытия шаблонов (None - не раскрывать)
+
+            Вывод: кортеж (args, kwargs). При ошибке - UsageError.
+        '''
+        args, kwargs = [], {}
+        rest = iter(argv)
+        only_args = False
+        for arg in rest:
+            if only_args or arg == '-' or not arg.startswith('-'):
+                args.append(arg)
+            elif arg == '--':
+                only_args = True
+            elif arg.startswith('--'):
+                name, sep, value = arg[2:].partition('=')
+                if name not in self.options:
+                    raise UsageError(f"unknown option '--{name}'")
+                kwarg, convert = self.options[name][:2]
+                if convert is None:
+                    if sep:
+                        raise UsageError(f"option '--{name}' doesn't take a value")
+                    kwargs[kwarg] = True
+                    continue
+                if not sep:
+                    value = next(rest, None)
+                    if value is None:
+                        raise UsageError(f"option '--{name}' requires a value")
+                kwargs[kwarg] = convert(value)
+            else:
+                cluster = arg[1:]
+                for i, char in enumerate(cluster):
+                    if char in self.flags:
+                        kwarg, value = self.flags[char]
+                        kwargs[kwarg] = value
+                    elif char in self.short_options:
+                        name = self.short_options[char]
+                        value = cluster[i + 1:] or next(rest, None)
+                        if value is None:
+                            raise UsageError(f"option '-{char}' requires a value")
+                        kwarg, convert = self.options[name][:2]
+                        kwargs[kwarg] = convert(value)
+                        break
+                    else:
+                        raise UsageError(f"unknown flag '-{char}'")
+
+        if self.glob and cwd is not None:
+            args = expand_globs(args, cwd)
+
+        low, high = self.nargs
+        if len(args) < low:
+            raise UsageError("not enouth arguments")
+        if high is not None and len(args) > high:
+            raise UsageError("too many arguments")
+        for i, convert in enumerate(self.arg_types[:len(args)]):
+            args[i] = convert(args[i])
+        if self.validate:
+            self.validate(kwargs)
+        return args, kwargs
+
+    def resolve(self, shell):
+        '''
+            Функция которая находит обработчик команды. Модуль обработчика импортируется
+            при первом вызове и затем кэшируется.
+
+            Вывод: вызываемый объект, принимающий (*args, **kwargs).
+        '''
+        if ':' not in self.target:
+            return getattr(shell, self.target)
+        if self._handler is None:
+            module, _, attr = self.target.partition(':')
+            self._handler = getattr(importlib.import_module(module), attr)
+        return lambda *args, **kwargs: self._handler(shell, *args, **kwargs)
+
+
+COMMANDS = {}
+
+
+def register(name, target=None, **kwargs):
+    '''
+        Функция которая регистрирует команду в таблице команд.
+
+        Принимает:
+            1. name (str) - Имя команды
+            2. target (str) - Обработчик (по умолчанию - метод System_Shell с тем же именем)
+            3. kwargs - Остальные параметры Command
+
+        Вывод: объект Command.
+    '''
+    command = Command(name, target or name, **kwargs)
+    COMMANDS[name] = command
+    return command
+
+
+def get_command(name):
+    '''Функция которая возвращает описание команды по имени или None.'''
+    return COMMANDS.get(name)
+
+
+def _check_cat(kwargs):
+    if kwargs.get('byte_range') and kwargs.get('line_range'):
+        raise UsageError("--bytes and --lines can't be used together")
+
+
+def _check_cp(kwargs):
+    if kwargs.get('reflink') and kwargs.get('link'):
+        raise UsageError("--reflink and --link can't be used together")
+
+
+register('ls', nargs=(0, 1),
+         flags={'l': 'flag_l', 'a': 'flag_a', 'R': 'flag_R',
+                'S': ('sort_by', 'size'), 't': ('sort_by', 'time'), 'U': ('sort_by', None)})
+register('cd', nargs=(1, 1))
+register('cat', nargs=(0, 1),
+         options={'bytes': ('byte_range', file_range), 'lines': ('line_range', line_range),
+                  'head': ('line_range', head_range), 'tail': ('line_range', tail_range)},
+         validate=_check_cat)
+register('cp', nargs=(2, None), flags={'r': 'flag_r', 'l': 'link', 'u': 'update'},
+         options={'jobs': ('jobs', positive_int, 'j'), 'reflink': ('reflink', reflink_mode), 'link': ('link', None),
+                  'verify': ('verify', None), 'update': ('update', None)},
+         validate=_check_cp, glob=True)
+register('mv', nargs=(2, None), options={'jobs': ('jobs', positive_int, 'j'), 'verify': ('verify', None)}, glob=True)
+register('rm', nargs=(1, None), flags={'r': 'flag_r', 'f': 'flag_f'}, options={'jobs': ('jobs', positive_int, 'j')},
+         glob=True)
+register('find', 'search:find', nargs=(0, 1),
+         options={'name': ('name', str), 'type': ('file_type', file_type),
+                  'size': ('size', size_condition), 'mtime': ('mtime', age_condition)})
+register('grep', 'search:grep', nargs=(1, 2),
+         flags={'i': 'flag_i', 'n': 'flag_n', 'l': 'flag_l', 'r': 'flag_r'},
+         options={'include': ('include', str), 'jobs': ('jobs', positive_int, 'j')})
+register('du', 'disk_usage:du', nargs=(0, 1),
+         flags={'h': 'flag_h', 'b': 'flag_b', 's': 'flag_s', 'S': ('sort_by', 'size')},
+         options={'max-depth': ('max_depth', count, 'd'), 'jobs': ('jobs', positive_int, 'j'),
+                  'no-cache': ('no_cache', None)})
+register('verify', 'checksum:verify', nargs=(2, 2), options={'jobs': ('jobs', positive_int, 'j')})
+register('sync', 'sync_engine:sync', nargs=(2, 2), flags={'c': 'checksum', 'n': 'dry_run'},
+         options={'delete': ('delete', None), 'checksum': ('checksum', None), 'dry-run': ('dry_run', None),
+                  'jobs': ('jobs', positive_int, 'j')})
+register('pack', 'archive:pack', nargs=(2, None),
+         options={'level': ('level', compress_level), 'jobs': ('jobs', positive_int, 'j')}, glob=True)
+register('unpack', 'archive:unpack', nargs=(1, 2))
+register('stats', 'metrics:stats',
+         options={'export': ('export', str), 'format': ('fmt', export_format), 'reset': ('reset', None)})
+# head [N] [FILE]: первый аргумент - количество, если это число, иначе файл (разбирает сам обработчик)
+register('head', 'pipeline:head', nargs=(0, 2))
+register('jobs', 'jobs:jobs')
+register('wait', 'jobs:wait', nargs=(0, 1), arg_types=(job_spec,))
+register('fg', 'jobs:fg', nargs=(0, 1), arg_types=(job_spec,))
+register('kill', 'jobs:kill', nargs=(1, 1), arg_types=(job_spec,))
+register('history', 'show_history', nargs=(0, 3),
+         options={'since': ('since', since_time), 'until': ('until', since_time), 'failed': ('failed', None),
+                  'command': ('command', str), 'dir': ('directory', str)})
+register('undo', nargs=(0, 1), arg_types=(count,), options={'to': ('to_id', positive_int)})
+register('redo', nargs=(0, 1), arg_types=(count,))
@@ -0,0 +1,197 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from commands import COMMANDS
+
+# Слова, которые shell понимает помимо таблицы команд
+EXTRA_COMMANDS = ('exit',)
+# Разделители слов для readline: '/' и '.' входят в слово, чтобы дополнялся путь целиком
+COMPLETER_DELIMS = ' \t\n|>&;'
+# Верхняя граница для диапазона имён с общим префиксом в отсортированном списке
+_MAX_CHAR = '\U0010ffff'
+
+
+class PrefixIndex:
+    '''
+        Класс индекса имён одной директории: отсортированный список имён, в котором
+        имена с заданным префиксом находятся двоичным поиском (O(log n + k)), без чтения директории.
+    '''
+    def __init__(self, path):
+        '''
+            Функция инициализатор: читает директорию одним проходом scandir.
+
+            Принимает:
+                1. path (str) - Путь к директории
+        '''
+        stat = os.stat(path)
+        self.version = (stat.st_mtime_ns, stat.st_ino)
+        names, dirs = [], set()
+        with os.scandir(path) as it:
+            for entry in it:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        dirs.add(entry.name)
+                except OSError:
+                    pass
+        names.sort()
+        self.names = names
+        self.dirs = dirs
+
+    def matches(self, prefix, hidden=None):
+        '''
+            Функция которая возвращает имена, начинающиеся с prefix (по возрастанию).
+
+            Принимает:
+                1. prefix (str) - Префикс имени
+                2. hidden (bool) - Включать ли скрытые имена (по умолчанию - только если префикс начинается с '.')
+
+            Вывод: список имён (str); к директориям добавлен '/'.
+        '''
+        if hidden is None:
+            hidden = prefix.startswith('.')
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_left(self.names, prefix + _MAX_CHAR, lo)
+        return [name + os.sep if name in self.dirs else name
+                for name in self.names[lo:hi] if hidden or not name.startswith('.')]
+
+
+class CompletionIndex:
+    '''
+        Класс кэша индексов имён для дополнения путей.
+
+        Индекс директории строится один раз и используется, пока у директории те же mtime и inode
+        (создание, удаление и переименование элементов меняют mtime). Поэтому нажатие Tab в
+        директории с десятками тысяч элементов стоит один stat и двоичный поиск.
+        Хранятся индексы max_dirs последних директорий (LRU).
+    '''
+    def __init__(self, max_dirs=64):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. max_dirs (int) - Сколько индексов директорий хранить
+        '''
+        self.max_dirs = max_dirs
+        self.dirs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        '''Функция которая возвращает индекс директории, перестраивая его, если директория изменилась.'''
+        path = os.path.abspath(path)
+        with self._lock:
+            index = self.dirs.get(path)
+            if index is not None:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_ino) == index.version:
+                    self.dirs.move_to_end(path)
+                    self.hits += 1
+                    return index
+            self.misses += 1
+            index = PrefixIndex(path)
+            self.dirs[path] = index
+            self.dirs.move_to_end(path)
+            while len(self.dirs) > self.max_dirs:
+                self.dirs.popitem(last=False)
+            return index
+
+    def complete_path(self, text, cwd):
+        '''
+            Функция которая дополняет путь.
+
+            Принимает:
+                1. text (str) - Начало пути (относительный, абсолютный или с ~)
+                2. cwd (str) - Текущая директория shell
+
+            Вывод: список вариантов (str) в том виде, в котором их надо подставить в строку.
+        '''
+        head, prefix = os.path.split(text)
+        directory = os.path.join(cwd, os.path.expanduser(head)) if head else cwd
+        try:
+            index = self.get(directory)
+        except OSError:
+            return []
+        return [os.path.join(head, name) if head else name for name in index.matches(prefix)]
+
+
+def complete_command(text):
+    '''Функция которая дополняет имя команды. Вывод: список имён (str).'''
+    names = sorted(set(COMMANDS) | set(EXTRA_COMMANDS))
+    return [name + ' ' for name in names if name.startswith(text)]
+
+
+def complete_option(command, text):
+    '''Функция которая дополняет длинную опцию команды (--name). Вывод: список вариантов (str).'''
+    spec = COMMANDS.get(command)
+    if spec is None:
+        return []
+    options = []
+    for name, option in sorted(spec.options.items()):
+        # Опция без значения подставляется с пробелом, со значением - с '='
+        options.append(f"--{name} " if option[1] is None else f"--{name}=")
+    return [option for option in options if option.startswith(text)]
+
+
+class Completer:
+    '''
+        Класс функции дополнения для readline: первое слово строки (и первое после '|') -
+        имя команды, слово с '--' - опция команды, остальные - пути относительно текущей директории shell.
+    '''
+    def __init__(self, shell, index=None):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. shell (System_Shell) - Shell (нужна текущая директория)
+                2. index (CompletionIndex) - Кэш индексов директорий
+        '''
+        self.shell = shell
+        self.index = index or CompletionIndex()
+        self.matches = []
+
+    def candidates(self, line, begidx, text):
+        '''
+            Функция которая возвращает варианты дополнения слова text, начинающегося в line с позиции begidx.
+        '''
+        before = line[:begidx]
+        stage = before.rsplit('|', 1)[-1]
+        words = stage.split()
+        if not words:
+            return complete_command(text)
+        if text.startswith('--'):
+            return complete_option(words[0], text)
+        return self.index.complete_path(text, self.shell.current_dir)
+
+    def complete(self, text, state):
+        '''Функция дополнения в формате readline: возвращает state-й вариант или None.'''
+        if state == 0:
+            import readline
+            try:
+                self.matches = self.candidates(readline.get_line_buffer(), readline.get_begidx(), text)
+            except Exception:
+                # Ошибка внутри функции дополнения readline молча проглатывает - дополнения просто не будет
+                self.matches = []
+        return self.matches[state] if state < len(self.matches) else None
+
+
+def setup_completion(shell, readline):
+    '''
+        Функция которая подключает дополнение по Tab к readline.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. readline - Модуль readline
+
+        Вывод: функция дополнения (Completer).
+    '''
+    completer = Completer(shell)
+    readline.set_completer(completer.complete)
+    readline.set_completer_delims(COMPLETER_DELIMS)
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+    return completer
@@ -11,15 +11,23 @@ LOGGING_CONFIG = {
                 },
                 'simple': {
                     'format': '%(asctime)s - %(levelname)s - %(message)s'
+                },
+                # Структурированный формат: одна строка JSON на команду (время выполнения, байты)
+                'json': {
+                    '()': 'shell_logging.JsonLinesFormatter'
                 }
             },
             
             'handlers': {
+                # Ротация по размеру. Для ротации по времени: 'class': 'shell_logging.TimeRotatingFileHandler',
+                # 'when': 'midnight', 'backupCount': 7 (без maxBytes и mode)
                 'file': {
-                    'class': 'logging.handlers.RotatingFileHandler',
+                    'class': 'shell_logging.SizeRotatingFileHandler',
                     'filename': 'shell.log',
                     'encoding': 'utf-8',
                     'mode': 'a',
+                    'maxBytes': 10 * 1024 * 1024,
+                    'backupCount': 5,
                     'formatter': 'detailed',
                     'level': 'INFO'
                 }
@@ -33,4 +41,86 @@ LOGGING_CONFIG = {
                 }
             },
             
-        }
\ No newline at end of file
+        }
+
+# Настройки истории команд: база SQLite, старый журнал для однократного импорта,
+# режим синхронизации и сколько последних команд загружать в readline для reverse-i-search (Ctrl-R)
+HISTORY_CONFIG = {
+    'db_file': '.history.db',
+    'legacy_file': '.history',
+    'synchronous': 'NORMAL',
+    'readline_size': 1000,
+}
+
+# Настройки корзины (.trash): возраст записей и квота на размер для фоновой очистки
+TRASH_CONFIG = {
+    'max_age': 7 * 24 * 3600,
+    'max_size': 1024 ** 3,
+    'purge_interval': 60.0,
+}
+
+# Настройки журнала операций (.operations) для undo / redo
+OPERATIONS_CONFIG = {
+    'max_ops': 1000,
+}
+
+# Настройки кэша содержимого директорий для ls: суммарное число элементов и использование inotify
+LISTING_CACHE_CONFIG = {
+    'max_entries': 200000,
+    'use_inotify': True,
+}
+
+# Настройки du: файл постоянного кэша размеров директорий
+DU_CONFIG = {
+    'cache_file': '.du_cache.json',
+}
+
+# Настройки метрик команд: число хранимых замеров на команду и автоматическая выгрузка
+# (export_path - файл .prom или .json, None - только команда stats)
+METRICS_CONFIG = {
+    'samples': 1024,
+    'export_path': None,
+    'export_interval': 10.0,
+}
+
+# Настройки фоновых задач (команда &): сколько задач выполняется одновременно
+# и сколько последних строк вывода каждой задачи хранится до fg / wait
+JOBS_CONFIG = {
+    'max_jobs': 4,
+    'output_lines': 1000,
+}
+
+# Настройки проверки копий (cp / mv --verify, verify): алгоритм hashlib и постоянный кэш
+# контрольных сумм по (устройство, inode, размер, mtime)
+VERIFY_CONFIG = {
+    'algorithm': 'sha256',
+    'cache_file': '.hash_cache.json',
+    'max_entries': 500000,
+}
+
+# Настройки синхронизации (sync, cp --update): имя манифеста в корне директории назначения
+SYNC_CONFIG = {
+    'manifest': '.sync_manifest.json',
+}
+
+# Настройки режима сервера (main.py --serve): адрес (unix:/path или host:port), сколько команд
+# сеансов выполняется одновременно, директория состояний сеансов, предел числа сеансов и файл
+# токена для TCP. Unix сокет создаётся с правами 0600; по TCP может подключиться любой локальный
+# пользователь, поэтому первая строка соединения должна быть "auth TOKEN" с токеном из token_file,
+# отправленная не позже чем через auth_timeout секунд
+SERVER_CONFIG = {
+    'address': 'unix:.shell.sock',
+    'workers': 32,
+    'sessions_dir': '.sessions',
+    'max_sessions': 256,
+    'token_file': '.server_token',
+    'auth_timeout': 10.0,
+}
+
+# Настройки pack / unpack: уровень сжатия по умолчанию, число потоков сжатия tar.gz
+# (None - по числу ядер) и размер блока, который сжимается одним членом gzip
+ARCHIVE_CONFIG = {
+    'level': 6,
+    'jobs': None,
+    'block_size': 1024 * 1024,
+}
@@ -0,0 +1,422 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fileio import current_console
+from jobs import current_job, check_cancelled
+from checksum import ChecksumMismatch, copy_file_hashed, verify_copy
+
+# Размер порции для копирования внутри ядра (copy_file_range / sendfile)
+COPY_CHUNK = 64 * 1024 * 1024
+
+# ioctl FICLONE (linux/fs.h): клонирование файла на файловых системах с copy-on-write (btrfs, xfs)
+FICLONE = 0x40049409
+
+# Режимы cp: обычное копирование, --reflink=auto, --reflink=always, --link
+COPY_MODES = ('copy', 'auto', 'always', 'link')
+
+
+def copy_file_data(src_fd, dst_fd, size):
+    '''
+        Функция которая копирует данные между файловыми дескрипторами внутри ядра.
+        Сначала пробует os.copy_file_range, затем os.sendfile, затем обычное чтение/запись.
+
+        Принимает:
+            1. src_fd (int) - Дескриптор исходного файла
+            2. dst_fd (int) - Дескриптор целевого файла
+            3. size (int) - Размер исходного файла
+
+        Вывод: количество скопированных байт (int).
+    '''
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        func = getattr(os, method, None)
+        if func is None:
+            continue
+        try:
+            while True:
+                if method == 'copy_file_range':
+                    n = func(src_fd, dst_fd, COPY_CHUNK)
+                else:
+                    n = func(dst_fd, src_fd, copied, COPY_CHUNK)
+                if not n:
+                    return copied
+                copied += n
+        except OSError as e:
+            # Файловая система или ядро не поддерживают метод - пробуем следующий, если ещё ничего не скопировано
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                         errno.ENOTSUP, errno.EBADF, errno.EPERM):
+                raise
+
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    while True:
+        block = os.read(src_fd, 1024 * 1024)
+        if not block:
+            return copied
+        os.write(dst_fd, block)
+        copied += len(block)
+
+
+def preallocate(fd, size):
+    '''Функция которая заранее выделяет место под файл, чтобы уменьшить фрагментацию. Ошибки игнорируются.'''
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+
+def copy_file(src, dst, size=None):
+    '''
+        Функция которая копирует один файл вместе с правами и временем изменения.
+
+        Принимает:
+            1. src (str) - Путь к исходному файлу
+            2. dst (str) - Путь к целевому файлу
+            3. size (int) - Размер исходного файла, если уже известен
+
+        Вывод: количество скопированных байт (int).
+    '''
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        if size is None:
+            size = os.fstat(src_fd).st_size
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            preallocate(dst_fd, size)
+            copied = copy_file_data(src_fd, dst_fd, size)
+            # posix_fallocate мог выделить больше, чем скопировано (файл изменился во время копирования)
+            if copied != size:
+                os.ftruncate(dst_fd, copied)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return copied
+
+
+def reflink(src_fd, dst_fd):
+    '''
+        Функция которая клонирует содержимое файла через ioctl FICLONE: данные не копируются,
+        оба файла ссылаются на одни и те же блоки до первой записи.
+
+        Вывод: None. Если файловая система не поддерживает клонирование - OSError.
+    '''
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def transfer_file(src, dst, size=None, mode='copy'):
+    '''
+        Функция которая создаёт копию файла выбранным способом.
+
+        Принимает:
+            1. src (str) - Путь к исходному файлу
+            2. dst (str) - Путь к целевому файлу (не должен существовать для mode='link')
+            3. size (int) - Размер исходного файла, если уже известен
+            4. mode (str) - 'copy' - копирование данных, 'link' - жёсткая ссылка,
+               'always' - только клонирование (reflink), 'auto' - клонирование, а если
+               файловая система его не поддерживает - обычное копирование
+
+        Вывод: кортеж (количество байт, использованный способ: 'copy', 'reflink' или 'link').
+    '''
+    if mode == 'copy':
+        return copy_file(src, dst, size), 'copy'
+    if mode == 'link':
+        os.link(src, dst)
+        return (os.path.getsize(dst) if size is None else size), 'link'
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        if size is None:
+            size = os.fstat(src_fd).st_size
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            try:
+                reflink(src_fd, dst_fd)
+                strategy, copied = 'reflink', size
+            except OSError as e:
+                if mode == 'always':
+                    raise OSError(e.errno, f"reflink is not supported: {e.strerror}", dst)
+                preallocate(dst_fd, size)
+                strategy, copied = 'copy', copy_file_data(src_fd, dst_fd, size)
+                if copied != size:
+                    os.ftruncate(dst_fd, copied)
+        finally:
+            os.close(dst_fd)
+    except OSError:
+        if mode == 'always' and os.path.exists(dst) and not os.path.getsize(dst):
+            os.remove(dst)
+        raise
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return copied, strategy
+
+
+def check_free_space(path, needed):
+    '''
+        Функция которая проверяет, что на файловой системе назначения хватает места.
+
+        Принимает:
+            1. path (str) - Путь назначения (может ещё не существовать)
+            2. needed (int) - Необходимое количество байт
+
+        Вывод: None. При нехватке места выбрасывает OSError(ENOSPC).
+    '''
+    existing = os.path.abspath(path)
+    while not os.path.exists(existing):
+        existing = os.path.dirname(existing)
+    free = shutil.disk_usage(existing).free
+    if needed > free:
+        raise OSError(errno.ENOSPC, f"Not enough free space: need {needed} bytes, available {free} bytes", path)
+
+
+class Progress:
+    '''Класс который выводит живую строку прогресса (файлы, байты, скорость) в stderr.'''
+    def __init__(self, label, total_files, total_bytes, enabled=None, interval=0.2):
+        self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        # В сеансе сервера stderr - терминал сервера, а не клиента: прогресс там не выводится
+        self.enabled = (sys.stderr.isatty() and current_console() is None) if enabled is None else enabled
+        self.interval = interval
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._shown = 0.0
+        self._lock = threading.Lock()
+        # Прогресс фоновой задачи показывает команда jobs
+        job = current_job()
+        if job is not None:
+            job.progress = self
+
+    def update(self, files=0, nbytes=0):
+        '''Функция которая учитывает скопированные файлы и байты и, не чаще interval, перерисовывает строку.'''
+        with self._lock:
+            self.files += files
+            self.bytes += nbytes
+            now = time.monotonic()
+            if self.enabled and now - self._shown >= self.interval:
+                self._shown = now
+                self._draw(now)
+
+    def _draw(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        sys.stderr.write(f"\r{self.label}: {self.files}/{self.total_files} files, "
+                         f"{self.bytes / 2**20:.1f}/{self.total_bytes / 2**20:.1f} MiB, "
+                         f"{self.bytes / 2**20 / elapsed:.1f} MiB/s")
+        sys.stderr.flush()
+
+    def finish(self):
+        '''Функция которая выводит итоговую строку прогресса.'''
+        if self.enabled:
+            with self._lock:
+                self._draw(time.monotonic())
+                sys.stderr.write('\n')
+                sys.stderr.flush()
+
+
+class CopyEngine:
+    '''
+        Класс рекурсивного копирования директорий.
+
+        Дерево обходится один раз (os.scandir), после чего файлы копируются пулом потоков
+        внутри ядра. Перед обычным копированием проверяется свободное место на диске назначения.
+        В режимах reflink и link данные не копируются: файлы клонируются (FICLONE) или
+        создаются жёсткие ссылки, поэтому дерево любого размера копируется за время обхода.
+        С проверкой (verify) каждый файл хэшируется по ходу копирования и сверяется с копией
+        в том же потоке пула.
+    '''
+    def __init__(self, jobs=None, progress=None, mode='copy', verify=None):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. jobs (int) - Количество потоков копирования. По умолчанию - как у ThreadPoolExecutor.
+                2. progress (bool) - Выводить ли прогресс. По умолчанию - если stderr это терминал.
+                3. mode (str) - Способ копирования файлов (см. transfer_file)
+                4. verify (HashCache) - Кэш контрольных сумм для проверки копий, None - без проверки
+        '''
+        self.jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+        self.progress = progress
+        self.mode = mode
+        self.verify = verify
+
+    def plan(self, src, dst):
+        '''
+            Функция которая обходит исходное дерево один раз и составляет план копирования.
+
+            Принимает:
+                1. src (str) - Исходная директория
+                2. dst (str) - Целевая директория
+
+            Вывод: кортеж (dirs, files, links, special, total_bytes), где dirs - список пар (src, dst),
+            files - список троек (src, dst, size), links - список пар (target, dst), special - пути
+            к FIFO, сокетам и устройствам (их нельзя копировать как файлы: чтение FIFO зависает).
+        '''
+        dirs, files, links, special = [(src, dst)], [], [], []
+        total = 0
+        stack = [(src, dst)]
+        while stack:
+            src_dir, dst_dir = stack.pop()
+            with os.scandir(src_dir) as it:
+                for entry in it:
+                    target = os.path.join(dst_dir, entry.name)
+                    if entry.is_symlink():
+                        links.append((os.readlink(entry.path), target))
+                    elif entry.is_dir():
+                        dirs.append((entry.path, target))
+                        stack.append((entry.path, target))
+                    elif entry.is_file():
+                        size = entry.stat().st_size
+                        files.append((entry.path, target, size))
+                        total += size
+                    else:
+                        special.append(entry.path)
+        return dirs, files, links, special, total
+
+    def copy_tree(self, src, dst):
+        '''
+            Функция которая рекурсивно копирует директорию src в dst (dst не должна существовать).
+
+            Принимает:
+                1. src (str) - Исходная директория
+                2. dst (str) - Целевая директория
+
+            Вывод: словарь статистики {'files', 'bytes', 'seconds', 'strategy'}, где strategy -
+            способ, которым скопированы файлы ('copy', 'reflink', 'link' или 'mixed').
+            При ошибках копирования отдельных файлов выбрасывает shutil.Error со списком ошибок
+            FIFO, сокеты и устройства не копируются: если они есть в дереве, shutil.Error со списком
+            таких путей выбрасывается до начала копирования. При любой ошибке, кроме ChecksumMismatch,
+            частично созданная копия удаляется.
+            Если фоновую задачу отменили (kill %N), оставшиеся файлы не копируются, частичная
+            копия удаляется и выбрасывается JobCancelled. Если при проверке контрольные суммы
+            не совпали - ChecksumMismatch (копия остаётся, её откатывает вызывающий код).
+        '''
+        started = time.monotonic()
+        dirs, files, links, special, total = self.plan(src, dst)
+        if special:
+            raise shutil.Error([(path, os.path.join(dst, os.path.relpath(path, src)), f"'{path}' is a special file")
+                                for path in special])
+        if self.mode == 'copy':
+            # При reflink и link место почти не расходуется; для auto нехватка места проявится при откате на копирование
+            check_free_space(dst, total)
+        try:
+            return self._copy_planned(dirs, files, links, total, dst, started)
+        except ChecksumMismatch:
+            raise
+        except BaseException:
+            if os.path.lexists(dst):
+                remove_tree(dst, self.jobs)
+            raise
+
+    def _copy_planned(self, dirs, files, links, total, dst, started):
+        for _, dst_dir in dirs:
+            os.makedirs(dst_dir, exist_ok=True)
+        for target, dst_link in links:
+            os.symlink(target, dst_link)
+
+        progress = Progress('cp', len(files), total, self.progress)
+        errors = []
+        mismatches = []
+        strategies = set()
+        job = current_job()
+
+        def task(src_file, dst_file, size):
+            if job is not None and job.cancel_event.is_set():
+                return
+            try:
+                if self.verify is not None and self.mode == 'copy':
+                    (nbytes, digest), strategy = copy_file_hashed(src_file, dst_file, self.verify, size), 'copy'
+                else:
+                    (nbytes, strategy), digest = transfer_file(src_file, dst_file, size, self.mode), None
+                if self.verify is not None:
+                    verify_copy(src_file, dst_file, self.verify, digest)
+                strategies.add(strategy)
+                progress.update(1, nbytes)
+            except ChecksumMismatch as e:
+                mismatches.append(str(e))
+            except OSError as e:
+                errors.append((src_file, dst_file, str(e)))
+
+        # Ограничиваем число задач в очереди, чтобы не держать в памяти миллион Future
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = set()
+            for item in files:
+                if len(pending) >= self.jobs * 4:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(pool.submit(task, *item))
+            wait(pending)
+        progress.finish()
+
+        if job is not None and job.cancel_event.is_set():
+            # Отменённое копирование откатывается целиком: частичной копии не остаётся
+            remove_tree(dst, self.jobs)
+            check_cancelled(job)
+
+        # Время изменения директорий выставляем после копирования их содержимого
+        for src_dir, dst_dir in reversed(dirs):
+            try:
+                shutil.copystat(src_dir, dst_dir)
+            except OSError as e:
+                errors.append((src_dir, dst_dir, str(e)))
+
+        if mismatches:
+            raise ChecksumMismatch(mismatches[0] + (f" (and {len(mismatches) - 1} more)" if len(mismatches) > 1 else ""))
+        if errors:
+            raise shutil.Error(errors)
+        strategy = strategies.pop() if len(strategies) == 1 else ('mixed' if strategies else self.mode)
+        return {'files': len(files), 'bytes': progress.bytes, 'seconds': time.monotonic() - started,
+                'strategy': 'reflink' if strategy in ('auto', 'always') else strategy}
+
+
+def remove_tree(path, jobs=None, batch_size=256):
+    '''
+        Функция которая удаляет дерево директорий: файлы удаляются пачками в пуле потоков,
+        затем директории удаляются от самых глубоких к корню.
+
+        Принимает:
+            1. path (str) - Путь к директории
+            2. jobs (int) - Количество потоков
+            3. batch_size (int) - Количество файлов в одной задаче пула
+
+        Вывод: количество удалённых файлов (int).
+    '''
+    dirs, batches, batch = [], [], []
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    batch.append(entry.path)
+                    if len(batch) >= batch_size:
+                        batches.append(batch)
+                        batch = []
+    if batch:
+        batches.append(batch)
+
+    def remove_batch(files):
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        return len(files)
+
+    with ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1) + 4)) as pool:
+        removed = sum(pool.map(remove_batch, batches))
+    for directory in reversed(dirs):
+        os.rmdir(directory)
+    return removed
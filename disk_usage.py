@@ -0,0 +1,253 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ansi import Colors
+from fileio import write_lines
+
+
+class SizeCache:
+    '''
+        Класс постоянного кэша размеров директорий для du.
+
+        Для каждой директории хранится [inode, mtime_ns, собственный размер файлов, имена поддиректорий].
+        Запись действительна, пока у директории те же inode и mtime: добавление, удаление
+        и переименование элементов меняют mtime директории. Изменение размера файла без
+        изменения состава директории mtime не меняет - в этом случае кэш обновляет du --no-cache.
+        Кэш хранится в JSON файле, запись на диск атомарная (через временный файл).
+    '''
+    def __init__(self, path):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. path (str) - Путь к файлу кэша
+        '''
+        self.path = os.path.abspath(path)
+        self.dirs = None
+        self.changed = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''Функция которая загружает кэш с диска при первом обращении. Повреждённый кэш игнорируется.'''
+        with self._lock:
+            if self.dirs is not None:
+                return
+            dirs = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    dirs = data
+            except (OSError, ValueError):
+                pass
+            self.dirs = dirs
+
+    def get(self, path, stat):
+        '''Функция которая возвращает (размер, поддиректории) для директории или None, если запись устарела.'''
+        record = self.dirs.get(path)
+        if record and record[0] == stat.st_ino and record[1] == stat.st_mtime_ns:
+            return record[2], record[3]
+        return None
+
+    def put(self, path, stat, size, subdirs):
+        with self._lock:
+            self.dirs[path] = [stat.st_ino, stat.st_mtime_ns, size, subdirs]
+            self.changed = True
+
+    def prune(self, root, seen):
+        '''Функция которая удаляет записи о директориях внутри root, которых больше нет.'''
+        prefix = root.rstrip(os.sep) + os.sep
+        # put вызывают потоки фоновых задач и сеансов сервера: словарь читается и меняется под блокировкой
+        with self._lock:
+            for path in [p for p in list(self.dirs) if (p == root or p.startswith(prefix)) and p not in seen]:
+                del self.dirs[path]
+                self.changed = True
+
+    def save(self):
+        '''Функция которая атомарно записывает кэш на диск, если он изменился.'''
+        with self._lock:
+            if not self.changed:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.dirs), f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+def open_size_cache(shell):
+    '''Функция которая возвращает кэш размеров shell, создавая его при первом обращении.'''
+    if shell.size_cache is None:
+        shell.size_cache = SizeCache(shell.size_cache_file)
+    return shell.size_cache
+
+
+def scan_dir(path, apparent=False):
+    '''
+        Функция которая считает собственный размер файлов директории (без поддиректорий).
+
+        Принимает:
+            1. path (str) - Путь к директории
+            2. apparent (bool) - Считать размер файлов, а не занятое место на диске
+
+        Вывод: кортеж (размер, список имён поддиректорий).
+    '''
+    size, subdirs = 0, []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            size += st.st_size if apparent else st.st_blocks * 512
+    return size, subdirs
+
+
+def tree_sizes(root, cache=None, apparent=False, jobs=None, onerror=None, refresh=False):
+    '''
+        Функция которая считает полный размер каждой директории дерева. Директории читаются
+        параллельно пулом потоков; директории с неизменившимися inode и mtime берутся из кэша
+        без чтения их содержимого (нужен только один stat).
+
+        Принимает:
+            1. root (str) - Абсолютный путь к корню
+            2. cache (SizeCache) - Кэш размеров (None - без кэша)
+            3. apparent (bool) - Считать размер файлов, а не занятое место
+            4. jobs (int) - Количество потоков
+            5. onerror (callable) - Обработчик ошибок чтения поддиректорий
+            6. refresh (bool) - Не доверять кэшу и перезаписать его свежими данными
+
+        Вывод: словарь {путь директории: полный размер}.
+    '''
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    # Кэш хранит размеры в одном режиме; apparent-режим считается без кэша
+    cache = None if apparent else cache
+
+    def task(path):
+        st = os.stat(path)
+        if cache is not None and not refresh:
+            cached = cache.get(path, st)
+            if cached is not None:
+                return cached
+        size, subdirs = scan_dir(path, apparent)
+        if cache is not None:
+            cache.put(path, st, size, subdirs)
+        return size, subdirs
+
+    own, children = {}, {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = {pool.submit(task, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    size, subdirs = future.result()
+                except OSError as e:
+                    if path == root:
+                        raise
+                    if onerror:
+                        onerror(e)
+                    size, subdirs = 0, []
+                own[path] = size
+                children[path] = [os.path.join(path, name) for name in subdirs]
+                for child in children[path]:
+                    pending[pool.submit(task, child)] = child
+
+    if cache is not None:
+        cache.prune(root, own)
+
+    # Суммируем снизу вверх: более длинные пути - более глубокие директории
+    totals = {}
+    for path in sorted(own, key=len, reverse=True):
+        totals[path] = own[path] + sum(totals.get(child, 0) for child in children[path])
+    return totals
+
+
+def human_size(size):
+    '''Функция которая форматирует размер в виде 1.5K, 20M, 3.0G.'''
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if size < 1024 or unit == 'T':
+            if not unit:
+                return str(size)
+            return f"{size:.1f}{unit}" if size < 10 else f"{size:.0f}{unit}"
+        size /= 1024
+
+
+def iter_du(totals, root, display_root, max_depth=None, sort_by='name', human=False):
+    '''
+        Функция которая формирует строки вывода du.
+
+        Принимает:
+            1. totals (dict) - Размеры директорий из tree_sizes
+            2. root (str) - Абсолютный путь к корню
+            3. display_root (str) - Корень в том виде, в котором его ввёл пользователь
+            4. max_depth (int) - Максимальная глубина вывода (0 - только корень)
+            5. sort_by (str) - 'name' или 'size' (большие первыми)
+            6. human (bool) - Размеры в читаемом виде
+
+        Вывод: генератор строк (str).
+    '''
+    depth_base = root.rstrip(os.sep).count(os.sep)
+    items = [(display_root + path[len(root):], size) for path, size in totals.items()
+             if max_depth is None or path.count(os.sep) - depth_base <= max_depth]
+    if sort_by == 'size':
+        items.sort(key=lambda item: (-item[1], item[0]))
+    else:
+        items.sort()
+    for path, size in items:
+        yield f"{human_size(size) if human else size}\t{path}"
+
+
+def _print_error(error):
+    print(f"{Colors.RED}{error}{Colors.RESET}", file=sys.stderr)
+
+
+def du(shell, path='.', max_depth=None, sort_by='name', flag_h=False, flag_b=False, flag_s=False,
+       jobs=None, no_cache=False):
+    '''
+        Функция команды du: выводит полный размер директории и её поддиректорий.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. path (str) - Директория (по умолчанию текущая)
+            3. max_depth (int) - Глубина вывода (--max-depth N)
+            4. sort_by (str) - Сортировка: 'name' или 'size' (-S)
+            5. flag_h (bool) - Размеры в читаемом виде (-h)
+            6. flag_b (bool) - Размер файлов в байтах вместо занятого места (-b)
+            7. flag_s (bool) - Только итог для path (-s, как --max-depth 0)
+            8. jobs (int) - Количество потоков (--jobs N)
+            9. no_cache (bool) - Пересчитать всё дерево, не используя кэш (--no-cache)
+
+        Вывод: None
+    '''
+    flags = ''.join(flag for flag, on in (('h', flag_h), ('b', flag_b), ('s', flag_s), ('S', sort_by == 'size')) if on)
+    args = ([f"-{flags}"] if flags else []) + ([f"--max-depth={max_depth}"] if max_depth is not None else [])
+    args += (['--no-cache'] if no_cache else []) + [path]
+    try:
+        root = os.path.abspath(os.path.join(shell.current_dir, path))
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f"'{path}' is not a directory")
+
+        cache = open_size_cache(shell)
+        cache.load()
+        totals = tree_sizes(root, cache, flag_b, jobs, onerror=_print_error, refresh=no_cache)
+        try:
+            cache.save()
+        except OSError as e:
+            _print_error(f"du: couldn't save size cache: {e}")
+
+        write_lines(iter_du(totals, root, path.rstrip(os.sep) or os.sep, 0 if flag_s else max_depth,
+                            sort_by, flag_h))
+        shell.add_log(f"du {' '.join(args)}", nbytes=totals[root])
+        shell.add_to_history('du', args, other_data={'bytes': totals[root], 'dirs': len(totals)})
+    except OSError as e:
+        error_msg = f"du: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"du {' '.join(args)}", False, error_msg)
+        shell.add_to_history('du', args, False)
@@ -0,0 +1,410 @@
+import codecs
+import contextlib
+import itertools
+import os
+import shutil
+import sys
+import threading
+
+# Размер блока для потокового чтения файлов
+BLOCK_SIZE = 64 * 1024
+
+# Ввод и вывод команды внутри конвейера (у каждого потока свои)
+_streams = threading.local()
+
+
+class OutputSink:
+    '''
+        Базовый класс приёмника вывода команд (выход конвейера, файл). write_lines и write_chunks
+        передают ему данные как есть, без цветов и разбиения на экраны.
+    '''
+    def feed_chunks(self, chunks):
+        '''Функция которая принимает блоки байт. Вывод: количество байт (int).'''
+        raise NotImplementedError
+
+    def feed_lines(self, lines):
+        '''Функция которая принимает строки (str) без перевода строки. Вывод: количество строк (int).'''
+        raise NotImplementedError
+
+
+def current_input():
+    '''Функция которая возвращает вход команды в конвейере (итератор строк bytes) или None.'''
+    return getattr(_streams, 'stdin', None)
+
+
+def current_output():
+    '''Функция которая возвращает текущий поток вывода команд: выход конвейера, файл или sys.stdout.'''
+    return getattr(_streams, 'stdout', None) or sys.stdout
+
+
+@contextlib.contextmanager
+def redirect(stdin=None, stdout=None):
+    '''
+        Функция которая на время блока подменяет вход и вывод команд текущего потока.
+        write_lines и write_chunks без явного out пишут в stdout.
+
+        Принимает:
+            1. stdin - Итератор строк (bytes) для команд, читающих вход (cat, grep, head)
+            2. stdout (OutputSink) - Приёмник вывода (выход конвейера, файл)
+    '''
+    saved = (current_input(), getattr(_streams, 'stdout', None))
+    _streams.stdin, _streams.stdout = stdin, stdout
+    try:
+        yield
+    finally:
+        _streams.stdin, _streams.stdout = saved
+
+
+def current_console():
+    '''Функция которая возвращает консоль текущего потока (сеанс сервера) или None.'''
+    return getattr(_streams, 'console', None)
+
+
+@contextlib.contextmanager
+def use_console(stream):
+    '''
+        Функция-контекстный менеджер: print и вывод команд текущего потока внутри блока идут
+        в stream (консоль сеанса сервера), если sys.stdout заменён на ConsoleProxy.
+
+        Принимает:
+            1. stream - Текстовый поток (write, flush) или None - общий sys.stdout
+    '''
+    saved = current_console()
+    _streams.console = stream
+    try:
+        yield
+    finally:
+        _streams.console = saved
+
+
+class ConsoleProxy:
+    '''
+        Класс замены sys.stdout для сервера: запись уходит в консоль текущего потока (use_console),
+        а у потоков без консоли - в исходный поток. Поэтому print в командах разных сеансов,
+        выполняемых в общем пуле потоков, не смешивается.
+    '''
+    def __init__(self, default):
+        self.default = default
+
+    def _target(self):
+        return current_console() or self.default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        target = self._target()
+        return target.isatty() if hasattr(target, 'isatty') else False
+
+    @property
+    def buffer(self):
+        # write_chunks пишет байты напрямую в buffer, если он есть; у консоли сеанса его нет
+        return getattr(self._target(), 'buffer', None)
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def iter_chunk_lines(chunks):
+    '''
+        Функция которая разбивает поток блоков на строки.
+
+        Принимает:
+            1. chunks - Итерируемый объект блоков (bytes)
+
+        Вывод: генератор строк (bytes) вместе с переводом строки (у последней строки его может не быть).
+    '''
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if rest:
+        yield rest
+
+
+def iter_lines_reversed(f, block_size=BLOCK_SIZE):
+    '''
+        Функция которая читает строки файла в обратном порядке, начиная с конца файла.
+        Файл читается блоками, поэтому в памяти никогда не находится весь файл.
+
+        Принимает:
+            1. f - Файловый объект, открытый в бинарном режиме
+            2. block_size (int) - Размер блока чтения
+
+        Вывод: генератор строк (bytes) без символа перевода строки, от последней к первой.
+    '''
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    rest = b''
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + rest).split(b'\n')
+        rest = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    yield rest
+
+
+class BinaryFileError(OSError):
+    '''Ошибка, возникающая при попытке вывести бинарный файл как текст.'''
+
+
+def is_binary(chunk):
+    '''
+        Функция которая определяет, похож ли блок данных на бинарный файл (есть нулевые байты).
+
+        Принимает:
+            1. chunk (bytes) - Первый блок файла
+
+        Вывод: True, если данные бинарные.
+    '''
+    return b'\0' in chunk
+
+
+def parse_range(text):
+    '''
+        Функция которая разбирает диапазон вида "A-B", "A-" или "-N".
+
+        Принимает:
+            1. text (str) - Строка диапазона
+
+        Вывод: кортеж (start, end). Для "-N" возвращает (-N, None), для "A-" - (A, None).
+    '''
+    start, sep, end = text.partition('-')
+    if not sep or not (start or end) or not all(part.isdigit() for part in (start, end) if part):
+        raise ValueError(f"invalid range '{text}'")
+    if not start:
+        return (-int(end), None)
+    if end and int(end) < int(start):
+        raise ValueError(f"invalid range '{text}'")
+    return (int(start), int(end) if end else None)
+
+
+def format_range(file_range):
+    '''Функция которая переводит диапазон (start, end) обратно в строку вида "A-B", "A-" или "-N".'''
+    start, end = file_range
+    if start < 0:
+        return str(start)
+    return f"{start}-{'' if end is None else end}"
+
+
+def tail_offset(f, count, block_size=BLOCK_SIZE):
+    '''
+        Функция которая находит смещение начала последних count строк, читая файл блоками с конца.
+
+        Принимает:
+            1. f - Файловый объект, открытый в бинарном режиме
+            2. count (int) - Количество строк с конца файла
+            3. block_size (int) - Размер блока чтения
+
+        Вывод: смещение (int) в байтах.
+    '''
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    if pos and count:
+        f.seek(pos - 1)
+        # Завершающий перевод строки не начинает новую строку
+        if f.read(1) == b'\n':
+            count += 1
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        block = f.read(step)
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx == -1:
+                break
+            count -= 1
+            if count <= 0:
+                return pos + idx + 1
+    return 0
+
+
+def line_offset(f, count, block_size=BLOCK_SIZE):
+    '''
+        Функция которая находит смещение начала строки с номером count + 1 (нумерация с 1).
+
+        Принимает:
+            1. f - Файловый объект, открытый в бинарном режиме
+            2. count (int) - Количество строк, которые нужно пропустить
+            3. block_size (int) - Размер блока чтения
+
+        Вывод: смещение (int) в байтах.
+    '''
+    f.seek(0)
+    pos = 0
+    while count > 0:
+        block = f.read(block_size)
+        if not block:
+            break
+        idx = -1
+        while count > 0:
+            idx = block.find(b'\n', idx + 1)
+            if idx == -1:
+                break
+            count -= 1
+        if count == 0:
+            return pos + idx + 1
+        pos += len(block)
+    return pos
+
+
+def iter_chunks(f, start=0, end=None, max_lines=None, block_size=BLOCK_SIZE):
+    '''
+        Функция которая читает файл блоками фиксированного размера в диапазоне [start, end).
+
+        Принимает:
+            1. f - Файловый объект, открытый в бинарном режиме
+            2. start (int) - Смещение начала
+            3. end (int) - Смещение конца (не включительно). Если None - до конца файла.
+            4. max_lines (int) - Остановиться после указанного количества строк
+            5. block_size (int) - Размер блока чтения
+
+        Вывод: генератор блоков (bytes).
+    '''
+    f.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        block = f.read(block_size if remaining is None else min(block_size, remaining))
+        if not block:
+            return
+        if remaining is not None:
+            remaining -= len(block)
+        if max_lines is not None:
+            idx = -1
+            while max_lines > 0:
+                idx = block.find(b'\n', idx + 1)
+                if idx == -1:
+                    break
+                max_lines -= 1
+            if max_lines == 0:
+                yield block[:idx + 1]
+                return
+        yield block
+
+
+def iter_file(path, byte_range=None, line_range=None, block_size=BLOCK_SIZE):
+    '''
+        Функция которая потоково читает файл (или его часть) блоками. Бинарные файлы
+        определяются по первому блоку, до того как что-либо будет выведено.
+
+        Принимает:
+            1. path (str) - Путь к файлу
+            2. byte_range (tuple) - Диапазон байт (start, end), нумерация с 0, end включительно.
+               (-N, None) означает последние N байт.
+            3. line_range (tuple) - Диапазон строк (start, end), нумерация с 1, end включительно.
+               (-N, None) означает последние N строк.
+            4. block_size (int) - Размер блока чтения
+
+        Вывод: генератор блоков (bytes).
+    '''
+    with open(path, 'rb') as f:
+        if is_binary(f.read(block_size)):
+            raise BinaryFileError(f"{path}: binary file")
+
+        size = os.fstat(f.fileno()).st_size
+        start, end, max_lines = 0, None, None
+        if byte_range:
+            first, last = byte_range
+            if first < 0:
+                start = max(0, size + first)
+            else:
+                start = first
+                end = None if last is None else last + 1
+        elif line_range:
+            first, last = line_range
+            if first < 0:
+                start = tail_offset(f, -first, block_size)
+            else:
+                start = line_offset(f, first - 1, block_size)
+                max_lines = None if last is None else last - first + 1
+
+        yield from iter_chunks(f, start, end, max_lines, block_size)
+
+
+def write_chunks(chunks, out=None, prefix='', suffix=''):
+    '''
+        Функция которая пишет блоки байт в буферизованный поток вывода. Префикс пишется только
+        после получения первого блока, поэтому ошибка чтения не оставляет "висящий" цвет.
+        Если данные не заканчиваются переводом строки, он добавляется после суффикса.
+
+        Принимает:
+            1. chunks - Итерируемый объект блоков (bytes)
+            2. out - Текстовый поток вывода (по умолчанию current_output())
+            3. prefix (str) - Строка перед данными (например, цвет), в конвейер и файл не пишется
+            4. suffix (str) - Строка после данных, в конвейер и файл не пишется
+
+        Вывод: количество записанных байт (int).
+    '''
+    out = out or current_output()
+    if isinstance(out, OutputSink):
+        return out.feed_chunks(chunks)
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    buffer = getattr(out, 'buffer', None)
+    decoder = None
+    if buffer is None:
+        # Текстовый поток без бинарного буфера (например, io.StringIO)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        write = lambda chunk: out.write(decoder.decode(chunk))
+    else:
+        out.flush()
+        write = buffer.write
+
+    write(prefix.encode())
+    written = 0
+    last = b'\n'
+    for chunk in itertools.chain((first,), chunks):
+        if chunk:
+            write(chunk)
+            written += len(chunk)
+            last = chunk[-1:]
+    if decoder is not None:
+        # Оборванная в конце данных последовательность UTF-8 выводится символом замены, а не теряется
+        out.write(decoder.decode(b'', final=True))
+    write((suffix if last == b'\n' else suffix + '\n').encode())
+    if buffer is not None:
+        buffer.flush()
+    out.flush()
+    return written
+
+
+def write_lines(lines, out=None, page_size=None):
+    '''
+        Функция которая выводит строки, накапливая их в буфере и записывая одним вызовом
+        write на каждый экран (page_size строк).
+
+        Принимает:
+            1. lines - Итерируемый объект строк (str) без перевода строки
+            2. out - Текстовый поток вывода (по умолчанию current_output())
+            3. page_size (int) - Количество строк в одной записи. По умолчанию - высота терминала.
+
+        Вывод: количество выведенных строк (int).
+    '''
+    out = out or current_output()
+    if isinstance(out, OutputSink):
+        return out.feed_lines(lines)
+    page_size = page_size or shutil.get_terminal_size().lines
+    page = []
+    count = 0
+    for line in lines:
+        page.append(line)
+        if len(page) >= page_size:
+            out.write('\n'.join(page) + '\n')
+            out.flush()
+            count += len(page)
+            page.clear()
+    if page:
+        out.write('\n'.join(page) + '\n')
+        count += len(page)
+    out.flush()
+    return count
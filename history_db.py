@@ -0,0 +1,281 @@
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    command TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    current_dir TEXT,
+    other_data TEXT,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_time ON history (time);
+CREATE INDEX IF NOT EXISTS history_command ON history (command, id);
+CREATE INDEX IF NOT EXISTS history_dir ON history (current_dir, id);
+CREATE INDEX IF NOT EXISTS history_failed ON history (id) WHERE status = 0;
+'''
+
+# Полнотекстовый индекс по строке команды: триграммы позволяют искать любую подстроку (от 3 символов) по индексу
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5 (line, content='history', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, line) VALUES (new.id, new.line);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, line) VALUES ('delete', old.id, old.line);
+END;
+'''
+
+COLUMNS = 'id, time, command, args, status, current_dir, other_data'
+
+
+def read_legacy(path):
+    '''
+        Функция которая читает старый журнал истории: JSON массив или JSON lines с метками удаления.
+
+        Вывод: список записей (dict) от старых к новым.
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        if f.read(1) == '[':
+            f.seek(0)
+            return json.load(f)
+        f.seek(0)
+        records = {}
+        for number, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'removed' in record:
+                records.pop(record['removed'], None)
+            else:
+                records[record.get('id', -number - 1)] = record
+        return list(records.values())
+
+
+def command_line(command, args):
+    '''Функция которая собирает строку команды для поиска и для истории readline.'''
+    return ' '.join([command] + [str(arg) for arg in args])
+
+
+class HistoryDB:
+    '''
+        Класс истории команд в базе SQLite.
+
+        Записи не загружаются в память: show_history и поиск выполняют запросы по индексам
+        (время, команда, директория, неуспешные команды) и по полнотекстовому триграммному индексу
+        строки команды. База открывается в режиме WAL, каждая команда - одна короткая транзакция,
+        в пакетном режиме все записи скрипта фиксируются одной транзакцией.
+    '''
+    def __init__(self, path, legacy_path=None, synchronous='NORMAL'):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. path (str) - Путь к файлу базы
+                2. legacy_path (str) - Старый журнал (.history), импортируется при первом открытии базы
+                3. synchronous (str) - Режим PRAGMA synchronous (NORMAL - fsync только при контрольных точках WAL)
+        '''
+        self.path = os.path.abspath(path)
+        self.legacy_path = os.path.abspath(legacy_path) if legacy_path else None
+        self.synchronous = synchronous
+        self.fts = False
+        self._db = None
+        self._batch = 0
+        self._lock = threading.RLock()
+
+    @contextlib.contextmanager
+    def _errors(self):
+        # Ошибки SQLite для вызывающего кода выглядят как обычные ошибки ввода-вывода
+        with self._lock:
+            try:
+                yield
+            except sqlite3.Error as e:
+                raise OSError(f"history database: {e}") from e
+
+    def load(self):
+        '''Функция которая открывает базу, создаёт схему и при первом запуске импортирует старый журнал.'''
+        with self._errors():
+            if self._db is not None:
+                return
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._db.executescript(SCHEMA)
+            try:
+                self._db.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite собран без FTS5 - поиск подстроки будет полным просмотром таблицы
+                self.fts = False
+            if self._db.execute('PRAGMA user_version').fetchone()[0] == 0:
+                self._import_legacy()
+                self._db.execute('PRAGMA user_version = 1')
+            atexit.register(self.close)
+
+    def _import_legacy(self):
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            records = read_legacy(self.legacy_path)
+        except (OSError, ValueError):
+            return
+        self._db.execute('BEGIN')
+        for record in records:
+            if isinstance(record, dict) and 'command' in record:
+                self._insert(dict(record), keep_id=False)
+        self._db.execute('COMMIT')
+
+    def _insert(self, entry, keep_id=True):
+        args = entry.get('args', [])
+        cursor = self._db.execute(
+            'INSERT INTO history (id, time, command, args, status, current_dir, other_data, line) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (entry.get('id') if keep_id else None, entry['time'], entry['command'], json.dumps(args),
+             1 if entry.get('status', True) else 0, entry.get('current_dir'),
+             json.dumps(entry.get('other_data') or {}), command_line(entry['command'], args)))
+        entry['id'] = cursor.lastrowid
+        return entry
+
+    def append(self, entry):
+        '''
+            Функция которая добавляет запись в историю и присваивает ей id.
+
+            Принимает:
+                1. entry (dict) - Запись (time, command, args, status, current_dir, other_data)
+
+            Вывод: запись (dict) с заполненным полем id.
+        '''
+        with self._errors():
+            self.load()
+            if self._batch and not self._db.in_transaction:
+                self._db.execute('BEGIN')
+            return self._insert(entry)
+
+    def remove(self, entry_id):
+        '''Функция которая удаляет запись по id.'''
+        with self._errors():
+            self.load()
+            self._db.execute('DELETE FROM history WHERE id = ?', (entry_id,))
+
+    @staticmethod
+    def _row(row):
+        return {'id': row[0], 'time': row[1], 'command': row[2], 'args': json.loads(row[3]),
+                'status': bool(row[4]), 'current_dir': row[5], 'other_data': json.loads(row[6] or '{}')}
+
+    def search(self, pattern=None, since=None, until=None, failed=False, command=None, directory=None, limit=None):
+        '''
+            Функция которая ищет записи истории. Все условия объединяются через И.
+
+            Принимает:
+                1. pattern (str) - Подстрока строки команды (без учёта регистра)
+                2. since (str) - Время ISO: записи не раньше
+                3. until (str) - Время ISO: записи раньше
+                4. failed (bool) - Только неуспешные команды
+                5. command (str) - Имя команды
+                6. directory (str) - Рабочая директория
+                7. limit (int) - Сколько последних подходящих записей вернуть (None - все)
+
+            Вывод: список записей (dict) от старых к новым.
+        '''
+        conditions, params = [], []
+        if pattern:
+            if self.fts and len(pattern) >= 3:
+                # Фраза в триграммном индексе - поиск подстроки без учёта регистра
+                conditions.append('id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)')
+                params.append('"' + pattern.replace('"', '""') + '"')
+            else:
+                conditions.append("line LIKE ? ESCAPE '\\'")
+                params.append('%' + pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if since:
+            conditions.append('time >= ?')
+            params.append(since)
+        if until:
+            conditions.append('time < ?')
+            params.append(until)
+        if failed:
+            conditions.append('status = 0')
+        if command:
+            conditions.append('command = ?')
+            params.append(command)
+        if directory:
+            conditions.append('current_dir = ?')
+            params.append(directory)
+
+        query = f'SELECT {COLUMNS} FROM history'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._errors():
+            self.load()
+            rows = self._db.execute(query, params).fetchall()
+        return [self._row(row) for row in reversed(rows)]
+
+    def tail(self, count):
+        '''Функция которая возвращает последние count записей от старых к новым.'''
+        return self.search(limit=count)
+
+    def iter_reversed(self):
+        '''Функция которая перебирает записи от новых к старым, читая базу порциями.'''
+        last_id = None
+        while True:
+            with self._errors():
+                self.load()
+                if last_id is None:
+                    rows = self._db.execute(f'SELECT {COLUMNS} FROM history ORDER BY id DESC LIMIT 256').fetchall()
+                else:
+                    rows = self._db.execute(f'SELECT {COLUMNS} FROM history WHERE id < ? ORDER BY id DESC LIMIT 256',
+                                            (last_id,)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row(row)
+            last_id = rows[-1][0]
+
+    def recent_lines(self, count):
+        '''Функция которая возвращает строки последних count команд от старых к новым (для readline).'''
+        with self._errors():
+            self.load()
+            rows = self._db.execute('SELECT line FROM history ORDER BY id DESC LIMIT ?', (count,)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def sync(self):
+        '''Функция которая фиксирует открытую транзакцию пакетного режима.'''
+        with self._errors():
+            if self._db is not None and self._db.in_transaction:
+                self._db.execute('COMMIT')
+
+    def begin_batch(self):
+        '''Функция которая начинает пакетную запись: все записи до end_batch фиксируются одной транзакцией.'''
+        self._batch += 1
+
+    def end_batch(self):
+        '''Функция которая завершает пакетную запись и фиксирует транзакцию.'''
+        self._batch = max(0, self._batch - 1)
+        if not self._batch:
+            self.sync()
+
+    def close(self):
+        '''Функция которая фиксирует изменения и закрывает базу.'''
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self.sync()
+                finally:
+                    self._db.close()
+                    self._db = None
+
+    def __bool__(self):
+        with self._errors():
+            self.load()
+            return self._db.execute('SELECT 1 FROM history LIMIT 1').fetchone() is not None
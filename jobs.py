@@ -0,0 +1,305 @@
+import contextlib
+import copy
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ansi import Colors
+from fileio import OutputSink, current_console, iter_chunk_lines, redirect, use_console, write_lines
+
+# Фоновая задача, которую выполняет текущий поток (у каждого потока своя)
+_local = threading.local()
+
+
+class JobCancelled(OSError):
+    '''Ошибка, которой команда фоновой задачи прерывается после kill %N.'''
+
+
+def current_job():
+    '''Функция которая возвращает фоновую задачу текущего потока или None.'''
+    return getattr(_local, 'job', None)
+
+
+@contextlib.contextmanager
+def job_context(job):
+    '''Функция-контекстный менеджер: код внутри блока выполняется от имени задачи job (для потоков пула).'''
+    saved = current_job()
+    _local.job = job
+    try:
+        yield
+    finally:
+        _local.job = saved
+
+
+def check_cancelled(job=None):
+    '''
+        Функция которая прерывает команду, если её задачу отменили. Вызывается между файлами
+        и элементами пакета, поэтому отмена не оставляет недописанных файлов.
+
+        Принимает:
+            1. job (Job) - Задача (по умолчанию задача текущего потока)
+
+        Вывод: None. Если задача отменена - JobCancelled.
+    '''
+    job = job or current_job()
+    if job is not None and job.cancel_event.is_set():
+        raise JobCancelled(f"job [{job.id}] cancelled")
+
+
+class JobOutput(OutputSink):
+    '''Класс вывода фоновой задачи: хранит последние max_lines строк до fg / wait.'''
+    def __init__(self, max_lines):
+        self.lines = deque(maxlen=max_lines)
+
+    def feed_chunks(self, chunks):
+        nbytes = 0
+        for line in iter_chunk_lines(chunks):
+            nbytes += len(line)
+            self.lines.append(line.rstrip(b'\n').decode('utf-8', errors='replace'))
+        return nbytes
+
+    def feed_lines(self, lines):
+        count = 0
+        for line in lines:
+            self.lines.append(line)
+            count += 1
+        return count
+
+
+class Job:
+    '''Класс фоновой задачи: строка команды, состояние, вывод, прогресс и флаг отмены.'''
+    def __init__(self, job_id, line, output_lines):
+        self.id = job_id
+        self.line = line
+        self.state = 'Running'
+        self.started = time.time()
+        self.finished = None
+        self.output = JobOutput(output_lines)
+        # Прогресс копирования / перемещения (copy_engine.Progress), если команда его ведёт
+        self.progress = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        '''Функция которая просит задачу остановиться в ближайшей безопасной точке.'''
+        self.cancel_event.set()
+
+    def describe(self):
+        '''Функция которая возвращает строку задачи для jobs: номер, состояние, время, команда и прогресс.'''
+        elapsed = (self.finished or time.time()) - self.started
+        state = 'Cancelling' if self.state == 'Running' and self.cancel_event.is_set() else self.state
+        text = f"[{self.id}] {state:<10} {elapsed:6.1f}s  {self.line}"
+        progress = self.progress
+        if progress is not None and self.state == 'Running':
+            text += (f"  ({progress.files}/{progress.total_files} files, "
+                     f"{progress.bytes / 2**20:.1f}/{progress.total_bytes / 2**20:.1f} MiB)")
+        return text
+
+
+class JobTable:
+    '''
+        Класс таблицы фоновых задач shell.
+
+        Команды выполняются в общем пуле из max_jobs потоков на копии shell: у задачи свои
+        текущая директория и состояние команды, а история, лог, журнал операций и корзина общие
+        (они защищены блокировками). Запись в историю и лог делает сама команда, когда задача завершается.
+        Завершённые задачи хранятся в таблице, пока о них не сообщат (jobs, wait, fg или перед приглашением).
+    '''
+    def __init__(self, max_jobs=4, output_lines=1000):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. max_jobs (int) - Сколько задач выполняется одновременно (остальные ждут в очереди)
+                2. output_lines (int) - Сколько последних строк вывода хранить на задачу
+        '''
+        self.max_jobs = max_jobs
+        self.output_lines = output_lines
+        self.jobs = {}
+        self.last_id = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, shell, line):
+        '''
+            Функция которая запускает строку команды фоновой задачей.
+
+            Принимает:
+                1. shell (System_Shell) - Shell
+                2. line (str) - Строка команды без &
+
+            Вывод: задача (Job).
+        '''
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='job')
+            self.last_id += 1
+            job = Job(self.last_id, line, self.output_lines)
+            self.jobs[job.id] = job
+        job_shell = copy.copy(shell)
+        # Фоновая задача не может спрашивать подтверждение
+        job_shell.interactive = False
+        # Сообщения задачи идут в консоль того, кто её запустил (сеанс сервера или терминал)
+        job.future = self._pool.submit(self._run, job, job_shell, current_console())
+        return job
+
+    def _run(self, job, shell, console=None):
+        status = False
+        with use_console(console):
+            try:
+                if not job.cancel_event.is_set():
+                    with job_context(job), redirect(None, job.output):
+                        status = shell.execute(job.line)
+            except Exception as e:
+                print(f"{Colors.RED}[{job.id}] {job.line}: {e}{Colors.RESET}")
+            finally:
+                job.state = 'Done' if status else ('Cancelled' if job.cancel_event.is_set() else 'Failed')
+                job.finished = time.time()
+        return status
+
+    def get(self, job_id=None):
+        '''Функция которая возвращает задачу по номеру (по умолчанию - последнюю). Нет задачи - KeyError.'''
+        with self._lock:
+            if job_id is None:
+                if not self.jobs:
+                    raise KeyError("no current job")
+                job_id = max(self.jobs)
+            if job_id not in self.jobs:
+                raise KeyError(f"%{job_id}: no such job")
+            return self.jobs[job_id]
+
+    def list(self):
+        '''Функция которая возвращает все задачи таблицы по возрастанию номера.'''
+        with self._lock:
+            return [self.jobs[job_id] for job_id in sorted(self.jobs)]
+
+    def running(self):
+        '''Функция которая возвращает незавершённые задачи.'''
+        return [job for job in self.list() if job.finished is None]
+
+    def wait(self, jobs):
+        '''Функция которая ждёт завершения задач. Вывод: True, если все завершились успешно.'''
+        return all([job.future.result() for job in jobs])
+
+    def collect(self, jobs=None):
+        '''Функция которая убирает из таблицы завершённые задачи (все или из списка jobs) и возвращает их.'''
+        with self._lock:
+            done = [job for job in (jobs if jobs is not None else self.jobs.values()) if job.finished is not None]
+            for job in done:
+                self.jobs.pop(job.id, None)
+        return sorted(done, key=lambda job: job.id)
+
+    def cancel_all(self):
+        '''Функция которая отменяет все незавершённые задачи.'''
+        for job in self.running():
+            job.cancel()
+
+    def close(self):
+        '''Функция которая отменяет незавершённые задачи, дожидается их и останавливает потоки пула.'''
+        self.cancel_all()
+        self.wait(self.running())
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def iter_report(jobs):
+    '''Функция которая формирует строки отчёта о завершённых задачах: состояние и сохранённый вывод.'''
+    for job in jobs:
+        yield job.describe()
+        yield from job.output.lines
+
+
+def jobs(shell):
+    '''
+        Функция команды jobs: выводит фоновые задачи с состоянием, временем и прогрессом.
+        Завершённые задачи после вывода убираются из таблицы.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+
+        Вывод: None
+    '''
+    table = shell.jobs.list()
+    write_lines(job.describe() for job in table)
+    shell.jobs.collect(table)
+    shell.add_log("jobs")
+    shell.add_to_history('jobs', [], other_data={'jobs': len(table)})
+
+
+def wait(shell, job_id=None):
+    '''
+        Функция команды wait: ждёт завершения задачи %N (или всех задач) и выводит её результат.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. job_id (int) - Номер задачи (по умолчанию - все)
+
+        Вывод: None
+    '''
+    args = [f"%{job_id}"] if job_id else []
+    try:
+        targets = [shell.jobs.get(job_id)] if job_id else shell.jobs.list()
+    except KeyError as e:
+        return _job_error(shell, 'wait', args, e)
+    status = shell.jobs.wait(targets)
+    write_lines(iter_report(shell.jobs.collect(targets)))
+    shell.add_log(f"wait {' '.join(args)}".rstrip(), status, "" if status else "wait: some jobs failed")
+    shell.add_to_history('wait', args, status)
+
+
+def fg(shell, job_id=None):
+    '''
+        Функция команды fg: ждёт задачу %N (по умолчанию последнюю) на переднем плане и выводит её результат.
+        Ctrl-C во время ожидания отменяет задачу.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. job_id (int) - Номер задачи
+
+        Вывод: None
+    '''
+    args = [f"%{job_id}"] if job_id else []
+    try:
+        job = shell.jobs.get(job_id)
+    except KeyError as e:
+        return _job_error(shell, 'fg', args, e)
+    print(job.line)
+    try:
+        status = shell.jobs.wait([job])
+    except KeyboardInterrupt:
+        job.cancel()
+        status = shell.jobs.wait([job])
+    write_lines(iter_report(shell.jobs.collect([job])))
+    shell.add_log(f"fg {' '.join(args)}".rstrip(), status, "" if status else f"fg: job [{job.id}] failed")
+    shell.add_to_history('fg', args, status)
+
+
+def kill(shell, job_id):
+    '''
+        Функция команды kill: отменяет задачу %N. Команда останавливается в безопасной точке
+        (между файлами и элементами пакета); уже выполненная часть остаётся в журнале операций и отменяется undo.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. job_id (int) - Номер задачи
+
+        Вывод: None
+    '''
+    args = [f"%{job_id}"]
+    try:
+        job = shell.jobs.get(job_id)
+    except KeyError as e:
+        return _job_error(shell, 'kill', args, e)
+    job.cancel()
+    print(job.describe())
+    shell.add_log(f"kill %{job_id}")
+    shell.add_to_history('kill', args)
+
+
+def _job_error(shell, command, args, error):
+    error_msg = f"{command}: {error.args[0]}"
+    print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+    shell.add_log(f"{command} {' '.join(args)}".rstrip(), False, error_msg)
+    shell.add_to_history(command, args, False)
@@ -0,0 +1,230 @@
+import atexit
+import json
+import os
+import time
+from collections import deque
+from fileio import iter_lines_reversed
+
+
+class Journal:
+    '''
+        Класс журнала записей в формате JSON lines (одна запись на строку).
+
+        Записи только дописываются в конец файла, поэтому стоимость добавления не зависит
+        от длины журнала. Удаление записи - это дописанная метка {"removed": id}, а удалённые
+        записи физически вычищаются при периодическом сжатии файла. При открытии
+        загружается только хвост журнала, остальное читается с диска по требованию.
+    '''
+    def __init__(self, path, tail_size=100, fsync_every=32, fsync_interval=1.0, compact_every=256):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. path (str) - Путь к файлу журнала
+                2. tail_size (int) - Сколько последних записей держать в памяти
+                3. fsync_every (int) - Через сколько записей принудительно вызывать fsync
+                4. fsync_interval (float) - Через сколько секунд принудительно вызывать fsync
+                5. compact_every (int) - Через сколько "мёртвых" строк сжимать файл
+        '''
+        self.path = os.path.abspath(path)
+        self.tail_size = tail_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self._tail = deque(maxlen=tail_size)
+        self._last_id = 0
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._dead = 0
+        self._batch = 0
+
+    def load(self):
+        '''Функция которая загружает хвост журнала. Старый формат (JSON массив) конвертируется в JSON lines.'''
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                is_legacy = f.read(1) == b'['
+            if is_legacy:
+                self._migrate_legacy()
+
+            removed = set()
+            entries = []
+            for record in self._iter_records_reversed():
+                if 'removed' in record:
+                    removed.add(record['removed'])
+                    continue
+                self._last_id = max(self._last_id, record.get('id', 0))
+                if record.get('id') in removed:
+                    continue
+                if len(entries) >= self.tail_size:
+                    break
+                entries.append(record)
+            self._tail.extend(reversed(entries))
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+        atexit.register(self.close)
+
+    def _migrate_legacy(self):
+        '''Функция которая переписывает журнал старого формата (JSON массив) в формат JSON lines.'''
+        with open(self.path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for i, record in enumerate(records, 1):
+                record.setdefault('id', i)
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _iter_records_reversed(self):
+        '''Функция которая читает все записи журнала (включая метки удаления) с конца файла.'''
+        if self._file:
+            self._file.flush()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in iter_lines_reversed(f):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Недописанная строка после аварийного завершения
+                    continue
+
+    def iter_reversed(self):
+        '''
+            Функция которая перебирает живые записи журнала от новых к старым.
+            Читает файл с конца, поэтому досрочная остановка перебора не читает весь журнал.
+
+            Вывод: генератор записей (dict).
+        '''
+        removed = set()
+        for record in self._iter_records_reversed():
+            if 'removed' in record:
+                removed.add(record['removed'])
+            elif record.get('id') not in removed:
+                yield record
+
+    def tail(self, count):
+        '''
+            Функция которая возвращает последние count записей журнала.
+
+            Принимает:
+                1. count (int) - Количество записей
+
+            Вывод: список записей от старых к новым.
+        '''
+        if count <= len(self._tail):
+            return list(self._tail)[len(self._tail) - count:]
+        entries = []
+        for record in self.iter_reversed():
+            entries.append(record)
+            if len(entries) >= count:
+                break
+        entries.reverse()
+        return entries
+
+    def append(self, entry):
+        '''
+            Функция которая дописывает запись в конец журнала и присваивает ей id.
+
+            Принимает:
+                1. entry (dict) - Запись
+
+            Вывод: запись (dict) с заполненным полем id.
+        '''
+        self._last_id += 1
+        entry['id'] = self._last_id
+        self._write(entry)
+        self._tail.append(entry)
+        return entry
+
+    def remove(self, entry_id):
+        '''
+            Функция которая помечает запись удалённой.
+
+            Принимает:
+                1. entry_id (int) - id записи
+        '''
+        self._write({'removed': entry_id})
+        for entry in self._tail:
+            if entry.get('id') == entry_id:
+                self._tail.remove(entry)
+                break
+        self._dead += 2
+        if self._dead >= self.compact_every:
+            self.compact()
+
+    def _write(self, record):
+        '''Функция которая пишет строку в файл. fsync вызывается пачками, а не на каждую запись.'''
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record) + '\n')
+        self._pending += 1
+        if self._batch:
+            return
+        self._file.flush()
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        '''Функция которая сбрасывает буферы журнала на диск (flush + fsync).'''
+        if self._file is None or self._file.closed:
+            return
+        self._file.flush()
+        if self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self):
+        '''Функция которая переписывает журнал без удалённых записей и меток удаления.'''
+        self.sync()
+        removed = set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if '"removed"' in line:
+                    try:
+                        removed.add(json.loads(line)['removed'])
+                    except (ValueError, KeyError):
+                        pass
+
+        tmp_path = self.path + '.tmp'
+        with open(self.path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'removed' in record or record.get('id') in removed:
+                    continue
+                dst.write(line if line.endswith('\n') else line + '\n')
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        if self._file:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._dead = 0
+
+    def begin_batch(self):
+        '''Функция которая начинает пакетную запись: строки копятся в буфере файла до end_batch.'''
+        self._batch += 1
+
+    def end_batch(self):
+        '''Функция которая завершает пакетную запись и одним вызовом сбрасывает накопленные строки на диск.'''
+        self._batch = max(0, self._batch - 1)
+        if not self._batch:
+            self.sync()
+
+    def close(self):
+        '''Функция которая сбрасывает буферы и закрывает файл журнала.'''
+        if self._file and not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __bool__(self):
+        return bool(self._tail) or next(self.iter_reversed(), None) is not None
@@ -0,0 +1,109 @@
+import os
+from datetime import datetime
+
+# Ключи сортировки для ls: -S (по размеру, большие первыми), -t (по времени, новые первыми)
+SORT_KEYS = {
+    'name': lambda item: item[0].name,
+    'size': lambda item: (-item[1].st_size, item[0].name),
+    'time': lambda item: (-item[1].st_mtime, item[0].name),
+}
+
+
+def entry_stat(entry):
+    '''
+        Функция которая возвращает stat элемента директории. DirEntry кэширует результат,
+        поэтому повторные вызовы не делают системных вызовов. Для битых ссылок
+        возвращается stat самой ссылки.
+    '''
+    try:
+        return entry.stat()
+    except FileNotFoundError:
+        return entry.stat(follow_symlinks=False)
+
+
+def format_entry(entry, stat, flag_l):
+    '''
+        Функция которая форматирует строку вывода ls для одного элемента.
+
+        Принимает:
+            1. entry (os.DirEntry) - Элемент директории
+            2. stat (os.stat_result) - Результат stat элемента (или None без флага -l)
+            3. flag_l (bool) - Флаг подробного вывода
+
+        Вывод: строка (str).
+    '''
+    if not flag_l:
+        return entry.name
+    return f"{entry.name} \t{stat.st_size}\t{datetime.fromtimestamp(stat.st_mtime)}\t{oct(stat.st_mode)[-3:]}"
+
+
+def iter_entries(work_dir, flag_a=False, need_stat=False, cache=None):
+    '''
+        Функция которая перебирает содержимое директории через os.scandir по мере чтения.
+
+        Принимает:
+            1. work_dir (str) - Путь к директории
+            2. flag_a (bool) - Показывать скрытые файлы (начинающиеся с точки)
+            3. need_stat (bool) - Нужен ли stat для каждого элемента
+            4. cache (ListingCache) - Кэш содержимого директорий (None - читать напрямую)
+
+        Вывод: генератор пар (DirEntry, stat или None).
+    '''
+    if cache is not None:
+        for entry, stat in cache.iter_entries(work_dir, need_stat):
+            if flag_a or not entry.name.startswith('.'):
+                yield entry, stat
+        return
+    with os.scandir(work_dir) as it:
+        for entry in it:
+            if not flag_a and entry.name.startswith('.'):
+                continue
+            yield entry, entry_stat(entry) if need_stat else None
+
+
+def iter_listing(work_dir, flag_l=False, flag_a=False, sort_by='name', flag_R=False, cache=None, label='.'):
+    '''
+        Функция которая формирует строки вывода ls.
+
+        Принимает:
+            1. work_dir (str) - Путь к директории
+            2. flag_l (bool) - Флаг подробного вывода
+            3. flag_a (bool) - Показывать скрытые файлы
+            4. sort_by (str) - Ключ сортировки: 'name', 'size', 'time'. Если None - строки
+               выдаются сразу по мере чтения директории (потоковый режим, -U).
+            5. flag_R (bool) - Рекурсивный обход поддиректорий
+            6. cache (ListingCache) - Кэш содержимого директорий
+            7. label (str) - Путь, как его указал пользователь: из него строятся заголовки -R
+               ("deep:", "deep/b:"); без пути - "."
+
+        Вывод: генератор строк (str). Ошибка чтения корневой директории пробрасывается,
+        ошибки поддиректорий при -R выводятся как строки.
+    '''
+    need_stat = flag_l or sort_by in ('size', 'time')
+    stack = [work_dir]
+    first = True
+    while stack:
+        current = stack.pop()
+        subdirs = []
+        if flag_R:
+            if not first:
+                yield ''
+            rel = os.path.relpath(current, work_dir)
+            yield f"{label if rel == '.' else os.path.join(label, rel)}:"
+
+        try:
+            entries = iter_entries(current, flag_a, need_stat, cache)
+            if sort_by:
+                entries = sorted(entries, key=SORT_KEYS[sort_by])
+            for entry, stat in entries:
+                yield format_entry(entry, stat, flag_l)
+                if flag_R and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+        except OSError as e:
+            if first:
+                raise
+            yield f"ls: {e}"
+
+        first = False
+        # Стек LIFO: поддиректории кладутся в обратном порядке, чтобы обход шёл по порядку
+        stack.extend(reversed(subdirs))
@@ -0,0 +1,316 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+from collections import Counter, OrderedDict
+
+# Маски событий inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+# События, меняющие состав директории; остальные (IN_MODIFY, IN_ATTRIB) устаревают только stat
+STRUCTURE_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    '''
+        Класс неблокирующего дескриптора inotify (через ctypes, только Linux).
+        События не ждутся в отдельном потоке, а вычитываются при каждом обращении к кэшу.
+    '''
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        '''Функция которая ставит наблюдение за директорией. Вывод: дескриптор наблюдения (int).'''
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        '''Функция которая снимает наблюдение.'''
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        '''Функция которая вычитывает накопившиеся события. Вывод: список пар (wd, mask).'''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                events.append((wd, mask))
+                offset += EVENT_HEADER.size + length
+
+    def close(self):
+        os.close(self.fd)
+
+
+def fresh_stat(path):
+    '''Функция которая делает stat по пути (для битых ссылок - stat самой ссылки), минуя кэш DirEntry.'''
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return os.lstat(path)
+
+
+class ListingCache:
+    '''
+        Класс LRU-кэша содержимого директорий для ls.
+
+        Для каждой директории хранится список пар [DirEntry, stat]; stat заполняется лениво,
+        когда он впервые понадобился (ls -l, -S, -t). Состав директории считается устаревшим, если:
+            1. на Linux пришло событие inotify о создании, удалении или переименовании в ней;
+            2. без inotify - изменились mtime или inode самой директории.
+        stat элементов кэшируется только при наличии inotify (события изменения и смены атрибутов
+        сбрасывают их): без inotify изменение содержимого файла не видно по mtime директории,
+        поэтому stat читается заново при каждом вызове.
+        Команды shell, изменяющие файлы, дополнительно сбрасывают затронутые директории явно.
+        Объём кэша ограничен общим количеством элементов во всех директориях.
+    '''
+    def __init__(self, max_entries=200000, use_inotify=True):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. max_entries (int) - Максимальное суммарное количество элементов в кэше
+                2. use_inotify (bool) - Использовать inotify, если он доступен
+        '''
+        self.max_entries = max_entries
+        self.dirs = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.watches = {}
+        # Сколько незавершённых чтений пользуется каждым wd (одна директория - один wd)
+        self.scanning = Counter()
+        self._lock = threading.Lock()
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                # Не Linux или inotify недоступен - остаётся проверка по mtime
+                self.inotify = None
+
+    def _process_events(self):
+        for wd, mask in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                self._clear()
+                return
+            path = self.watches.get(wd)
+            if path is None:
+                continue
+            if mask & STRUCTURE_MASK:
+                self._drop(path, remove_watch=not mask & IN_IGNORED)
+            else:
+                self.dirs[path]['stats_valid'] = False
+
+    def _drop(self, path, remove_watch=True):
+        record = self.dirs.pop(path, None)
+        if record is None:
+            return
+        self.size -= len(record['entries'])
+        wd = record.get('wd')
+        if wd is not None:
+            self.watches.pop(wd, None)
+            if remove_watch and wd not in self.scanning:
+                self.inotify.rm_watch(wd)
+
+    def _clear(self):
+        for path in list(self.dirs):
+            self._drop(path)
+
+    def _is_fresh(self, path, record):
+        if record.get('wd') is not None:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_ino) == record['version']
+
+    def _start_scan(self, path):
+        record = {'wd': None, 'stats_valid': True}
+        if self.inotify is not None:
+            # Наблюдение ставится до чтения, чтобы не потерять изменения во время scandir
+            try:
+                record['wd'] = self.inotify.add_watch(path)
+            except OSError:
+                record['wd'] = None
+            if record['wd'] in self.watches:
+                # Та же директория уже наблюдается под другим путём (ссылка) - проверяем по mtime
+                record['wd'] = None
+            if record['wd'] is not None:
+                self.scanning[record['wd']] += 1
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._release_watch(record)
+            raise
+        record['version'] = (stat.st_mtime_ns, stat.st_ino)
+        return record
+
+    def _finish_scan(self, record):
+        wd = record['wd']
+        if wd is not None:
+            self.scanning[wd] -= 1
+            if not self.scanning[wd]:
+                del self.scanning[wd]
+
+    def _release_watch(self, record):
+        # Один и тот же wd достаётся параллельным чтениям той же директории: наблюдение снимается,
+        # только если оно не нужно ни кэшу, ни другим незавершённым чтениям
+        self._finish_scan(record)
+        wd = record['wd']
+        if wd is not None and wd not in self.watches and wd not in self.scanning:
+            self.inotify.rm_watch(wd)
+
+    def _lookup(self, path, need_stat):
+        if self.inotify is not None:
+            self._process_events()
+        record = self.dirs.get(path)
+        if record is not None and self._is_fresh(path, record):
+            self.dirs.move_to_end(path)
+            self.hits += 1
+            if not record['stats_valid']:
+                for pair in record['entries']:
+                    pair[1] = None
+                record['stats_valid'] = True
+            if not need_stat:
+                return [(entry, None) for entry, _ in record['entries']], None
+            if record['wd'] is None:
+                return [(entry, fresh_stat(entry.path)) for entry, _ in record['entries']], None
+            for pair in record['entries']:
+                if pair[1] is None:
+                    pair[1] = fresh_stat(pair[0].path)
+            return [tuple(pair) for pair in record['entries']], None
+        self._drop(path)
+        self.misses += 1
+        return None, self._start_scan(path)
+
+    def _store(self, path, record):
+        try:
+            stat = os.stat(path)
+            changed = (stat.st_mtime_ns, stat.st_ino) != record['version']
+        except OSError:
+            changed = True
+        if changed or path in self.dirs:
+            # Директория изменилась во время чтения или её уже закэшировало параллельное чтение
+            self._release_watch(record)
+            return
+        self._finish_scan(record)
+        if record['wd'] is not None:
+            self.watches[record['wd']] = path
+        self.dirs[path] = record
+        self.size += len(record['entries'])
+        while self.size > self.max_entries:
+            self._drop(next(iter(self.dirs)))
+
+    def iter_entries(self, path, need_stat=False):
+        '''
+            Функция которая перебирает содержимое директории: из кэша или, при промахе, по мере
+            чтения scandir, заполняя кэш по ходу. Поэтому ls -U выводит первые строки сразу и на
+            промахе. Директория больше max_entries элементов не кэшируется: как только предел
+            превышен, собранный список отбрасывается, а чтение продолжается без него.
+            Недочитанная (прерванная) директория тоже не кэшируется.
+
+            Принимает:
+                1. path (str) - Путь к директории
+                2. need_stat (bool) - Нужен ли stat для каждого элемента
+
+            Вывод: генератор пар (DirEntry, stat или None). Ошибки чтения директории пробрасываются.
+        '''
+        path = os.path.abspath(path)
+        with self._lock:
+            cached, record = self._lookup(path, need_stat)
+        if cached is not None:
+            yield from cached
+            return
+        # stat элементов кэшируется только при наличии inotify (см. описание класса)
+        cache_stats = record['wd'] is not None
+        entries = []
+        complete = False
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    stat = fresh_stat(entry.path) if need_stat else None
+                    if entries is not None:
+                        entries.append([entry, stat if cache_stats else None])
+                        if len(entries) > self.max_entries:
+                            entries = None
+                    yield entry, stat
+            complete = entries is not None
+        finally:
+            with self._lock:
+                if complete:
+                    record['entries'] = entries
+                    self._store(path, record)
+                else:
+                    self._release_watch(record)
+
+    def get(self, path, need_stat=False):
+        '''
+            Функция которая возвращает содержимое директории из кэша или читает его заново.
+
+            Принимает:
+                1. path (str) - Путь к директории
+                2. need_stat (bool) - Нужен ли stat для каждого элемента
+
+            Вывод: список пар (DirEntry, stat или None). Ошибки чтения директории пробрасываются.
+        '''
+        return list(self.iter_entries(path, need_stat))
+
+    def invalidate(self, *paths):
+        '''
+            Функция которая сбрасывает кэш для указанных путей: их родительских директорий,
+            самих путей и всех закэшированных поддиректорий.
+        '''
+        paths = {os.path.abspath(path) for path in paths}
+        with self._lock:
+            for path in paths:
+                self._drop(os.path.dirname(path))
+            # Один проход по кэшу: запись удаляется, если она сама или её предок есть среди путей
+            for cached in list(self.dirs):
+                current = cached
+                while True:
+                    if current in paths:
+                        self._drop(cached)
+                        break
+                    parent = os.path.dirname(current)
+                    if parent == current:
+                        break
+                    current = parent
+
+    def clear(self):
+        '''Функция которая полностью очищает кэш.'''
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        '''Функция которая возвращает счётчики кэша (dict).'''
+        return {'hits': self.hits, 'misses': self.misses, 'dirs': len(self.dirs), 'entries': self.size,
+                'inotify': self.inotify is not None}
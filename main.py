@@ -1,11 +1,30 @@
-from config import LOGGING_CONFIG
+from config import LOGGING_CONFIG, HISTORY_CONFIG, TRASH_CONFIG, OPERATIONS_CONFIG, LISTING_CACHE_CONFIG, DU_CONFIG, METRICS_CONFIG, JOBS_CONFIG
+from history_db import HistoryDB
+from fileio import iter_file, write_chunks, write_lines, format_range, current_input
+from commands import get_command, iter_tokens, UsageError
+from trash import Trash
+from shell_logging import start_queue_logging, stop_queue_logging
 import os
 import shutil
 import logging
 import logging.config
+import time
+import sys
+import argparse
+import copy
 from datetime import datetime
 from ansi import Colors
-import json 
+
+def files_touched(other_data):
+    '''Функция которая оценивает количество файлов, затронутых командой, по данным из истории.'''
+    if not other_data:
+        return 0
+    if 'files' in other_data:
+        return other_data['files']
+    if 'items' in other_data:
+        return sum(files_touched(item) or 1 for item in other_data['items'])
+    return 1 if any(key.endswith('path') for key in other_data) else 0
+
 
 class System_Shell:
     '''Основной класс shell'''
@@ -13,47 +32,103 @@ class System_Shell:
         '''Функция инициализатор. Инициализирует текущую директорию, историю команд, 
         настраивает логирование, загружает корзину и историю.'''
         self.current_dir = os.getcwd()
-        self.history = []  
-        self.history_file = ".history" 
-        self.trash_dir = ".trash"  
+        self.history_file = HISTORY_CONFIG['db_file']
+        self.history = HistoryDB(self.history_file, HISTORY_CONFIG['legacy_file'], HISTORY_CONFIG['synchronous'])
+        self.trash_dir = os.path.abspath(".trash")
+        self.trash = Trash(self.trash_dir, **TRASH_CONFIG)
+        self.operations_file = os.path.abspath(".operations")
+        self._operations = None
+        # Журнал загружается при первом обращении, в том числе из потока очистки корзины
+        self.trash.referenced.append(lambda: self.operations.trash_paths())
+        self.listing_cache = None
+        self.size_cache_file = os.path.abspath(DU_CONFIG['cache_file'])
+        self.size_cache = None
+        self.hash_cache = None
+        self.command_started = None
+        self.command_bytes = None
+        self.command_data = None
+        self._metrics = None
+        self._jobs = None
+        self.completer = None
+        self.last_status = True
+        self.interactive = True
         self.setup_logging()
         self.check_history()
 
+    # Журнал операций, метрики и таблица фоновых задач создаются (и их модули импортируются)
+    # при первом обращении, а не при запуске shell
+    @property
+    def operations(self):
+        if self._operations is None:
+            from operations import OperationJournal
+            self._operations = OperationJournal(self.operations_file, **OPERATIONS_CONFIG)
+        return self._operations
+
+    @operations.setter
+    def operations(self, value):
+        self._operations = value
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            from metrics import MetricsRegistry
+            self._metrics = MetricsRegistry(**METRICS_CONFIG)
+        return self._metrics
+
+    @property
+    def jobs(self):
+        if self._jobs is None:
+            from jobs import JobTable
+            self._jobs = JobTable(**JOBS_CONFIG)
+        return self._jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        self._jobs = value
+
     def setup_logging(self):
-        '''Функция которая загружает конфигурацию для логирования из файла config.py'''  
+        '''Функция которая загружает конфигурацию для логирования из файла config.py
+        и переносит запись в лог-файл в фоновый поток.'''  
+        stop_queue_logging()
         logging.config.dictConfig(LOGGING_CONFIG)
         self.logger = logging.getLogger('shell_logger')
+        start_queue_logging(self.logger)
         
-    def add_log(self, command, status=True, error_msg=""):
+    def add_log(self, command, status=True, error_msg="", nbytes=None):
         '''
             Функция которая добавляет записи в лог-файл shell.log.
+            Запись только кладётся в очередь, в файл её пишет фоновый поток.
 
             Принимает:
                 1. command (str) - выполненная команда
                 2. status (bool) - статус выполнения(успех / неудача)
                 3. error_msg (str) - сообщение об ошибке
+                4. nbytes (int) - количество прочитанных / записанных командой байт
 
             Вывод: None
         '''
+        self.command_bytes = nbytes
+        duration_ms = None
+        if self.command_started is not None:
+            duration_ms = round((time.perf_counter() - self.command_started) * 1000, 3)
+        extra = {'command': command, 'status': 'SUCCESS' if status else 'ERROR',
+                 'error': error_msg or None, 'duration_ms': duration_ms, 'bytes': nbytes}
         status = "SUCCESS" if status else f"ERROR: {error_msg}"
-        self.logger.info(f"{command} - {status}")
+        self.logger.info(f"{command} - {status}", extra=extra)
 
 
     def check_history(self):
-        '''Функция которая загружает историю команд из файла .history.'''
+        '''Функция которая открывает базу истории (записи в память не загружаются).'''
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    self.history = json.load(f)
-        except OSError as e:
+            self.history.load()
+        except (OSError, ValueError) as e:
             print(f"{Colors.RED}File with history didn't find{Colors.RESET}")
 
 
     def save_history(self):
-        '''Функция которая сохраняет последние 10 команд из списка в файл .history.'''
+        '''Функция которая фиксирует записи истории в базе.'''
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history[-10:], f)
+            self.history.sync()
         except OSError as e:
             print(f"{Colors.YELLOW}Could't save command history{Colors.RESET}")
 
@@ -78,49 +153,72 @@ class System_Shell:
             'current_dir': self.current_dir,
             'other_data': other_data or {}
         }
-        self.history.append(command_history_info)
-        self.save_history()
+        self.last_status = status
+        self.command_data = other_data
+        try:
+            self.history.append(command_history_info)
+        except OSError as e:
+            print(f"{Colors.YELLOW}Could't save command history{Colors.RESET}")
+
+    def invalidate_listing(self, *paths):
+        '''
+            Функция которая сбрасывает кэш ls для изменённых путей и их родительских директорий.
+
+            Принимает:
+                1. paths (str) - Изменённые пути
 
-    def ls(self, path=None, flag_l=False):
+            Вывод: None
+        '''
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(*(path for path in paths if path))
+
+    def ls(self, path=None, flag_l=False, flag_a=False, sort_by='name', flag_R=False):
         '''
             Функция которая выводит список содержимого в директории.
+            Содержимое читается через os.scandir, stat каждого элемента делается не более одного раза
+            и используется и для сортировки, и для вывода. Вывод пишется блоками по одному экрану.
+            Прочитанные директории хранятся в кэше ListingCache, который сбрасывается по mtime
+            директории или событиям inotify, поэтому повторный ls не обращается к диску.
 
             Принимает:
                 1. path (str) - Путь к директории. Если None, используется текущая директория.
                 2. flag_l (bool) - Флаг подробного вывода. 
+                3. flag_a (bool) - Флаг вывода скрытых файлов (начинающихся с точки).
+                4. sort_by (str) - Сортировка: 'name' (по умолчанию), 'size' (-S), 'time' (-t).
+                   None (-U) - без сортировки, вывод начинается до окончания чтения директории.
+                5. flag_R (bool) - Флаг рекурсивного вывода поддиректорий.
 
             Вывод:
                 При отсутствии флага -l выводит список файлов и директорий в указаной папке.
                 Если есть флаг - l, то выводит подробный список файлов и директорий в указаной папке(размер, время последнего изменения, права доступа).
         '''
+        flags = ''.join(flag for flag, on in (('l', flag_l), ('a', flag_a), ('S', sort_by == 'size'),
+                                              ('t', sort_by == 'time'), ('U', sort_by is None), ('R', flag_R)) if on)
+        args = ([f"-{flags}"] if flags else []) + ([path] if path else [])
         try:
             if path:
-                work_dir = path
+                work_dir = os.path.join(self.current_dir, path)
             else:
                 work_dir = self.current_dir
 
-            elems = os.listdir(work_dir)
-            if not flag_l:
-                print("\n".join(elems))
-            else:
-                for elem in elems:
-                    full_path = os.path.join(work_dir, elem)
-                    stat = os.stat(full_path)
-                    print(f"{elem} \t{stat.st_size}\t{datetime.fromtimestamp(stat.st_mtime)}\t{oct(stat.st_mode)[-3:]}")
+            from listing import iter_listing
+            write_lines(iter_listing(work_dir, flag_l, flag_a, sort_by, flag_R, self.open_listing_cache(), path or '.'))
             
-            self.add_log(f"ls {'-l ' if flag_l else ''}{path if path else ''}")
-            self.add_to_history('ls', [path] if path else [])
+            self.add_log(f"ls {' '.join(args)}")
+            self.add_to_history('ls', args)
 
         except OSError as e:
             error_msg = f"ls: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"ls {'-l ' if flag_l else ''}{path if path else ''}", False, error_msg)
-            self.add_to_history('ls', [path] if path else [], False)
+            self.add_log(f"ls {' '.join(args)}", False, error_msg)
+            self.add_to_history('ls', args, False)
 
 
     def cd(self, path):
         '''
             Функция которая осуществляет смену рабочей директории.
+            Меняется только current_dir shell (все пути команд строятся от неё), а не рабочая
+            директория процесса, поэтому фоновые задачи и сеансы сервера не мешают друг другу.
 
             Принимает:
                 1. path (str) - Путь к новой директории
@@ -137,8 +235,11 @@ class System_Shell:
             
             if not os.path.exists(new_dir):
                 raise FileNotFoundError(f"Directory '{new_dir}' doesn't exist")
+            if not os.path.isdir(new_dir):
+                raise NotADirectoryError(f"'{new_dir}' is not a directory")
+            if not os.access(new_dir, os.X_OK):
+                raise PermissionError(f"Permission denied: '{new_dir}'")
             
-            os.chdir(new_dir)
             self.current_dir = new_dir
             self.add_log(f"cd {path}")
             self.add_to_history('cd', [path])
@@ -149,329 +250,878 @@ class System_Shell:
             self.add_log(f"cd {path}", False, error_msg)
             self.add_to_history('cd', [path], False)
 
-    def cat(self, path):
+    def cat(self, path=None, byte_range=None, line_range=None):
         '''
             Функция которая выводит содержимое указанного файла.
+            Файл читается и выводится потоково блоками фиксированного размера, поэтому
+            расход памяти не зависит от размера файла.
 
             Приниимает:
-                1. path (str) - Путь к файлу
+                1. path (str) - Путь к файлу. Без него выводится вход конвейера
+                2. byte_range (tuple) - Диапазон байт (start, end), (-N, None) - последние N байт
+                3. line_range (tuple) - Диапазон строк (start, end), (-N, None) - последние N строк
             
             Вывод:
-                Выводит содержимое указанного файла. Если путь указан на директорию, то выводит ошибку.         
+                Выводит содержимое указанного файла (или его часть). Если путь указан на директорию
+                или файл бинарный, то выводит ошибку.
         '''
+        args = []
+        if byte_range:
+            args.append(f"--bytes={format_range(byte_range)}")
+        if line_range:
+            args.append(f"--lines={format_range(line_range)}")
+        if path is None:
+            if current_input() is None:
+                return self.usage_error("cat: missing file operand")
+            if byte_range or line_range:
+                return self.usage_error("cat: --bytes and --lines need a file")
+        else:
+            args.append(path)
+
         try:
-            full_path = os.path.join(self.current_dir, path)
-            
-            if os.path.isdir(full_path):
-                raise IsADirectoryError(f"{path} is a directory")
-            
-            with open(full_path, 'r', encoding='utf-8') as f:
-                print(f"{Colors.BLUE}{f.read()}{Colors.RESET}")
-            
-            self.add_log(f"cat {path}")
-            self.add_to_history('cat', [path])
+            if path is None:
+                chunks = current_input()
+            else:
+                full_path = os.path.join(self.current_dir, path)
+
+                if os.path.isdir(full_path):
+                    raise IsADirectoryError(f"{path} is a directory")
+                chunks = iter_file(full_path, byte_range, line_range)
+
+            nbytes = write_chunks(chunks, prefix=Colors.BLUE, suffix=Colors.RESET)
+
+            self.add_log(f"cat {' '.join(args)}", nbytes=nbytes)
+            self.add_to_history('cat', args)
 
         except OSError as e:
             error_msg = f"cat: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"cat {path}", False, error_msg)
-            self.add_to_history('cat', [path], False)
+            self.add_log(f"cat {' '.join(args)}", False, error_msg)
+            self.add_to_history('cat', args, False)
+
+    def run_batch(self, func, items, jobs=None):
+        '''
+            Функция которая выполняет func для каждого элемента пакета в пуле потоков
+            (один элемент выполняется без пула).
+
+            Принимает:
+                1. func (callable) - Функция обработки одного элемента
+                2. items (list) - Элементы пакета
+                3. jobs (int) - Максимальное количество потоков
+
+            Вывод: кортеж (results, errors): результаты успешных элементов в исходном порядке и список OSError.
+        '''
+        from jobs import JobCancelled, current_job, job_context, check_cancelled
+        # Потоки пула выполняют элементы от имени той же фоновой задачи, что и команда
+        job = current_job()
+
+        def call(item):
+            try:
+                with job_context(job):
+                    check_cancelled(job)
+                    return func(item), None
+            except OSError as e:
+                return None, e
+
+        if len(items) == 1:
+            outcomes = [call(items[0])]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            workers = min(len(items), jobs or min(32, (os.cpu_count() or 1) + 4))
+            with self.trash.batch(), ThreadPoolExecutor(max_workers=workers) as pool:
+                outcomes = list(pool.map(call, items))
+        errors = [error for _, error in outcomes if error is not None]
+        cancelled = [error for error in errors if isinstance(error, JobCancelled)]
+        if len(cancelled) > 1:
+            # Об отмене достаточно одного сообщения, а не по одному на каждый пропущенный элемент
+            errors = [error for error in errors if not isinstance(error, JobCancelled)] + cancelled[:1]
+        return [result for result, error in outcomes if error is None], errors
+
+    def finish_batch(self, command, args, results, errors):
+        '''
+            Функция которая записывает результат изменяющей команды (cp, mv, rm): пакет из любого
+            количества элементов - это одна операция в журнале операций (отменяется одним undo),
+            одна запись в логе и одна запись в истории.
+
+            Принимает:
+                1. command (str) - Имя команды
+                2. args (list) - Аргументы команды
+                3. results (list) - Данные успешно обработанных элементов (для undo)
+                4. errors (list) - Ошибки остальных элементов
+
+            Вывод: None
+        '''
+        for error in errors:
+            print(f"{Colors.RED}{command}: {str(error)}{Colors.RESET}")
+
+        other_data = {}
+        if len(results) == 1:
+            other_data = results[0]
+        elif results:
+            other_data = {'items': results, 'bytes': sum(item.get('bytes') or 0 for item in results)}
+        if results:
+            self.invalidate_listing(*(value for item in results for key, value in item.items()
+                                      if key in ('path', 'src_path', 'dst_path', 'dir_path')))
+            self.operations.record(command, args, other_data, self.current_dir)
+
+        error_msg = f"{command}: {str(errors[0])}" if errors else ""
+        if len(errors) > 1:
+            error_msg += f" (and {len(errors) - 1} more)"
+        self.add_log(f"{command} {' '.join(args)}", not errors, error_msg, nbytes=other_data.get('bytes'))
+        self.add_to_history(command, args, not errors, other_data)
 
-    def cp(self, src, dst, flag_r=False):
+    def target_dir(self, command, sources, dst):
+        '''Функция которая проверяет, что при нескольких источниках назначение - существующая директория.'''
+        if len(sources) > 1 and not os.path.isdir(os.path.join(self.current_dir, dst)):
+            raise NotADirectoryError(f"target '{dst}' is not a directory")
+
+    def cp(self, *paths, flag_r=False, jobs=None, reflink=None, link=False, verify=False, update=False):
         '''
-            Функция которая копирует файлы или директории.
+            Функция которая копирует файлы или директории: cp SRC DST или cp SRC... DIR.
+            Шаблоны в путях (*.log, **/*.tmp) раскрываются один раз при разборе команды,
+            несколько источников копируются пулом потоков и записываются в историю одной
+            операцией, которую undo отменяет целиком.
+            Директории копируются движком CopyEngine: дерево обходится один раз, файлы копируются
+            пулом потоков внутри ядра, а перед началом проверяется свободное место.
+            С --reflink файлы клонируются (copy-on-write), с --link создаются жёсткие ссылки -
+            в обоих случаях данные не копируются. Использованный способ сохраняется в истории.
+            С --verify каждая копия сверяется с источником по контрольной сумме (источник хэшируется
+            по ходу копирования и читается один раз); при несовпадении элемент откатывается как при undo.
+            С --update (-u) существующее назначение не перезаписывается целиком: копируются только новые
+            и изменённые файлы (см. sync без --delete).
 
             Принимает:
-                1. src (str) - Путь к исходному файлу или директории
-                2. dst (str) -  Путь к целевому файлу или директории
-                3. flag_r (bool) - Флаг рекурсивного копирования, работает только для директорий
+                1. paths (str) - Пути к исходным файлам или директориям и последним - путь назначения
+                2. flag_r (bool) - Флаг рекурсивного копирования, работает только для директорий
+                3. jobs (int) - Количество потоков копирования (--jobs N)
+                4. reflink (str) - 'auto' - клонировать, если ФС поддерживает, иначе копировать;
+                   'always' - только клонировать (--reflink=auto|always)
+                5. link (bool) - Создавать жёсткие ссылки вместо копий (--link, -l)
+                6. verify (bool) - Проверять копии по контрольным суммам (--verify)
+                7. update (bool) - Копировать только новые и изменённые файлы (--update, -u)
 
             Вывод: None.
         '''
+        mode = reflink or ('link' if link else 'copy')
+        args = (['-r'] if flag_r else []) + ([f'--jobs={jobs}'] if jobs else []) + \
+               ([f'--reflink={reflink}'] if reflink else []) + (['--link'] if link else []) + \
+               (['--verify'] if verify else []) + (['--update'] if update else []) + list(paths)
+        *sources, dst = paths
         try:
-            src_path = os.path.join(self.current_dir, src)
-            dst_path = os.path.join(self.current_dir, dst)
+            self.target_dir('cp', sources, dst)
+            if update:
+                # Синхронизация каждого источника сама распараллелена, поэтому источники обрабатываются по очереди
+                results, errors = [], []
+                for src in sources:
+                    try:
+                        items, item_errors = self.update_item(src, dst, flag_r, jobs)
+                        results.extend(items)
+                        errors.extend(item_errors)
+                    except OSError as e:
+                        errors.append(e)
+                self.finish_batch('cp', args, results, errors)
+                return
+            from checksum import open_cache
+            cache = open_cache(self) if verify else None
+            results, errors = self.run_batch(lambda src: self.copy_item(src, dst, flag_r, jobs, mode, cache),
+                                             sources, jobs)
+            self.save_hash_cache(cache)
+            self.finish_batch('cp', args, results, errors)
 
-            if not os.path.exists(src_path):
-                raise FileNotFoundError(f"File '{src}' doesn't exist")
-            
-            if os.path.isdir(dst_path):
-                dst_path = os.path.join(dst_path, src_path.name)
-            
-            if os.path.exists(dst_path):
-                if os.path.isfile(dst_path):
-                    os.remove(dst_path)
-                elif os.path.isdir(dst_path):
-                    shutil.rmtree(dst_path)
+        except OSError as e:
+            error_msg = f"cp: {str(e)}"
+            print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+            self.add_log(f"cp {' '.join(args)}", False, error_msg)
+            self.add_to_history('cp', args, False)
 
+    def copy_item(self, src, dst, flag_r=False, jobs=None, mode='copy', verify=None):
+        '''
+            Функция которая копирует один файл или директорию (элемент пакета cp).
+            verify - кэш контрольных сумм (HashCache), если копию нужно проверить.
+
+            Вывод: данные для истории и undo (dict).
+        '''
+        from checksum import ChecksumMismatch
+        from operations import undo_operation
+        src_path = os.path.join(self.current_dir, src)
+        dst_path = os.path.join(self.current_dir, dst)
+
+        if not os.path.exists(src_path):
+            raise FileNotFoundError(f"File '{src}' doesn't exist")
+
+        if os.path.isdir(dst_path):
+            dst_path = os.path.join(dst_path, os.path.basename(os.path.normpath(src_path)))
+
+        other_data = {'src_path': os.path.abspath(src_path), 'dst_path': os.path.abspath(dst_path)}
+        if os.path.lexists(dst_path):
+            if os.path.samefile(src_path, dst_path):
+                raise OSError(f"'{src}' and '{dst}' are the same file")
+            # Заменяемый файл или директория сохраняются в корзине, чтобы undo мог их вернуть
+            entry = self.trash.put(other_data['dst_path'])
+            other_data.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+
+        try:
             if flag_r and os.path.isdir(src_path):
-                shutil.copytree(src_path, dst_path)
-            else:
+                from copy_engine import CopyEngine
+                other_data.update(CopyEngine(jobs, mode=mode, verify=verify).copy_tree(src_path, dst_path))
+            elif os.path.isdir(src_path):
+                raise IsADirectoryError(f"'{src}' is a directory (use -r)")
+            elif verify is not None:
+                from checksum import copy_file_hashed, verify_copy
+                from copy_engine import transfer_file
+                if mode == 'copy':
+                    (nbytes, digest), strategy = copy_file_hashed(src_path, dst_path, verify), 'copy'
+                else:
+                    (nbytes, strategy), digest = transfer_file(src_path, dst_path, mode=mode), None
+                other_data.update({'bytes': nbytes, 'strategy': strategy})
+                verify_copy(src_path, dst_path, verify, digest)
+            elif mode == 'copy':
                 shutil.copy2(src_path, dst_path)
-            
-            self.add_log(f"cp {'-r ' if flag_r else ''}{src} {dst}")
-            self.add_to_history('cp', [src, dst, '-r'] if flag_r else [src, dst], other_data={'src_path': src_path, 'dst_path': dst_path})
-        
+                other_data.update({'bytes': os.path.getsize(dst_path), 'strategy': 'copy'})
+            else:
+                from copy_engine import transfer_file
+                nbytes, strategy = transfer_file(src_path, dst_path, mode=mode)
+                other_data.update({'bytes': nbytes, 'strategy': strategy})
+        except ChecksumMismatch:
+            # Копия не совпала с источником: откатываем элемент по данным для undo
+            # (копия уходит в корзину, заменённый файл возвращается на место)
+            undo_operation(self, {'command': 'cp', 'data': other_data})
+            raise
+        except BaseException:
+            # Любая другая ошибка (отмена задачи, нехватка места, нет прав): частичная копия удаляется,
+            # заменённый элемент возвращается - состояние как до команды
+            self.discard_copy(other_data)
+            raise
+        if verify is not None:
+            other_data['verified'] = verify.algorithm
+        return other_data
+
+    def discard_copy(self, other_data):
+        '''
+            Функция которая откатывает неудавшееся копирование элемента: удаляет то, что успело
+            появиться на месте назначения, и возвращает из корзины заменённый элемент.
+
+            Принимает:
+                1. other_data (dict) - Данные элемента (dst_path и, если назначение заменялось, replaced_trash_*)
+
+            Вывод: None
+        '''
+        dst_path = other_data['dst_path']
+        try:
+            if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                from copy_engine import remove_tree
+                remove_tree(dst_path)
+            elif os.path.lexists(dst_path):
+                os.remove(dst_path)
+            if 'replaced_trash_id' in other_data:
+                self.trash.restore(other_data['replaced_trash_id'], other_data['replaced_trash_path'], dst_path)
         except OSError as e:
-            error_msg = f"cp: {str(e)}"
-            print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"cp {'-r ' if flag_r else ''}{src} {dst}", False, error_msg)
-            self.add_to_history('cp', ['-r', src, dst] if flag_r else [src, dst], False)
+            where = f" (replaced item is in '{other_data['replaced_trash_path']}')" \
+                if 'replaced_trash_path' in other_data else ""
+            print(f"{Colors.YELLOW}cp: couldn't roll back '{dst_path}': {e}{where}{Colors.RESET}")
 
-    def mv(self, src, dst):
+    def update_item(self, src, dst, flag_r=False, jobs=None):
         '''
-            Функция которая перемещяет или переименовывает файлы или директории.
+            Функция которая копирует один источник cp --update: файл - только если он новее или другого
+            размера, директорию - инкрементальной синхронизацией (SyncEngine).
+
+            Вывод: кортеж (данные для истории и undo (list), ошибки (list)).
+        '''
+        from sync_engine import SyncEngine
+        from config import SYNC_CONFIG
+        src_path = os.path.join(self.current_dir, src)
+        dst_path = os.path.join(self.current_dir, dst)
+
+        if not os.path.exists(src_path):
+            raise FileNotFoundError(f"File '{src}' doesn't exist")
+        if os.path.isdir(dst_path):
+            dst_path = os.path.join(dst_path, os.path.basename(os.path.normpath(src_path)))
+
+        if os.path.isdir(src_path):
+            if not flag_r:
+                raise IsADirectoryError(f"'{src}' is a directory (use -r)")
+            engine = SyncEngine(jobs, manifest=SYNC_CONFIG['manifest'])
+            with self.trash.batch():
+                return engine.apply(engine.plan(src_path, dst_path), self.trash)
+
+        if os.path.isfile(dst_path):
+            src_stat, dst_stat = os.stat(src_path), os.stat(dst_path)
+            if src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns <= dst_stat.st_mtime_ns:
+                return [], []
+        return [self.copy_item(src, dst)], []
+
+    def mv(self, *paths, jobs=None, verify=False):
+        '''
+            Функция которая перемещяет или переименовывает файлы или директории: mv SRC DST или mv SRC... DIR.
+            На одном устройстве перемещение - это один атомарный os.replace. Между устройствами файлы
+            переносятся потоково по одному с контрольными точками, поэтому прерванное перемещение
+            продолжается повторным вызовом той же команды. Заменяемый файл назначения попадает в корзину.
+            Несколько источников перемещаются пулом потоков и отменяются одним undo.
+            С --verify при переносе между устройствами исходный файл удаляется только после того,
+            как копия совпала с ним по контрольной сумме; при несовпадении элемент возвращается на место.
 
             Принимает:
-                1. src (str) - Путь к исходному файлу или директории
-                2. dst (str) - Путь к целевому файлу или директории
+                1. paths (str) - Пути к исходным файлам или директориям и последним - путь назначения
+                2. jobs (int) - Количество потоков для нескольких источников (--jobs N)
+                3. verify (bool) - Проверять перенесённые файлы по контрольным суммам (--verify)
             
                 Вывод: None.
         '''
+        args = ([f'--jobs={jobs}'] if jobs else []) + (['--verify'] if verify else []) + list(paths)
+        *sources, dst = paths
         try:
-            src_path = os.path.join(self.current_dir, src)
-            dst_path = os.path.join(self.current_dir, dst)
+            self.target_dir('mv', sources, dst)
+            from checksum import open_cache
+            cache = open_cache(self) if verify else None
+            results, errors = self.run_batch(lambda src: self.move_item(src, dst, cache), sources, jobs)
+            self.save_hash_cache(cache)
+            self.finish_batch('mv', args, results, errors)
 
-            if not os.path.exists(src_path):
-                raise FileNotFoundError(f"File '{src}' doesn't exist")
-            
-            if os.path.isdir(dst_path):
-                dst_path = os.path.join(dst_path, src_path.name)
-            
-            if os.path.exists(dst_path):
-                if os.path.isfile(dst_path):
-                    os.remove(dst_path)
-                elif os.path.isdir(dst_path):
-                    shutil.rmtree(dst_path)
-            
-            shutil.move(src_path, dst_path)
-            self.add_log(f"mv {src} {dst}")
-            self.add_to_history('mv', [src, dst], other_data={'src_path': src_path, 'dst_path': dst_path})
-        
         except OSError as e:
             error_msg = f"mv: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"mv {src} {dst}", False, error_msg)
-            self.add_to_history('mv', [src, dst], False)
+            self.add_log(f"mv {' '.join(args)}", False, error_msg)
+            self.add_to_history('mv', args, False)
 
-    def rm(self, file, flag_r=False):
+    def move_item(self, src, dst, verify=None):
         '''
-            Функция которая удаляет указанный файл или директорию.
+            Функция которая перемещает один файл или директорию (элемент пакета mv).
+            verify - кэш контрольных сумм (HashCache), если перенесённые файлы нужно проверить.
 
-            Принимает:
-                1. file (str) - Имя файла или директории для удаления
-                2. flag_r (bool) - Флаг рекурсивного удаления директории. Работает только для директорий.
-
-            Вывод: None.
+            Вывод: данные для истории и undo (dict).
         '''
-        try:
-            path = os.path.join(self.current_dir, file)
+        from checksum import ChecksumMismatch
+        from move_engine import move_path, move_across_devices, load_checkpoint, checkpoint_path
+        src_path = os.path.join(self.current_dir, src)
+        dst_path = os.path.join(self.current_dir, dst)
+
+        if not os.path.lexists(src_path):
+            raise FileNotFoundError(f"File '{src}' doesn't exist")
 
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"File '{file}' doesn't exist")
+        if os.path.isdir(dst_path) and not load_checkpoint(src_path, dst_path):
+            dst_path = os.path.join(dst_path, os.path.basename(os.path.normpath(src_path)))
 
+        other_data = {'src_path': os.path.abspath(src_path), 'dst_path': os.path.abspath(dst_path)}
+        if os.path.lexists(dst_path) and not load_checkpoint(src_path, dst_path):
+            if os.path.samefile(src_path, dst_path):
+                raise OSError(f"'{src}' and '{dst}' are the same file")
+            # Файл заменяется атомарно, а его прежнее содержимое сохраняется в корзине жёсткой ссылкой
+            replace_file = os.path.isfile(dst_path) and not os.path.isdir(src_path)
+            entry = self.trash.put(other_data['dst_path'], link=replace_file)
+            other_data.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+
+        try:
+            other_data.update(move_path(src_path, dst_path, verify=verify))
+        except ChecksumMismatch:
+            # Исходный файл удаляется только после проверки копии, поэтому откат - как undo:
+            # уже перенесённая часть дерева возвращается в src, заменённый элемент - из корзины
+            os.remove(checkpoint_path(dst_path))
+            if os.path.lexists(dst_path):
+                move_across_devices(dst_path, src_path)
+            if 'replaced_trash_id' in other_data:
+                self.trash.restore(other_data['replaced_trash_id'], other_data['replaced_trash_path'],
+                                   other_data['dst_path'])
+            raise
+        if verify is not None:
+            other_data['verified'] = verify.algorithm
+        return other_data
 
-            if file in ["/", ".."] or os.path.abspath(path) == os.path.abspath("/"):
-                raise PermissionError("Can't delete root directory")
+    def save_hash_cache(self, cache):
+        '''Функция которая сохраняет кэш контрольных сумм после cp / mv --verify (ошибка записи не прерывает команду).'''
+        if cache is None:
+            return
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"{Colors.YELLOW}Couldn't save hash cache: {e}{Colors.RESET}")
 
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            trash_path = os.path.join(self.trash_dir, f"{file}_{timestamp}")
+    def rm(self, *files, flag_r=False, flag_f=False, jobs=None):
+        '''
+            Функция которая удаляет указанные файлы или директории.
+            Удаление - это переименование в корзину на той же файловой системе, поэтому оно
+            выполняется мгновенно для деревьев любого размера и может быть отменено командой undo.
+            Место в корзине освобождает фоновый поток очистки. Несколько путей (или шаблон)
+            удаляются одним пакетом и восстанавливаются одним undo.
 
-            if flag_r and os.path.isdir(path):
-                confirm = input(f"Remove directory '{file}' recursivly? (y/n): ")
-                if confirm.lower() == 'y':
-                    shutil.rmtree(path)
+            Принимает:
+                1. files (str) - Имена файлов или директорий для удаления
+                2. flag_r (bool) - Флаг рекурсивного удаления директории. Работает только для директорий.
+                3. flag_f (bool) - Флаг удаления без подтверждения.
+                4. jobs (int) - Количество потоков для нескольких путей (--jobs N)
+
+            Вывод: None.
+        '''
+        args = (['-r'] if flag_r else []) + list(files)
+        try:
+            dirs = [file for file in files if os.path.isdir(os.path.join(self.current_dir, file))
+                    and not os.path.islink(os.path.join(self.current_dir, file))]
+            if dirs and flag_r and self.interactive and not flag_f:
+                if len(files) == 1:
+                    confirm = input(f"Remove directory '{files[0]}' recursivly? (y/n): ")
                 else:
+                    confirm = input(f"Remove {len(files)} items ({len(dirs)} directories) recursivly? (y/n): ")
+                if confirm.lower() != 'y':
                     print("Operation cancelled")
                     return
-            else:
-                os.remove(path)
-            
-            self.add_log(f"rm {'-r ' if flag_r else ''}{file}")
-            self.add_to_history('rm', [file, '-r'] if flag_r else [file], other_data={'path': path, 'trash_path': trash_path})
-        
+
+            results, errors = self.run_batch(lambda file: self.remove_item(file, flag_r), list(files), jobs)
+            self.finish_batch('rm', args, results, errors)
+
         except OSError as e:
             error_msg = f"rm: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"rm {'-r ' if flag_r else ''}{file}", False, error_msg)
-            self.add_to_history('rm', [file, '-r'] if flag_r else [file], False)
+            self.add_log(f"rm {' '.join(args)}", False, error_msg)
+            self.add_to_history('rm', args, False)
+
+    def remove_item(self, file, flag_r=False):
+        '''
+            Функция которая перемещает в корзину один файл или директорию (элемент пакета rm).
+
+            Вывод: данные для истории и undo (dict).
+        '''
+        path = os.path.join(self.current_dir, file)
 
-    def show_history(self, count=5):
+        if not os.path.lexists(path):
+            raise FileNotFoundError(f"File '{file}' doesn't exist")
+
+        if file in ["/", ".."] or os.path.abspath(path) == os.path.abspath("/"):
+            raise PermissionError("Can't delete root directory")
+
+        abs_path = os.path.abspath(path)
+        if os.path.commonpath([abs_path, self.trash_dir]) in (abs_path, self.trash_dir):
+            raise PermissionError("Can't delete trash directory")
+
+        if os.path.isdir(path) and not os.path.islink(path) and not flag_r:
+            raise IsADirectoryError(f"'{file}' is a directory")
+
+        entry = self.trash.put(abs_path)
+        return {'path': abs_path, 'trash_path': entry['trash_path'], 'trash_id': entry['id']}
+
+    def show_history(self, *args, since=None, until=None, failed=False, command=None, directory=None):
         '''
-            Функция которая выводит историю выполненных команд.
+            Функция которая выводит историю выполненных команд. Поиск выполняется запросом
+            к базе истории по индексам, вся история в память не загружается.
 
             Принимает:
-                1. count (int) - Количество команд для показеа (по умолчанию 5)
-            
+                1. args - [N] или grep PATTERN [N]: количество команд для показа (по умолчанию 5,
+                   с фильтрами - 100) и подстрока строки команды для поиска
+                2. since (str) - Только команды не раньше времени (--since 2h, --since 2025-01-01)
+                3. until (str) - Только команды раньше времени (--until)
+                4. failed (bool) - Только неуспешные команды (--failed)
+                5. command (str) - Только команды с этим именем (--command cp)
+                6. directory (str) - Только команды, выполненные в директории (--dir)
+
             Вывод:
-                Выводит команды в порядке от новой к старым(статус, время выполнения, аргументами).
+                Выводит команды в порядке от старых к новым (id, статус, время выполнения, аргументы).
         '''
+        args = list(args)
+        pattern = None
+        if args and args[0] == 'grep':
+            if len(args) < 2:
+                return self.usage_error("history: grep requires a pattern")
+            pattern = args[1]
+            args = args[2:]
+        if len(args) > 1:
+            return self.usage_error("history: too many arguments")
+        if args and not args[0].isdigit():
+            return self.usage_error(f"history: invalid count: '{args[0]}'")
+        count = int(args[0]) if args else None
+        if count is None:
+            filtered = pattern or since or until or failed or command or directory
+            count = 100 if filtered else 5
+        if directory:
+            directory = os.path.abspath(os.path.join(self.current_dir, directory))
+
+        history_args = (['grep', pattern] if pattern else []) + [str(count)]
+        history_args += [f"--since={since}"] if since else []
+        history_args += [f"--until={until}"] if until else []
+        history_args += ['--failed'] if failed else []
+        history_args += [f"--command={command}"] if command else []
+        history_args += [f"--dir={directory}"] if directory else []
+        log_line = f"history {' '.join(history_args)}"
         try:
-            if not self.history:
+            entries = self.history.search(pattern, since, until, failed, command, directory, limit=count)
+            if not entries:
                 print(f"{Colors.YELLOW}No command in history{Colors.RESET}")
                 return
-            
-            if len(self.history) > count:
-                start_idx = len(self.history) - count
-            else:
-                start_idx = 0
 
-            i = start_idx + 1
-            for info in self.history[start_idx:]:
-                if info.get('status', True):
-                    status = "SUCCESS"
-                else:
-                    status = "ERROR"
-                    
-                timestamp = datetime.fromisoformat(info['time']).strftime('%H:%M:%S')
-                args = []
-                for arg in info['args']:
-                    args.append(str(arg))
-                str_args = ' '.join(args)
-                    
-                print(f"{i} {status} [{timestamp}] {info['command']} {str_args}")
-                i += 1
-                
-            self.add_log(f"history {count}")
-            self.add_to_history('history', [str(count)])
+            def format_entries():
+                for info in entries:
+                    if info.get('status', True):
+                        status = "SUCCESS"
+                    else:
+                        status = "ERROR"
+
+                    timestamp = datetime.fromisoformat(info['time']).strftime('%H:%M:%S')
+                    args = []
+                    for arg in info['args']:
+                        args.append(str(arg))
+                    str_args = ' '.join(args)
+
+                    yield f"{info['id']} {status} [{timestamp}] {info['command']} {str_args}"
+
+            write_lines(format_entries())
+            self.add_log(log_line)
+            self.add_to_history('history', history_args)
         except OSError as e:
             error_msg = f"history: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log(f"history {count}", False, error_msg)
-            self.add_to_history('history', [str(count)], False)
+            self.add_log(log_line, False, error_msg)
+            self.add_to_history('history', history_args, False)
 
-    def undo_last(self):
+    def undo(self, count=1, to_id=None):
         '''
-            Функция которая отменяет результат выполнения последней команды.(последней команды со статусом success).
-            Поддерживает отмену команд: cp, rm, mv.
+            Функция которая отменяет последние изменяющие команды (cp, mv, rm), начиная с самой новой.
+            Операции берутся из журнала операций .operations, а не из истории, поэтому поиск
+            не зависит от длины истории. Отменённые операции можно повторить командой redo.
+
+            Принимает:
+                1. count (int) - Количество отменяемых операций (по умолчанию 1)
+                2. to_id (int) - Отменить все операции вплоть до операции с этим id (undo --to ID)
+
+            Вывод: None
         '''
+        from operations import undo_operation
+        args = [f"--to={to_id}"] if to_id is not None else ([str(count)] if count != 1 else [])
         try:
-            if not self.history:
+            targets = self.operations.undo_targets(count, to_id)
+            if not targets:
                 print(f"{Colors.YELLOW}No commands to cancel{Colors.RESET}")
                 return
 
-            last_command = None
-            for info in reversed(self.history):
-                if info['command'] in ['cp', 'mv', 'rm'] and info.get('status', True):
-                    last_command = info
-                    break
-            
-            if not last_command:
-                print(f"{Colors.YELLOW}No commands to cansel{Colors.RESET}")
-                return
-            
-            command = last_command['command']
-            args = last_command['args']
-            other_data = last_command.get('other_data', {})
-            
-            
-            if command == 'cp':
-                dst_path = other_data.get('dst_path')
-                if dst_path and os.path.exists(dst_path):
-                    if os.path.isfile(dst_path):
-                        os.remove(dst_path)
-                    elif os.path.isdir(dst_path):
-                        shutil.rmtree(dst_path)
-            
-            elif command == 'mv':
-                src_path = other_data.get('src_path')
-                dst_path = other_data.get('dst_path')
-                if dst_path and os.path.exists(dst_path) and src_path:
-                    if not os.path.exists(src_path):
-                        shutil.move(dst_path, src_path)
-            
-            elif command == 'rm':
-                trash_path = other_data.get('trash_path')
-                path = other_data.get('path')
-                if os.path.exists(trash_path) and not os.path.exists(path):
-                    shutil.move(trash_path, path)
-                else:
-                    print(f"{Colors.RED}Couldn't cancel operation{Colors.RESET}")
-            
-            self.history.remove(last_command)
-            self.save_history()
-            self.add_log("undo")
-            self.add_to_history('undo', [])
-            
-        except OSError as e:
+            for op in targets:
+                data = undo_operation(self, op)
+                self.invalidate_listing(*(value for item in data.get('items', [data])
+                                          for key, value in item.items() if key.endswith('path')))
+                self.operations.mark_undone(op['id'], data)
+                print(f"Undone: {op['id']} {op['command']} {' '.join(op['args'])}")
+
+            self.add_log(f"undo {' '.join(args)}".rstrip())
+            self.add_to_history('undo', args)
+
+        except (OSError, ValueError) as e:
             error_msg = f"undo: {str(e)}"
             print(f"{Colors.RED}{error_msg}{Colors.RESET}")
-            self.add_log("undo", False, error_msg)
-            self.add_to_history('undo', [], False)
+            self.add_log(f"undo {' '.join(args)}".rstrip(), False, error_msg)
+            self.add_to_history('undo', args, False)
+
+    def undo_last(self):
+        '''Функция которая отменяет результат выполнения последней изменяющей команды (cp, rm, mv).'''
+        self.undo(1)
+
+    def redo(self, count=1):
+        '''
+            Функция которая повторяет последние отменённые командой undo операции.
+            Новая изменяющая команда очищает список операций для повтора.
+
+            Принимает:
+                1. count (int) - Количество повторяемых операций (по умолчанию 1)
+
+            Вывод: None
+        '''
+        from operations import redo_operation
+        args = [str(count)] if count != 1 else []
+        try:
+            targets = self.operations.redo_targets(count)
+            if not targets:
+                print(f"{Colors.YELLOW}No commands to redo{Colors.RESET}")
+                return
+
+            for op in targets:
+                data = redo_operation(self, op)
+                self.invalidate_listing(*(value for item in data.get('items', [data])
+                                          for key, value in item.items() if key.endswith('path')))
+                self.operations.mark_redone(op['id'], data)
+                print(f"Redone: {op['id']} {op['command']} {' '.join(op['args'])}")
+
+            self.add_log(f"redo {' '.join(args)}".rstrip())
+            self.add_to_history('redo', args)
+
+        except (OSError, ValueError) as e:
+            error_msg = f"redo: {str(e)}"
+            print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+            self.add_log(f"redo {' '.join(args)}".rstrip(), False, error_msg)
+            self.add_to_history('redo', args, False)
+
+
+    def usage_error(self, message):
+        '''
+            Функция которая выводит сообщение о неправильном использовании команды
+            и отмечает команду как неуспешную.
+
+            Принимает:
+                1. message (str) - Сообщение об ошибке
+
+            Вывод: False.
+        '''
+        print(message)
+        self.last_status = False
+        return False
+
+    def execute(self, line):
+        '''
+            Функция которая парсит одну строку команды и вызывает соответствующую функцию.
+            Флаги и аргументы каждой команды описаны в таблице команд (commands.py).
+            Строки с |, > и >> вне кавычек выполняются как конвейер (pipeline.py), строка с & в конце -
+            фоновой задачей. Кавычки (одинарные или двойные) убираются из аргументов.
+
+            Принимает:
+                1. line (str) - Строка команды
+
+            Вывод: True, если команда выполнилась успешно, иначе False.
+        '''
+        if line.rstrip().endswith('&'):
+            return self.start_job(line.rstrip()[:-1].strip())
+        try:
+            tokens = list(iter_tokens(line))
+        except UsageError as e:
+            return self.usage_error(f"System_Shell: {e}")
+        if any(operator for _, operator, _, _ in tokens):
+            from pipeline import run_pipeline
+            return run_pipeline(self, line)
+        command = [word for word, _, _, _ in tokens]
+        if not command:
+            return True
+
+        cmd = command[0]
+        self.command_started = time.perf_counter()
+        self.command_bytes = None
+        self.command_data = None
+        self.last_status = True
+
+        spec = get_command(cmd)
+        if spec is None:
+            return self.usage_error(f"Unknown command: {cmd}")
+        try:
+            args, kwargs = spec.parse(command[1:], self.current_dir)
+        except UsageError as e:
+            return self.usage_error(f"{cmd}: {e}")
 
+        try:
+            spec.resolve(self)(*args, **kwargs)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            print(f"Unexpected error: {str(e)}")
+            self.last_status = False
+        self.metrics.record(cmd, time.perf_counter() - self.command_started, self.last_status,
+                            self.command_bytes, files_touched(self.command_data))
+        return self.last_status
+
+    def setup_readline(self):
+        '''
+            Функция которая загружает в readline последние команды из истории, чтобы работали
+            стрелки и reverse-i-search (Ctrl-R), и подключает дополнение команд, опций и путей по Tab.
+            Загружается только хвост базы (readline_size строк).
+        '''
+        try:
+            import readline
+        except ImportError:
+            return
+        from completion import setup_completion
+        self.completer = setup_completion(self, readline)
+        try:
+            lines = self.history.recent_lines(HISTORY_CONFIG['readline_size'])
+        except OSError:
+            return
+        readline.clear_history()
+        for line in lines:
+            readline.add_history(line)
+
+    def open_listing_cache(self):
+        '''Функция которая возвращает кэш содержимого директорий для ls, создавая его при первом обращении.'''
+        if self.listing_cache is None:
+            from listing_cache import ListingCache
+            self.listing_cache = ListingCache(**LISTING_CACHE_CONFIG)
+        return self.listing_cache
+
+    def open_shared(self):
+        '''
+            Функция которая создаёт объекты, общие для shell, его фоновых задач и сеансов сервера:
+            кэши контрольных сумм, размеров и содержимого директорий, метрики и журнал операций.
+            Вызывается перед копированием shell: копия, создавшая такой объект сама, держала бы свой
+            экземпляр, и save() копии и shell перезаписывали бы файлы друг друга.
+        '''
+        from checksum import open_cache
+        from disk_usage import open_size_cache
+        open_cache(self)
+        open_size_cache(self)
+        self.open_listing_cache()
+        # Свойства создают объект при первом обращении
+        for name in ('metrics', 'operations'):
+            getattr(self, name)
+
+    def new_session(self, state_dir, current_dir=None):
+        '''
+            Функция которая создаёт shell сеанса сервера. Лог, корзина, метрики и кэши общие с этим shell,
+            а текущая директория, история, журнал операций (undo / redo) и фоновые задачи - свои.
+
+            Принимает:
+                1. state_dir (str) - Директория состояния сеанса (база истории и журнал операций)
+                2. current_dir (str) - Начальная директория (по умолчанию - текущая директория этого shell)
+
+            Вывод: shell сеанса (System_Shell).
+        '''
+        os.makedirs(state_dir, exist_ok=True)
+        self.open_shared()
+        session = copy.copy(self)
+        session.current_dir = os.path.abspath(current_dir or self.current_dir)
+        session.history = HistoryDB(os.path.join(state_dir, HISTORY_CONFIG['db_file']),
+                                    synchronous=HISTORY_CONFIG['synchronous'])
+        from operations import OperationJournal
+        from jobs import JobTable
+        session.operations = OperationJournal(os.path.join(state_dir, ".operations"), **OPERATIONS_CONFIG)
+        session.trash.referenced.append(session.operations.trash_paths)
+        session.jobs = JobTable(**JOBS_CONFIG)
+        session.completer = None
+        session.command_started = session.command_bytes = session.command_data = None
+        session.last_status = True
+        # Подтверждения через сокет не запрашиваются: удаление всё равно можно отменить undo
+        session.interactive = False
+        session.check_history()
+        return session
+
+    def start_job(self, line):
+        '''
+            Функция которая запускает команду фоновой задачей (строка с & в конце) и сразу возвращает управление.
+
+            Принимает:
+                1. line (str) - Строка команды без &
+
+            Вывод: True, если задача запущена.
+        '''
+        if not line:
+            return self.usage_error("System_Shell: syntax error near '&'")
+        # Задача работает с копией shell (JobTable.submit): кэши и журнал должны быть общими
+        self.open_shared()
+        job = self.jobs.submit(self, line)
+        print(f"[{job.id}] {line}")
+        return True
+
+    def report_jobs(self, wait=False):
+        '''
+            Функция которая сообщает о завершившихся фоновых задачах (состояние и их вывод).
+
+            Принимает:
+                1. wait (bool) - Сначала дождаться всех задач (при выходе из shell). Ctrl-C отменяет их.
+        '''
+        if self._jobs is None:
+            # Фоновых задач ещё не было
+            return
+        if wait and self.jobs.running():
+            try:
+                self.jobs.wait(self.jobs.running())
+            except KeyboardInterrupt:
+                self.jobs.cancel_all()
+                self.jobs.wait(self.jobs.running())
+        from jobs import iter_report
+        write_lines(iter_report(self.jobs.collect()))
 
     def run(self):
         '''Функция которая запускает основной цикл выполнения программы.
-            Также функция обрабатывает пользовательский ввод, парсит команды и в соответствии с результатами парсинга вызывает соответствующие функции.
+            Также функция обрабатывает пользовательский ввод и передаёт каждую строку в execute.
         '''
         print("System_Shell started. Type 'exit' to quit.")
+        self.setup_readline()
         while True:
             try:
-                command = input(f"{Colors.BRIGHT_GREEN}{self.current_dir}{Colors.RESET} $ ").strip().split()
-                if not command:
-                    continue
-                
-                cmd = command[0]
-                args = command[1:]
-
-                if cmd == "exit":
+                self.report_jobs()
+                line = input(f"{Colors.BRIGHT_GREEN}{self.current_dir}{Colors.RESET} $ ")
+                if line.strip() == "exit":
                     break
-                elif cmd == "ls":
-                    not_flag_args = [arg for arg in args if arg != "-l"]
-                    flag_l = "-l" in args
-                    if not_flag_args:
-                        path = not_flag_args[0]
-                    else:
-                        path = None
-                    self.ls(path, flag_l)
-                elif cmd == "cd":
-                    if len(args) != 1:
-                        print("cd: not enouth arguments")
-                    else:
-                        self.cd(args[0])
-                elif cmd == "cat":
-                    if len(args) != 1:
-                        print("cat: not enouth arguments")
-                    else:
-                        self.cat(args[0])
-                elif cmd == "cp":
-                    flag_r = "-r" in args
-                    files = [arg for arg in args if arg != "-r"]
-                    if len(files) != 2:
-                        print("cp: not enouth arguments")
-                    else:
-                        self.cp(files[0], files[1], flag_r)
-                elif cmd == "mv":
-                    if len(args) != 2:
-                        print("mv: not enouth arguments")
-                    else:
-                        self.mv(args[0], args[1])
-                elif cmd == "rm":
-                    not_flag_args = [arg for arg in args if arg != "-l"]
-                    flag_l = "-l" in args
-                    if not_flag_args:
-                        path = not_flag_args[0]
-                    else:
-                        path = None
-                    if not path:
-                        print("rm: not enouth arguments")
-                    else:
-                        self.rm(path, flag_r)
-                elif cmd == "history":
-                    if args and args[0].isdigit():
-                        count = int(args[0])
-                    else:
-                        count = 5
-                    self.show_history(count)
-                elif cmd == "undo":
-                    self.undo_last()
-                else:
-                    print(f"Unknown command: {cmd}")
+                self.execute(line)
             except KeyboardInterrupt:
                 print("\nUse 'exit' to quit")
-            except Exception as e:
-                print(f"Unexpected error: {str(e)}")
 
-if __name__ == "__main__":
+    def run_script(self, lines, stop_on_error=False):
+        '''
+            Функция которая выполняет команды из скрипта без приглашения и цветов.
+            Запись истории на диск выполняется одним пакетом на весь скрипт.
+            Строки "set -e" / "set +e" включают и выключают остановку на первой ошибке,
+            строки, начинающиеся с #, пропускаются, "exit [N]" завершает скрипт.
+
+            Принимает:
+                1. lines - Итерируемый объект строк (файл, sys.stdin или список)
+                2. stop_on_error (bool) - Останавливаться на первой ошибке (как set -e)
+
+            Вывод: код возврата (int): 0 - все команды успешны, 1 - была ошибка, N - из "exit N".
+        '''
+        self.interactive = False
+        Colors.disable()
+        exit_code = 0
+        self.history.begin_batch()
+        try:
+            for lineno, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line in ("set -e", "set +e"):
+                    stop_on_error = line == "set -e"
+                    continue
+                words = line.split()
+                if words[0] == "exit":
+                    if len(words) > 1 and words[1].isdigit():
+                        exit_code = int(words[1])
+                    break
+                if not self.execute(line):
+                    exit_code = 1
+                    if stop_on_error:
+                        print(f"Stopped at line {lineno}: {line}", file=sys.stderr)
+                        break
+        finally:
+            self.history.end_batch()
+        return exit_code
+
+
+def main(argv=None):
+    '''
+        Функция которая разбирает аргументы командной строки и запускает shell.
+
+        Режимы:
+            1. main.py - интерактивный режим (или пакетный, если stdin не терминал)
+            2. main.py -c "ls; cd .." - выполнить команды из строки
+            3. main.py script.sh - выполнить команды из файла ("-" - из stdin)
+            4. main.py --serve [ADDR] - сервер сеансов shell на Unix сокете (unix:/path) или TCP (host:port, с токеном)
+
+        Вывод: код возврата (int).
+    '''
+    parser = argparse.ArgumentParser(description="System_Shell")
+    parser.add_argument("-c", dest="commands", help="commands to run, separated by ';' or newlines")
+    parser.add_argument("-e", dest="stop_on_error", action="store_true", help="stop on the first failed command")
+    parser.add_argument("--serve", nargs="?", const="", metavar="ADDR",
+                        help="serve shell sessions on unix:/path or host:port (default from SERVER_CONFIG)")
+    parser.add_argument("script", nargs="?", help="script file to run ('-' for stdin)")
+    args = parser.parse_args(argv)
+
     shell = System_Shell()
-    shell.run()
\ No newline at end of file
+    try:
+        if args.serve is not None:
+            from server import serve
+            return serve(shell, args.serve or None)
+        if args.commands is not None:
+            return shell.run_script(args.commands.replace(";", "\n").splitlines(), args.stop_on_error)
+        if args.script and args.script != "-":
+            with open(args.script, "r", encoding="utf-8") as f:
+                return shell.run_script(f, args.stop_on_error)
+        if args.script == "-" or not sys.stdin.isatty():
+            return shell.run_script(sys.stdin, args.stop_on_error)
+        shell.run()
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    except OSError as e:
+        print(f"System_Shell: {e}", file=sys.stderr)
+        return 2
+    finally:
+        # Фоновые задачи доводятся до конца, чтобы их операции попали в историю и журнал
+        shell.report_jobs(wait=True)
+        # Последняя выгрузка метрик, чтобы в файле были все команды сессии
+        if shell.metrics.export_path:
+            try:
+                shell.metrics.export(shell.metrics.export_path)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
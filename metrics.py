@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from ansi import Colors
+
+
+def percentile(samples, fraction):
+    '''
+        Функция которая возвращает перцентиль (метод ближайшего ранга).
+
+        Принимает:
+            1. samples (list) - Отсортированные значения
+            2. fraction (float) - Доля, например 0.5 или 0.99
+
+        Вывод: значение (float) или 0.0 для пустого списка.
+    '''
+    if not samples:
+        return 0.0
+    rank = math.ceil(fraction * len(samples))
+    return samples[max(0, min(len(samples), rank) - 1)]
+
+
+class CommandMetrics:
+    '''Класс счётчиков одной команды: количество, ошибки, байты, файлы и последние замеры времени.'''
+    def __init__(self, samples):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.files = 0
+        self.samples = deque(maxlen=samples)
+
+    def snapshot(self):
+        '''Функция которая возвращает словарь со счётчиками и перцентилями задержки.'''
+        ordered = sorted(self.samples)
+        return {'count': self.count, 'errors': self.errors, 'seconds': self.seconds, 'bytes': self.bytes,
+                'files': self.files, 'p50': percentile(ordered, 0.5), 'p99': percentile(ordered, 0.99),
+                'max': ordered[-1] if ordered else 0.0}
+
+
+class MetricsRegistry:
+    '''
+        Класс реестра метрик shell в памяти.
+
+        Для каждой команды хранятся счётчики и последние samples замеров длительности,
+        по которым считаются p50 / p99, поэтому память не растёт с числом команд.
+        Снимок можно выгрузить в текстовый формат Prometheus или JSON; при заданном
+        export_path выгрузка выполняется автоматически не чаще export_interval секунд.
+    '''
+    def __init__(self, samples=1024, export_path=None, export_interval=10.0):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. samples (int) - Сколько последних замеров хранить на команду
+                2. export_path (str) - Файл для автоматической выгрузки (.prom или .json), None - не выгружать
+                3. export_interval (float) - Минимальный интервал автоматической выгрузки в секундах
+        '''
+        self.samples = samples
+        self.export_path = os.path.abspath(export_path) if export_path else None
+        self.export_interval = export_interval
+        self.commands = {}
+        self.gauges = {}
+        self.started = time.time()
+        self._exported = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds, status=True, nbytes=None, files=None):
+        '''
+            Функция которая учитывает одно выполнение команды.
+
+            Принимает:
+                1. command (str) - Имя команды
+                2. seconds (float) - Длительность
+                3. status (bool) - Успех выполнения
+                4. nbytes (int) - Прочитано / записано байт
+                5. files (int) - Затронуто файлов
+        '''
+        with self._lock:
+            metrics = self.commands.get(command)
+            if metrics is None:
+                metrics = self.commands[command] = CommandMetrics(self.samples)
+            metrics.count += 1
+            metrics.errors += 0 if status else 1
+            metrics.seconds += seconds
+            metrics.bytes += nbytes or 0
+            metrics.files += files or 0
+            metrics.samples.append(seconds)
+        if self.export_path and time.monotonic() - self._exported >= self.export_interval:
+            try:
+                self.export(self.export_path)
+            except OSError:
+                pass
+
+    def set_gauges(self, name, values):
+        '''Функция которая сохраняет значения внешних счётчиков (например, кэша ls) для выгрузки.'''
+        with self._lock:
+            self.gauges[name] = dict(values)
+
+    def snapshot(self):
+        '''Функция которая возвращает снимок всех метрик (dict).'''
+        with self._lock:
+            return {'started': self.started, 'time': time.time(),
+                    'commands': {name: metrics.snapshot() for name, metrics in sorted(self.commands.items())},
+                    'gauges': {name: dict(values) for name, values in self.gauges.items()}}
+
+    def reset(self):
+        '''Функция которая обнуляет все счётчики.'''
+        with self._lock:
+            self.commands.clear()
+            self.started = time.time()
+
+    def to_prometheus(self, snapshot=None):
+        '''Функция которая форматирует снимок в текстовом формате Prometheus. Вывод: строка (str).'''
+        snapshot = snapshot or self.snapshot()
+        commands = snapshot['commands']
+        lines = ['# HELP shell_command_duration_seconds Command latency.',
+                 '# TYPE shell_command_duration_seconds summary']
+        for name, data in commands.items():
+            for field, quantile in (('p50', '0.5'), ('p99', '0.99')):
+                lines.append(f'shell_command_duration_seconds{{command="{name}",quantile="{quantile}"}} {data[field]}')
+            lines.append(f'shell_command_duration_seconds_sum{{command="{name}"}} {data["seconds"]}')
+            lines.append(f'shell_command_duration_seconds_count{{command="{name}"}} {data["count"]}')
+        for field, help_text in (('errors', 'Failed command executions.'), ('bytes', 'Bytes read or written.'),
+                                 ('files', 'Files touched.')):
+            lines.append(f'# HELP shell_command_{field}_total {help_text}')
+            lines.append(f'# TYPE shell_command_{field}_total counter')
+            for name, data in commands.items():
+                lines.append(f'shell_command_{field}_total{{command="{name}"}} {data[field]}')
+        for gauge, values in snapshot['gauges'].items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f'# TYPE shell_{gauge}_{key} gauge')
+                    lines.append(f'shell_{gauge}_{key} {float(value) if isinstance(value, bool) else value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, fmt=None):
+        '''
+            Функция которая атомарно записывает снимок метрик в файл.
+
+            Принимает:
+                1. path (str) - Путь к файлу
+                2. fmt (str) - 'prom' или 'json'. По умолчанию - по расширению файла (.json - JSON, иначе Prometheus)
+
+            Вывод: None
+        '''
+        fmt = fmt or ('json' if path.endswith('.json') else 'prom')
+        snapshot = self.snapshot()
+        data = json.dumps(snapshot, indent=2) if fmt == 'json' else self.to_prometheus(snapshot)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._exported = time.monotonic()
+
+
+def format_seconds(seconds):
+    '''Функция которая форматирует длительность в мс или с.'''
+    return f"{seconds * 1000:.2f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def stats(shell, export=None, fmt=None, reset=False):
+    '''
+        Функция команды stats: выводит количество вызовов, ошибки, p50 / p99 задержки, байты и файлы
+        по каждой команде за сессию.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. export (str) - Выгрузить снимок в файл (--export=metrics.prom или metrics.json)
+            3. fmt (str) - Формат выгрузки: prom или json (--format)
+            4. reset (bool) - Обнулить счётчики после вывода (--reset)
+
+        Вывод: None
+    '''
+    args = ([f"--export={export}"] if export else []) + ([f"--format={fmt}"] if fmt else []) + \
+           (['--reset'] if reset else [])
+    try:
+        registry = shell.metrics
+        if shell.listing_cache is not None:
+            registry.set_gauges('listing_cache', shell.listing_cache.stats())
+        snapshot = registry.snapshot()
+
+        print(f"{'command':<10} {'count':>7} {'errors':>7} {'p50':>10} {'p99':>10} {'bytes':>12} {'files':>8}")
+        for name, data in snapshot['commands'].items():
+            print(f"{name:<10} {data['count']:>7} {data['errors']:>7} {format_seconds(data['p50']):>10} "
+                  f"{format_seconds(data['p99']):>10} {data['bytes']:>12} {data['files']:>8}")
+        for gauge, values in snapshot['gauges'].items():
+            print(f"{gauge}: " + ', '.join(f"{key}={value}" for key, value in values.items()))
+
+        if export:
+            registry.export(os.path.join(shell.current_dir, export), fmt)
+        if reset:
+            registry.reset()
+        shell.add_log(f"stats {' '.join(args)}".rstrip())
+        shell.add_to_history('stats', args)
+    except OSError as e:
+        error_msg = f"stats: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"stats {' '.join(args)}".rstrip(), False, error_msg)
+        shell.add_to_history('stats', args, False)
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+from copy_engine import Progress
+from jobs import check_cancelled
+from checksum import ChecksumMismatch, drop_page_cache, hash_file
+
+# Как часто (в байтах) сохранять контрольную точку при копировании большого файла
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+# Размер блока потокового копирования
+MOVE_CHUNK = 8 * 1024 * 1024
+
+
+def same_device(src, dst):
+    '''
+        Функция которая проверяет, лежат ли src и каталог назначения dst на одном устройстве.
+
+        Принимает:
+            1. src (str) - Исходный путь
+            2. dst (str) - Путь назначения (может ещё не существовать)
+
+        Вывод: True, если перемещение можно выполнить одним rename.
+    '''
+    parent = os.path.dirname(os.path.abspath(dst))
+    return os.lstat(src).st_dev == os.stat(parent).st_dev
+
+
+def checkpoint_path(dst):
+    '''Функция которая возвращает путь к файлу контрольной точки межустройственного перемещения в dst.'''
+    dst = os.path.abspath(dst)
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.mv-checkpoint")
+
+
+def load_checkpoint(src, dst):
+    '''Функция которая загружает контрольную точку перемещения src -> dst. Вывод: dict или None.'''
+    try:
+        with open(checkpoint_path(dst), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('src') != os.path.abspath(src):
+        return None
+    return state
+
+
+def save_checkpoint(dst, state):
+    '''Функция которая атомарно (через временный файл и os.replace) сохраняет контрольную точку.'''
+    path = checkpoint_path(dst)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def move_file_streaming(src_file, dst_file, state, dst, progress, verify=None):
+    '''
+        Функция которая потоково копирует один файл на другое устройство через временный файл .part,
+        периодически сохраняя контрольную точку, и удаляет исходный файл после успешного копирования.
+        Если контрольная точка указывает на этот файл, копирование продолжается с сохранённого смещения.
+        С проверкой (verify - кэш контрольных сумм) сумма источника считается по ходу копирования,
+        и исходный файл удаляется, только если с ней совпала сумма копии, прочитанной с диска.
+    '''
+    part = dst_file + '.part'
+    offset = 0
+    if state.get('current') == src_file and os.path.exists(part):
+        offset = min(state.get('offset', 0), os.path.getsize(part))
+    state['current'] = src_file
+    state['offset'] = offset
+    hasher = hashlib.new(verify.algorithm) if verify is not None else None
+
+    with open(src_file, 'rb') as fsrc, open(part, 'r+b' if offset else 'wb') as fdst:
+        if hasher is not None and offset:
+            # Начало файла скопировано до перерыва - его часть суммы считается по источнику
+            while fsrc.tell() < offset:
+                block = fsrc.read(min(MOVE_CHUNK, offset - fsrc.tell()))
+                if not block:
+                    break
+                hasher.update(block)
+        fdst.truncate(offset)
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        since_checkpoint = 0
+        while True:
+            block = fsrc.read(MOVE_CHUNK)
+            if not block:
+                break
+            fdst.write(block)
+            if hasher is not None:
+                hasher.update(block)
+            state['offset'] += len(block)
+            since_checkpoint += len(block)
+            progress.update(0, len(block))
+            if since_checkpoint >= CHECKPOINT_BYTES:
+                fdst.flush()
+                os.fsync(fdst.fileno())
+                save_checkpoint(dst, state)
+                since_checkpoint = 0
+                # Отмена задачи - только после контрольной точки, с неё перемещение и продолжится
+                check_cancelled()
+        fdst.flush()
+        os.fsync(fdst.fileno())
+        if hasher is not None:
+            drop_page_cache(fdst.fileno())
+
+    shutil.copystat(src_file, part)
+    if hasher is not None and hash_file(part, verify, refresh=True) != hasher.hexdigest():
+        os.remove(part)
+        state['current'] = None
+        state['offset'] = 0
+        save_checkpoint(dst, state)
+        raise ChecksumMismatch(f"checksum mismatch: '{src_file}' -> '{dst_file}'")
+    os.replace(part, dst_file)
+    os.remove(src_file)
+    state['current'] = None
+    state['offset'] = 0
+    state['done_files'] = state.get('done_files', 0) + 1
+    save_checkpoint(dst, state)
+    progress.update(1, 0)
+
+
+def move_across_devices(src, dst, progress=None, verify=None):
+    '''
+        Функция которая перемещает файл или дерево на другое устройство с возможностью продолжения.
+
+        Файлы переносятся по одному: каждый файл копируется в dst, синхронизируется на диск и только
+        после этого удаляется из src, поэтому для директорий место на диске не удваивается.
+        Состояние сохраняется в контрольной точке рядом с dst, и повторный вызов с теми же
+        аргументами после сбоя продолжает перемещение. Отмена фоновой задачи (kill %N) прерывает
+        перемещение между файлами или на контрольной точке, и его так же можно продолжить.
+
+        Принимает:
+            1. src (str) - Исходный путь
+            2. dst (str) - Путь назначения
+            3. progress (bool) - Выводить ли прогресс (по умолчанию - если stderr это терминал)
+            4. verify (HashCache) - Кэш контрольных сумм для проверки каждого файла, None - без проверки
+
+        Вывод: словарь статистики {'files', 'bytes', 'resumed'}.
+    '''
+    src = os.path.abspath(src)
+    dst = os.path.abspath(dst)
+    state = load_checkpoint(src, dst)
+    resumed = state is not None
+    if resumed and not os.path.lexists(src):
+        # Сбой произошёл после переноса последнего файла - осталось только убрать контрольную точку
+        os.remove(checkpoint_path(dst))
+        return {'files': 0, 'bytes': 0, 'resumed': True}
+    if state is None:
+        state = {'src': src, 'dst': dst, 'done_files': 0, 'current': None, 'offset': 0}
+        save_checkpoint(dst, state)
+
+    if os.path.isdir(src) and not os.path.islink(src):
+        files, dirs, total = [], [], 0
+        stack = [src]
+        while stack:
+            current = stack.pop()
+            dirs.append(current)
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        files.append(entry.path)
+                        if not entry.is_symlink():
+                            total += entry.stat(follow_symlinks=False).st_size
+
+        bar = Progress('mv', len(files), total, progress)
+        for src_dir in dirs:
+            os.makedirs(os.path.join(dst, os.path.relpath(src_dir, src)), exist_ok=True)
+        for src_file in files:
+            check_cancelled()
+            dst_file = os.path.join(dst, os.path.relpath(src_file, src))
+            if os.path.islink(src_file):
+                if os.path.lexists(dst_file):
+                    os.remove(dst_file)
+                os.symlink(os.readlink(src_file), dst_file)
+                os.remove(src_file)
+                bar.update(1, 0)
+            else:
+                move_file_streaming(src_file, dst_file, state, dst, bar, verify)
+        # Каталоги удаляются от самых глубоких к корню, когда в них уже ничего не осталось
+        for src_dir in reversed(dirs):
+            shutil.copystat(src_dir, os.path.join(dst, os.path.relpath(src_dir, src)))
+            os.rmdir(src_dir)
+    else:
+        bar = Progress('mv', 1, os.lstat(src).st_size, progress)
+        move_file_streaming(src, dst, state, dst, bar, verify)
+
+    bar.finish()
+    os.remove(checkpoint_path(dst))
+    return {'files': bar.files, 'bytes': bar.bytes, 'resumed': resumed}
+
+
+def move_path(src, dst, progress=None, verify=None):
+    '''
+        Функция которая перемещает src в dst: на одном устройстве - одним атомарным os.replace,
+        на разных устройствах - потоково с контрольными точками (move_across_devices).
+        При os.replace данные не копируются (тот же inode), поэтому проверять нечего.
+
+        Вывод: словарь статистики {'strategy', ...}.
+    '''
+    if load_checkpoint(src, dst) is None and same_device(src, dst):
+        os.replace(src, dst)
+        return {'strategy': 'rename'}
+    stats = move_across_devices(src, dst, progress, verify)
+    stats['strategy'] = 'stream'
+    return stats
@@ -0,0 +1,346 @@
+import json
+import os
+import threading
+import time
+
+
+class OperationJournal:
+    '''
+        Класс журнала изменяющих операций (cp, mv, rm, sync, pack, unpack) для многоуровневых undo / redo.
+
+        Журнал хранится в файле JSON lines из событий {"do": операция}, {"undo": id}, {"redo": id}
+        и {"update": id} (новые данные операции после неудачной отмены / повтора, откатанных назад).
+        В памяти держатся стек выполненных операций, стек отменённых операций и индекс
+        id -> операция, поэтому поиск операции по id (undo --to) выполняется за O(1).
+        Файл загружается при первом обращении, а не при запуске shell.
+    '''
+    def __init__(self, path, max_ops=1000):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. path (str) - Путь к файлу журнала
+                2. max_ops (int) - Сколько последних операций сохранять при сжатии журнала
+        '''
+        self.path = os.path.abspath(path)
+        self.max_ops = max_ops
+        self.ops = {}
+        self.undo_stack = []
+        self.redo_stack = []
+        self.position = {}
+        self.last_id = 0
+        self._loaded = False
+        self._lines = 0
+        # Журнал пишут и команда на переднем плане, и фоновые задачи
+        self._lock = threading.RLock()
+
+    def _load(self):
+        '''Функция которая воспроизводит события журнала и строит стеки и индекс.'''
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Недописанная строка после аварийного завершения
+                    continue
+                self._apply(event)
+                self._lines += 1
+
+    def _apply(self, event):
+        '''Функция которая применяет одно событие журнала к стекам в памяти.'''
+        if 'do' in event:
+            op = event['do']
+            for op_id in self.redo_stack:
+                self.ops.pop(op_id, None)
+            self.redo_stack.clear()
+            self.ops[op['id']] = op
+            self.position[op['id']] = len(self.undo_stack)
+            self.undo_stack.append(op['id'])
+            self.last_id = max(self.last_id, op['id'])
+        elif 'undo' in event:
+            op_id = self.undo_stack.pop()
+            del self.position[op_id]
+            self.redo_stack.append(op_id)
+            self.ops[op_id]['data'] = event.get('data', self.ops[op_id]['data'])
+        elif 'redo' in event:
+            op_id = self.redo_stack.pop()
+            self.position[op_id] = len(self.undo_stack)
+            self.undo_stack.append(op_id)
+            self.ops[op_id]['data'] = event.get('data', self.ops[op_id]['data'])
+        elif 'update' in event:
+            if event['update'] in self.ops:
+                self.ops[event['update']]['data'] = event['data']
+
+    def _write(self, event):
+        '''Функция которая дописывает событие в журнал и синхронизирует его на диск.'''
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(event)
+        self._lines += 1
+        if self._lines > 2 * len(self.ops) + 100 or len(self.undo_stack) > 2 * self.max_ops:
+            self.compact()
+
+    def record(self, command, args, data, current_dir=None):
+        '''
+            Функция которая записывает выполненную операцию. Стек redo при этом очищается.
+
+            Принимает:
+                1. command (str) - Имя команды
+                2. args (list) - Аргументы команды
+                3. data (dict) - Данные для отмены и повтора операции
+                4. current_dir (str) - Рабочая директория
+
+            Вывод: операция (dict) с полем id.
+        '''
+        with self._lock:
+            self._load()
+            op = {'id': self.last_id + 1, 'time': time.time(), 'command': command, 'args': args,
+                  'current_dir': current_dir, 'data': data}
+            self._write({'do': op})
+            return op
+
+    def undo_targets(self, count=1, to_id=None):
+        '''
+            Функция которая возвращает операции для отмены, начиная с последней.
+
+            Принимает:
+                1. count (int) - Сколько операций отменить
+                2. to_id (int) - Отменить все операции вплоть до операции с этим id включительно
+
+            Вывод: список операций (dict). Если to_id не найден среди выполненных - ValueError.
+        '''
+        with self._lock:
+            self._load()
+            if to_id is not None:
+                if to_id not in self.position:
+                    raise ValueError(f"operation {to_id} is not in the undo stack")
+                start = self.position[to_id]
+            else:
+                start = max(0, len(self.undo_stack) - count)
+            return [self.ops[op_id] for op_id in reversed(self.undo_stack[start:])]
+
+    def redo_targets(self, count=1):
+        '''Функция которая возвращает до count последних отменённых операций в порядке повтора.'''
+        with self._lock:
+            self._load()
+            return [self.ops[op_id] for op_id in reversed(self.redo_stack[max(0, len(self.redo_stack) - count):])]
+
+    def trash_paths(self):
+        '''Функция которая возвращает пути в корзине (set), нужные для отмены операций из стека undo.'''
+        with self._lock:
+            self._load()
+            paths = set()
+            stack = [self.ops[op_id]['data'] for op_id in self.undo_stack]
+            while stack:
+                value = stack.pop()
+                if isinstance(value, dict):
+                    for key, item in value.items():
+                        if key.endswith('trash_path') and isinstance(item, str):
+                            paths.add(item)
+                        elif isinstance(item, (dict, list)):
+                            stack.append(item)
+                elif isinstance(value, list):
+                    stack.extend(value)
+            return paths
+
+    def mark_undone(self, op_id, data):
+        '''Функция которая записывает отмену операции (должна быть на вершине стека) и её новые данные.'''
+        with self._lock:
+            if not self.undo_stack or self.undo_stack[-1] != op_id:
+                raise ValueError(f"operation {op_id} is not the last one")
+            self._write({'undo': op_id, 'data': data})
+
+    def mark_redone(self, op_id, data):
+        '''Функция которая записывает повтор операции (должна быть на вершине стека redo) и её новые данные.'''
+        with self._lock:
+            if not self.redo_stack or self.redo_stack[-1] != op_id:
+                raise ValueError(f"operation {op_id} is not the last undone one")
+            self._write({'redo': op_id, 'data': data})
+
+    def update_data(self, op_id, data):
+        '''Функция которая записывает новые данные операции, не меняя её места в стеках.'''
+        with self._lock:
+            self._load()
+            if op_id in self.ops:
+                self._write({'update': op_id, 'data': data})
+
+    def compact(self):
+        '''
+            Функция которая переписывает журнал так, чтобы он воспроизводил текущее состояние:
+            последние max_ops выполненных операций и стек отменённых операций.
+        '''
+        done = self.undo_stack[-self.max_ops:]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for op_id in done + list(reversed(self.redo_stack)):
+                f.write(json.dumps({'do': self.ops[op_id]}) + '\n')
+            for op_id in self.redo_stack:
+                f.write(json.dumps({'undo': op_id, 'data': self.ops[op_id]['data']}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        dropped = self.undo_stack[:-self.max_ops] if len(self.undo_stack) > self.max_ops else []
+        for op_id in dropped:
+            self.ops.pop(op_id, None)
+        self.undo_stack = done
+        self.position = {op_id: i for i, op_id in enumerate(done)}
+        self._lines = len(done) + 2 * len(self.redo_stack)
+
+
+def _restorable(data, key, path):
+    # Элемент, который надо вернуть из корзины, проверяется до того, как место освобождается,
+    # иначе после неудачного восстановления на пути не осталось бы ничего
+    if data.get(key) and not os.path.lexists(data[key]):
+        raise FileNotFoundError(f"'{path}' is no longer in trash")
+
+
+def _undo_cp(shell, data):
+    _restorable(data, 'replaced_trash_path', data['dst_path'])
+    entry = shell.trash.put(data['dst_path'])
+    if data.get('replaced_trash_path'):
+        try:
+            shell.trash.restore(data.get('replaced_trash_id'), data['replaced_trash_path'], data['dst_path'])
+        except OSError:
+            shell.trash.restore(entry['id'], entry['trash_path'], data['dst_path'])
+            raise
+    data.update({'undo_trash_path': entry['trash_path'], 'undo_trash_id': entry['id']})
+    return data
+
+
+def _redo_cp(shell, data):
+    _restorable(data, 'undo_trash_path', data['dst_path'])
+    entry = None
+    if data.get('replaced_trash_path'):
+        entry = shell.trash.put(data['dst_path'])
+    try:
+        shell.trash.restore(data.get('undo_trash_id'), data.get('undo_trash_path'), data['dst_path'])
+    except OSError:
+        if entry is not None:
+            shell.trash.restore(entry['id'], entry['trash_path'], data['dst_path'])
+        raise
+    if entry is not None:
+        data.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+    return data
+
+
+def _undo_mv(shell, data):
+    from move_engine import move_path
+    if os.path.lexists(data['src_path']):
+        raise FileExistsError(f"'{data['src_path']}' already exists")
+    move_path(data['dst_path'], data['src_path'])
+    if data.get('replaced_trash_path'):
+        shell.trash.restore(data.get('replaced_trash_id'), data['replaced_trash_path'], data['dst_path'])
+    return data
+
+
+def _redo_mv(shell, data):
+    from move_engine import move_path
+    if data.get('replaced_trash_path'):
+        replace_file = os.path.isfile(data['dst_path']) and not os.path.isdir(data['src_path'])
+        entry = shell.trash.put(data['dst_path'], link=replace_file)
+        data.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+    move_path(data['src_path'], data['dst_path'])
+    return data
+
+
+def _undo_rm(shell, data):
+    shell.trash.restore(data.get('trash_id'), data.get('trash_path'), data['path'])
+    return data
+
+
+def _redo_rm(shell, data):
+    entry = shell.trash.put(data['path'])
+    data.update({'trash_path': entry['trash_path'], 'trash_id': entry['id']})
+    return data
+
+
+def _undo_sync(shell, data):
+    # Элементы синхронизации (sync, cp --update): созданная директория, удалённый элемент (как rm)
+    # или скопированный файл (как cp). Директории отменяются после своего содержимого, поэтому они уже пусты
+    if 'dir_path' in data:
+        if os.path.isdir(data['dir_path']):
+            os.rmdir(data['dir_path'])
+        return data
+    return _undo_rm(shell, data) if 'path' in data else _undo_cp(shell, data)
+
+
+def _redo_sync(shell, data):
+    if 'dir_path' in data:
+        os.makedirs(data['dir_path'], exist_ok=True)
+        return data
+    return _redo_rm(shell, data) if 'path' in data else _redo_cp(shell, data)
+
+
+UNDO_ACTIONS = {'cp': _undo_sync, 'mv': _undo_mv, 'rm': _undo_rm, 'sync': _undo_sync,
+                'pack': _undo_cp, 'unpack': _undo_cp}
+REDO_ACTIONS = {'cp': _redo_sync, 'mv': _redo_mv, 'rm': _redo_rm, 'sync': _redo_sync,
+                'pack': _redo_cp, 'unpack': _redo_cp}
+
+
+def _apply_actions(action, inverse, data, reverse=False, save=None):
+    if 'items' not in data:
+        return action(dict(data))
+    # Пакетная операция (cp/mv/rm с несколькими путями) отменяется и повторяется целиком:
+    # если элемент не удался, уже обработанные возвращаются обратно, и операция остаётся
+    # на своём месте в стеке - повторная попытка начнёт с того же состояния
+    items = list(data['items'])
+    order = range(len(items) - 1, -1, -1) if reverse else range(len(items))
+    done = []
+    try:
+        for i in order:
+            items[i] = action(dict(items[i]))
+            done.append(i)
+    except Exception as e:
+        try:
+            for i in reversed(done):
+                items[i] = inverse(dict(items[i]))
+        except Exception as rollback_error:
+            raise OSError(f"{e} (rollback of the batch failed: {rollback_error})") from e
+        if save is not None:
+            # Откат перекладывает элементы в корзину под новыми путями - их надо запомнить для повторной попытки
+            save(dict(data, items=items))
+        raise
+    return dict(data, items=items)
+
+
+def _saver(shell, op):
+    # Операции без id (откат cp --verify внутри команды) в журнале не хранятся
+    if 'id' not in op:
+        return None
+
+    def save(data):
+        op['data'] = data
+        shell.operations.update_data(op['id'], data)
+    return save
+
+
+def undo_operation(shell, op):
+    '''
+        Функция которая отменяет операцию, используя сохранённые в ней данные.
+        Элементы пакетной операции отменяются в обратном порядке; если один из них не удался,
+        уже отменённые повторяются снова, так что операция отменяется целиком или не отменяется.
+
+        Принимает:
+            1. shell (System_Shell) - Shell (нужна корзина)
+            2. op (dict) - Операция из журнала
+
+        Вывод: обновлённые данные операции (dict) для последующего redo.
+    '''
+    undo, redo = UNDO_ACTIONS[op['command']], REDO_ACTIONS[op['command']]
+    return _apply_actions(lambda data: undo(shell, data), lambda data: redo(shell, data), op['data'],
+                          reverse=True, save=_saver(shell, op))
+
+
+def redo_operation(shell, op):
+    '''Функция которая повторяет ранее отменённую операцию (целиком или никак). Вывод: обновлённые данные операции (dict).'''
+    undo, redo = UNDO_ACTIONS[op['command']], REDO_ACTIONS[op['command']]
+    return _apply_actions(lambda data: redo(shell, data), lambda data: undo(shell, data), op['data'],
+                          save=_saver(shell, op))
@@ -0,0 +1,226 @@
+import itertools
+import os
+from ansi import Colors
+from commands import UsageError, iter_tokens
+from fileio import OutputSink, current_input, current_output, iter_chunk_lines, iter_file, redirect, write_chunks
+
+def split_pipeline(line):
+    '''
+        Функция которая разбирает строку конвейера.
+
+        Принимает:
+            1. line (str) - Строка вида "cat a.log | grep ERROR | head 20 > out.txt"
+
+        Вывод: кортеж (список команд, (файл, дописывать ли) или None). При ошибке - UsageError.
+        Команды возвращаются частями исходной строки вместе с кавычками; | и > в кавычках не разделяют.
+        Перенаправление (> file или >> file) может стоять только в конце строки.
+    '''
+    stages, target, start = [], None, 0
+    tokens = list(iter_tokens(line))
+    for i, (word, operator, begin, end) in enumerate(tokens):
+        if not operator:
+            continue
+        stage = line[start:begin].strip()
+        if not stage:
+            raise UsageError(f"syntax error near '{word}'")
+        stages.append(stage)
+        start = end
+        if word != '|':
+            rest = tokens[i + 1:]
+            if len(rest) != 1 or rest[0][1]:
+                raise UsageError(f"syntax error near '{word}'")
+            return stages, (rest[0][0], word == '>>')
+    stage = line[start:].strip()
+    if not stage:
+        raise UsageError("syntax error near '|'")
+    stages.append(stage)
+    return stages, target
+
+
+class PipeOutput(OutputSink):
+    '''
+        Класс выхода команды в конвейере.
+
+        Когда команда выводит результат (write_lines / write_chunks), следующая команда
+        запускается сразу с этим результатом на входе и читает его по одной строке,
+        поэтому между командами не накапливаются данные. Когда следующая команда
+        заканчивает работу раньше (head), генератор предыдущей закрывается и она перестаёт читать свой вход.
+    '''
+    def __init__(self, shell, run_next):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. shell (System_Shell) - Shell
+                2. run_next (callable) - Запускает оставшуюся часть конвейера с итератором строк на входе
+        '''
+        self.shell = shell
+        self.run_next = run_next
+        self.fed = False
+
+    def _feed(self, lines):
+        self.fed = True
+        shell = self.shell
+        # Следующая команда выполняется внутри текущей: сохраняем состояние текущей команды
+        state = (shell.command_started, shell.command_bytes, shell.command_data, shell.last_status)
+        try:
+            self.run_next(lines)
+        finally:
+            lines.close()
+            shell.command_started, shell.command_bytes, shell.command_data, shell.last_status = state
+
+    def feed_chunks(self, chunks):
+        '''Функция которая передаёт блоки байт следующей команде. Вывод: количество прочитанных ею байт.'''
+        counted = [0]
+
+        def count(chunks):
+            for chunk in chunks:
+                counted[0] += len(chunk)
+                yield chunk
+        source = count(chunks)
+        try:
+            self._feed(iter_chunk_lines(source))
+        finally:
+            source.close()
+        return counted[0]
+
+    def feed_lines(self, lines):
+        '''Функция которая передаёт строки следующей команде. Вывод: количество прочитанных ею строк.'''
+        counted = [0]
+
+        def encode(lines):
+            for line in lines:
+                counted[0] += 1
+                yield line.encode('utf-8') + b'\n'
+        self._feed(encode(lines))
+        return counted[0]
+
+
+class FileOutput(OutputSink):
+    '''Класс вывода команды в файл (перенаправление > и >>). Цвета в файл не пишутся.'''
+    def __init__(self, f):
+        self.f = f
+
+    def feed_chunks(self, chunks):
+        written = 0
+        last = b'\n'
+        for chunk in chunks:
+            if chunk:
+                self.f.write(chunk)
+                written += len(chunk)
+                last = chunk[-1:]
+        if last != b'\n':
+            self.f.write(b'\n')
+        return written
+
+    def feed_lines(self, lines):
+        count = 0
+        for line in lines:
+            self.f.write(line.encode('utf-8') + b'\n')
+            count += 1
+        return count
+
+
+def run_stages(shell, stages, stdin=None, out=None):
+    '''
+        Функция которая выполняет команды конвейера.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. stages (list) - Строки команд
+            3. stdin - Вход первой команды (итератор строк bytes)
+            4. out - Вывод последней команды (None - sys.stdout)
+
+        Вывод: статус последней команды (bool).
+    '''
+    if len(stages) == 1:
+        with redirect(stdin, out):
+            return shell.execute(stages[0])
+
+    status = []
+    pipe = PipeOutput(shell, lambda lines: status.append(run_stages(shell, stages[1:], lines, out)))
+    with redirect(stdin, pipe):
+        shell.execute(stages[0])
+    if not pipe.fed:
+        # Команда ничего не вывела: следующие получают пустой вход
+        status.append(run_stages(shell, stages[1:], iter(()), out))
+    return status[-1]
+
+
+def run_pipeline(shell, line):
+    '''
+        Функция которая выполняет строку с конвейером (|) и перенаправлением вывода (>, >>).
+        Каждая команда записывается в историю и лог отдельно.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. line (str) - Строка команды
+
+        Вывод: статус последней команды конвейера (bool).
+    '''
+    try:
+        stages, target = split_pipeline(line)
+    except UsageError as e:
+        return shell.usage_error(f"System_Shell: {e}")
+
+    if target is None:
+        status = run_stages(shell, stages, out=current_output())
+    else:
+        path = os.path.abspath(os.path.join(shell.current_dir, target[0]))
+        try:
+            f = open(path, 'ab' if target[1] else 'wb')
+        except OSError as e:
+            print(f"{Colors.RED}System_Shell: {target[0]}: {e.strerror}{Colors.RESET}")
+            shell.last_status = False
+            return False
+        try:
+            status = run_stages(shell, stages, out=FileOutput(f))
+        finally:
+            f.close()
+            shell.invalidate_listing(path)
+    shell.last_status = status
+    return status
+
+
+def head(shell, count=10, path=None):
+    '''
+        Функция команды head [N] [FILE]: выводит первые count строк файла или входа конвейера.
+        Вход читается только до count-й строки, после этого предыдущие команды конвейера останавливаются.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. count (int или str) - Количество строк (по умолчанию 10). Единственный аргумент,
+               который не является числом, - это файл (head FILE)
+            3. path (str) - Файл. Без него читается вход конвейера
+
+        Вывод: None
+    '''
+    if isinstance(count, str):
+        if count.isdigit():
+            count = int(count)
+        elif path is None:
+            count, path = 10, count
+        else:
+            shell.usage_error(f"head: invalid count: '{count}'")
+            return
+    args = [str(count)] + ([path] if path else [])
+    try:
+        if path is not None:
+            full_path = os.path.join(shell.current_dir, path)
+            if os.path.isdir(full_path):
+                raise IsADirectoryError(f"{path} is a directory")
+            lines = iter_file(full_path, line_range=(1, count)) if count else iter(())
+        else:
+            stdin = current_input()
+            if stdin is None:
+                shell.usage_error("head: no input (use 'head N FILE' or a pipe)")
+                return
+            lines = itertools.islice(stdin, count)
+        nbytes = write_chunks(lines)
+        shell.add_log(f"head {' '.join(args)}", nbytes=nbytes)
+        shell.add_to_history('head', args)
+    except OSError as e:
+        error_msg = f"head: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"head {' '.join(args)}", False, error_msg)
+        shell.add_to_history('head', args, False)
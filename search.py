@@ -0,0 +1,316 @@
+import fnmatch
+import mmap
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ansi import Colors
+from fileio import BLOCK_SIZE, is_binary, write_lines, current_input
+
+# Типы элементов для find --type
+TYPE_CHECKS = {
+    'f': lambda entry: entry.is_file(follow_symlinks=False),
+    'd': lambda entry: entry.is_dir(follow_symlinks=False),
+    'l': lambda entry: entry.is_symlink(),
+}
+
+
+def walk(root, onerror=None):
+    '''
+        Функция которая обходит дерево директорий итеративно через os.scandir (без рекурсии
+        и без os.walk). Ссылки на директории не раскрываются.
+
+        Принимает:
+            1. root (str) - Корень обхода
+            2. onerror (callable) - Вызывается с OSError для директорий, которые не удалось прочитать
+
+        Вывод: генератор DirEntry всех элементов дерева (корень не включается).
+    '''
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                subdirs = []
+                for entry in it:
+                    yield entry
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+        except OSError as e:
+            if current == root or onerror is None:
+                raise
+            onerror(e)
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def match_size(size, condition):
+    '''Функция которая проверяет размер по условию (знак, байты): '+' - больше, '-' - меньше, '=' - равно.'''
+    sign, value = condition
+    if sign == '+':
+        return size > value
+    if sign == '-':
+        return size < value
+    return size == value
+
+
+def iter_find(root, display_root, name=None, file_type=None, size=None, mtime=None, onerror=None):
+    '''
+        Функция которая ищет элементы дерева по фильтрам. stat делается только если нужен
+        фильтр по размеру или времени изменения.
+
+        Принимает:
+            1. root (str) - Абсолютный путь к корню поиска
+            2. display_root (str) - Корень в том виде, в котором его ввёл пользователь (для вывода)
+            3. name (str) - Шаблон имени (glob)
+            4. file_type (str) - Тип: 'f', 'd' или 'l'
+            5. size (tuple) - Условие на размер (знак, байты)
+            6. mtime (tuple) - Условие на возраст (знак, дни): '+N' - старше N дней, '-N' - новее
+            7. onerror (callable) - Обработчик ошибок чтения поддиректорий
+
+        Вывод: генератор путей (str).
+    '''
+    now = time.time()
+    type_check = TYPE_CHECKS.get(file_type)
+    pattern = re.compile(fnmatch.translate(name)).match if name else None
+    for entry in walk(root, onerror):
+        if pattern and not pattern(entry.name):
+            continue
+        if type_check and not type_check(entry):
+            continue
+        if size or mtime:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if size and not match_size(st.st_size, size):
+                continue
+            if mtime and not match_size(int((now - st.st_mtime) // 86400), mtime):
+                continue
+        yield display_root + entry.path[len(root):]
+
+
+def scan_file(path, regex, line_numbers=False, files_only=False):
+    '''
+        Функция которая ищет совпадения регулярного выражения в файле, отображённом в память (mmap).
+        Файл не читается целиком в память Python: поиск идёт прямо по страницам отображения.
+        Выражение ищется в режиме re.MULTILINE, чтобы ^ и $ совпадали на границах строк, как при
+        построчном поиске во входе конвейера. Совпадение, захватившее перевод строки (\\s, [^x], \\n),
+        ищется заново в пределах своей строки: строка выводится, только если совпадает сама по себе.
+
+        Принимает:
+            1. path (str) - Путь к файлу
+            2. regex (re.Pattern) - Скомпилированное регулярное выражение над bytes
+            3. line_numbers (bool) - Вычислять ли номера строк
+            4. files_only (bool) - Остановиться на первом совпадении (grep -l)
+
+        Вывод: кортеж (binary, matches), где matches - список пар (номер строки или None, строка bytes).
+    '''
+    if not regex.flags & re.MULTILINE:
+        regex = re.compile(regex.pattern, regex.flags | re.MULTILINE)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return False, []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            binary = is_binary(mm[:BLOCK_SIZE])
+            matches = []
+            lineno, counted = 1, 0
+            pos = 0
+            while pos <= size:
+                match = regex.search(mm, pos)
+                if match is None:
+                    break
+                start = match.start()
+                line_start = mm.rfind(b'\n', 0, start) + 1
+                line_end = mm.find(b'\n', start)
+                if line_end < 0:
+                    line_end = size
+                # Следующий поиск - со следующей строки: в этой уже есть совпадение или его нет
+                pos = line_end + 1
+                if match.end() > line_end and regex.search(mm, line_start, line_end) is None:
+                    continue
+                if line_numbers:
+                    # Переводы строк считаются поиском по отображению, без копирования куска файла
+                    newline = mm.find(b'\n', counted, line_start)
+                    while newline >= 0:
+                        lineno += 1
+                        newline = mm.find(b'\n', newline + 1, line_start)
+                    counted = line_start
+                matches.append((lineno if line_numbers else None, mm[line_start:line_end]))
+                if files_only or binary:
+                    break
+            return binary, matches
+
+
+def iter_grep(regex, paths, line_numbers=False, files_only=False, jobs=None, onerror=None):
+    '''
+        Функция которая ищет совпадения в файлах пулом потоков и выдаёт строки результата
+        по мере готовности. Порядок файлов сохраняется, в работе одновременно не больше jobs * 4 файлов,
+        поэтому память не зависит от количества файлов.
+
+        Принимает:
+            1. regex (re.Pattern) - Скомпилированное регулярное выражение над bytes
+            2. paths - Итерируемый объект пар (путь для вывода, путь к файлу)
+            3. line_numbers (bool) - Выводить номера строк (grep -n)
+            4. files_only (bool) - Выводить только имена файлов (grep -l)
+            5. jobs (int) - Количество потоков
+            6. onerror (callable) - Обработчик ошибок чтения файлов
+
+        Вывод: генератор строк (str).
+    '''
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+
+    def task(path):
+        try:
+            return scan_file(path, regex, line_numbers, files_only)
+        except (OSError, ValueError) as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        paths = iter(paths)
+        while True:
+            while len(pending) < jobs * 4:
+                item = next(paths, None)
+                if item is None:
+                    break
+                pending.append((item[0], pool.submit(task, item[1])))
+            if not pending:
+                return
+            display, future = pending.popleft()
+            result = future.result()
+            if isinstance(result, Exception):
+                if onerror:
+                    onerror(result)
+                continue
+            binary, matches = result
+            if not matches:
+                continue
+            if files_only:
+                yield display
+            elif binary:
+                yield f"Binary file {display} matches"
+            else:
+                for lineno, line in matches:
+                    text = line.decode('utf-8', errors='replace')
+                    yield f"{display}:{lineno}:{text}" if line_numbers else f"{display}:{text}"
+
+
+def iter_grep_lines(regex, lines, line_numbers=False, files_only=False):
+    '''
+        Функция которая фильтрует входные строки конвейера по регулярному выражению.
+
+        Принимает:
+            1. regex (re.Pattern) - Скомпилированное регулярное выражение над bytes
+            2. lines - Итерируемый объект строк (bytes)
+            3. line_numbers (bool) - Добавлять номера строк (grep -n)
+            4. files_only (bool) - Вывести только "(standard input)" при первом совпадении (grep -l)
+
+        Вывод: генератор строк (str).
+    '''
+    for lineno, line in enumerate(lines, 1):
+        if regex.search(line):
+            if files_only:
+                yield "(standard input)"
+                return
+            text = line.rstrip(b'\n').decode('utf-8', errors='replace')
+            yield f"{lineno}:{text}" if line_numbers else text
+
+
+def _print_error(error):
+    print(f"{Colors.RED}{error}{Colors.RESET}", file=sys.stderr)
+
+
+def find(shell, path='.', name=None, file_type=None, size=None, mtime=None):
+    '''
+        Функция команды find: ищет файлы и директории по имени, типу, размеру и времени изменения.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. path (str) - Директория поиска (по умолчанию текущая)
+            3. name (str) - Шаблон имени (--name '*.py'; кавычки убирает разбор строки команды)
+            4. file_type (str) - Тип элемента (--type f|d|l)
+            5. size (tuple) - Условие на размер (--size +10M)
+            6. mtime (tuple) - Условие на возраст в днях (--mtime -7)
+
+        Вывод: None
+    '''
+    args = [path] + ([f"--name={name}"] if name else []) + ([f"--type={file_type}"] if file_type else [])
+    args += [f"--size={size[0]}{size[1]}"] if size else []
+    args += [f"--mtime={mtime[0]}{mtime[1]}"] if mtime else []
+    try:
+        root = os.path.abspath(os.path.join(shell.current_dir, path))
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f"'{path}' is not a directory")
+        # page_size=1: каждый найденный путь выводится сразу, а не после заполнения экрана
+        count = write_lines(iter_find(root, path.rstrip(os.sep) or os.sep, name, file_type, size, mtime,
+                                      onerror=_print_error), page_size=1)
+        shell.add_log(f"find {' '.join(args)}")
+        shell.add_to_history('find', args, other_data={'found': count})
+    except OSError as e:
+        error_msg = f"find: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"find {' '.join(args)}", False, error_msg)
+        shell.add_to_history('find', args, False)
+
+
+def grep(shell, pattern, path=None, flag_i=False, flag_n=False, flag_l=False, flag_r=False,
+         include=None, jobs=None):
+    '''
+        Функция команды grep: ищет регулярное выражение в содержимом файлов.
+        Файлы отображаются в память (mmap) и сканируются пулом потоков, результаты выводятся
+        по мере нахождения, не дожидаясь конца обхода дерева.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. pattern (str) - Регулярное выражение
+            3. path (str) - Файл или директория (директория - только с -r). Без него - вход конвейера,
+               а вне конвейера - текущая директория
+            4. flag_i (bool) - Без учёта регистра
+            5. flag_n (bool) - Выводить номера строк
+            6. flag_l (bool) - Выводить только имена файлов с совпадениями
+            7. flag_r (bool) - Рекурсивный поиск по директории
+            8. include (str) - Шаблон имён файлов для поиска (--include '*.py')
+            9. jobs (int) - Количество потоков (--jobs N)
+
+        Вывод: None
+    '''
+    flags = ''.join(flag for flag, on in (('i', flag_i), ('n', flag_n), ('l', flag_l), ('r', flag_r)) if on)
+    stdin = current_input() if path is None else None
+    path = '.' if path is None and stdin is None else path
+    args = ([f"-{flags}"] if flags else []) + ([f"--include={include}"] if include else []) + [pattern]
+    args += [path] if path else []
+    try:
+        regex = re.compile(pattern.encode('utf-8'), re.MULTILINE | (re.IGNORECASE if flag_i else 0))
+        if stdin is not None:
+            count = write_lines(iter_grep_lines(regex, stdin, flag_n, flag_l))
+        else:
+            full_path = os.path.abspath(os.path.join(shell.current_dir, path))
+            if os.path.isdir(full_path):
+                if not flag_r:
+                    raise IsADirectoryError(f"'{path}' is a directory")
+                display_root = path.rstrip(os.sep) or os.sep
+                files = ((display_root + p[len(full_path):], p)
+                         for p in iter_find(full_path, full_path, include, 'f', onerror=_print_error))
+            elif os.path.exists(full_path):
+                files = [(path, full_path)]
+            else:
+                raise FileNotFoundError(f"File '{path}' doesn't exist")
+            count = write_lines(iter_grep(regex, files, flag_n, flag_l, jobs, onerror=_print_error), page_size=1)
+        shell.add_log(f"grep {' '.join(args)}")
+        shell.add_to_history('grep', args, other_data={'matches': count})
+        # Как и в grep: отсутствие совпадений - неуспешный код возврата для скриптов
+        shell.last_status = count > 0
+    except re.error as e:
+        error_msg = f"grep: invalid pattern: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"grep {' '.join(args)}", False, error_msg)
+        shell.add_to_history('grep', args, False)
+    except OSError as e:
+        error_msg = f"grep: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"grep {' '.join(args)}", False, error_msg)
+        shell.add_to_history('grep', args, False)
@@ -0,0 +1,377 @@
+import asyncio
+import contextlib
+import hmac
+import itertools
+import os
+import re
+import secrets
+import shutil
+import socket
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fileio import ConsoleProxy, use_console
+
+# Сколько байт вывода сеанса копится в консоли до отправки клиенту
+CONSOLE_BUFFER = 64 * 1024
+# Допустимые имена сеансов (имя - это ещё и директория состояния сеанса)
+SESSION_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class SessionConsole:
+    '''
+        Класс консоли сеанса: текстовый поток, в который пишут команды сеанса из потоков пула.
+        Запись копится в буфере и отправляется клиенту блоками через цикл событий; поток команды
+        ждёт, пока данные уйдут в сокет (drain), поэтому медленный клиент тормозит только свой сеанс.
+        После разрыва соединения вывод молча отбрасывается.
+    '''
+    def __init__(self, loop, writer):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. loop (asyncio.AbstractEventLoop) - Цикл событий сервера
+                2. writer (asyncio.StreamWriter) - Поток записи соединения
+        '''
+        self.loop = loop
+        self.writer = writer
+        self.closed = False
+        self._parts = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            if self.closed:
+                return len(text)
+            self._parts.append(text)
+            self._size += len(text)
+            full = self._size >= CONSOLE_BUFFER
+        if full:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            data, self._parts, self._size = ''.join(self._parts), [], 0
+        if not data or self.closed:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._send(data.encode()), self.loop).result()
+        except (ConnectionError, RuntimeError):
+            self.closed = True
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def isatty(self):
+        return False
+
+
+class Server:
+    '''
+        Класс сервера сеансов shell.
+
+        Каждое соединение - отдельный сеанс со своей текущей директорией, историей, журналом операций
+        и фоновыми задачами (System_Shell.new_session); лог, корзина и метрики общие. Соединения
+        обслуживает один цикл событий asyncio, а строки команд выполняются в общем пуле потоков,
+        так что тысяча простаивающих клиентов не занимает ни одного потока.
+    '''
+    def __init__(self, shell, workers=32, sessions_dir='.sessions', max_sessions=256, token=None, auth_timeout=10.0):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. shell (System_Shell) - Основной shell (общие лог, корзина, метрики)
+                2. workers (int) - Сколько команд выполняется одновременно
+                3. sessions_dir (str) - Директория состояний сеансов
+                4. max_sessions (int) - Сколько сеансов обслуживается одновременно
+                5. token (str) - Токен, который клиент передаёт первой строкой "auth TOKEN".
+                   Обязателен для TCP; для Unix сокета необязателен (доступ ограничен правами 0600)
+                6. auth_timeout (float) - Сколько секунд ждать строку "auth TOKEN"
+        '''
+        self.shell = shell
+        self.workers = workers
+        self.sessions_dir = os.path.abspath(sessions_dir)
+        self.max_sessions = max_sessions
+        self.token = token
+        self.auth_timeout = auth_timeout
+        self.sessions = {}
+        # Соединения, которые ещё не открыли сеанс (ждут auth или первую строку), тоже занимают место
+        self.pending = 0
+        self.named = set()
+        self.server = None
+        self.socket_path = None
+        self._pool = None
+        self._stdout = None
+        self._counter = itertools.count(1)
+        # Кэши открываются заранее, чтобы сеансы пользовались одними (new_session делает то же при каждом сеансе)
+        shell.open_shared()
+
+    async def start(self, address):
+        '''
+            Функция которая начинает принимать соединения.
+
+            Принимает:
+                1. address (str) - host:port или unix:/path
+
+            Вывод: адрес, на котором слушает сервер (str).
+            TCP без токена - ValueError: к порту может подключиться любой локальный пользователь.
+        '''
+        if address.startswith('unix:'):
+            sock = self._bind_unix(address[len('unix:'):])
+        else:
+            host, _, port = address.rpartition(':')
+            if not host or not port.isdigit():
+                raise ValueError(f"invalid address '{address}' (expected host:port or unix:/path)")
+            if not self.token:
+                raise ValueError(f"a token is required to serve on TCP address '{address}'")
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='session')
+        self._stdout = sys.stdout
+        sys.stdout = ConsoleProxy(sys.stdout)
+        if address.startswith('unix:'):
+            self.server = await asyncio.start_unix_server(self.handle, sock=sock)
+            return address
+        self.server = await asyncio.start_server(self.handle, host, int(port))
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    def _bind_unix(self, path):
+        '''
+            Функция которая создаёт Unix сокет сервера с правами 0600: подключиться может только
+            владелец сервера. Сокет создаётся под umask 0177, чтобы он ни на миг не был доступен другим;
+            оставшийся от прежнего запуска сокет удаляется, любой другой файл по этому пути - нет.
+
+            Принимает:
+                1. path (str) - Путь сокета
+
+            Вывод: привязанный сокет (socket.socket).
+        '''
+        path = os.path.abspath(path)
+        with contextlib.suppress(FileNotFoundError):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError(f"'{path}' exists and is not a socket")
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        self.socket_path = path
+        return sock
+
+    async def close(self):
+        '''Функция которая закрывает сервер и все сеансы, удаляет его Unix сокет и возвращает исходный sys.stdout.'''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.socket_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socket_path)
+            self.socket_path = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._stdout is not None:
+            sys.stdout = self._stdout
+            self._stdout = None
+
+    def open_session(self, name=None):
+        '''
+            Функция которая создаёт сеанс.
+
+            Принимает:
+                1. name (str) - Имя сеанса (история и журнал операций сохраняются между подключениями).
+                   None - новое имя s1, s2, ...
+
+            Вывод: кортеж (имя, shell сеанса). Имя занято или недопустимо - ValueError.
+        '''
+        if name is None:
+            name = f"s{next(self._counter)}"
+            while name in self.sessions:
+                name = f"s{next(self._counter)}"
+        elif not SESSION_NAME.match(name) or name.startswith('.'):
+            raise ValueError(f"invalid session name '{name}'")
+        elif name in self.sessions:
+            raise ValueError(f"session '{name}' is already in use")
+        else:
+            self.named.add(name)
+        session = self.shell.new_session(os.path.join(self.sessions_dir, name))
+        self.sessions[name] = session
+        return name, session
+
+    def close_session(self, name):
+        '''
+            Функция которая отменяет фоновые задачи сеанса, дожидается их и закрывает его историю.
+            Состояние безымянного сеанса удаляется: к нему нельзя переподключиться, а его журнал
+            операций не должен достаться следующему сеансу с тем же номером.
+        '''
+        session = self.sessions.pop(name)
+        session.jobs.close()
+        session.history.close()
+        session.trash.referenced.remove(session.operations.trash_paths)
+        if name in self.named:
+            self.named.discard(name)
+        else:
+            shutil.rmtree(os.path.join(self.sessions_dir, name), ignore_errors=True)
+
+    async def handle(self, reader, writer):
+        '''
+            Функция которая обслуживает одно соединение: первая строка "session NAME" выбирает
+            именованный сеанс, остальные строки выполняются как команды shell, "exit" закрывает соединение.
+            Если у сервера есть токен, первая строка - "auth TOKEN [session NAME]"; до неё клиент
+            не видит ни приглашения, ни текущей директории, а неверный токен или молчание дольше
+            auth_timeout закрывают соединение. Соединение, ещё не открывшее сеанс, считается в max_sessions.
+        '''
+        loop = asyncio.get_running_loop()
+        console = SessionConsole(loop, writer)
+        if len(self.sessions) + self.pending >= self.max_sessions:
+            writer.write(b"System_Shell: too many sessions\n")
+            await self._close_writer(writer)
+            return
+        name = None
+        self.pending += 1
+        pending = True
+        try:
+            if self.token:
+                writer.write(b"System_Shell server. Authenticate with 'auth TOKEN'.\n")
+                await writer.drain()
+                try:
+                    line = await asyncio.wait_for(self._readline(reader), self.auth_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(b"System_Shell: authentication timed out\n")
+                    return
+                words = (line or '').split()
+                if words[:1] != ['auth'] or len(words) < 2 \
+                        or not hmac.compare_digest(words[1].encode(), self.token.encode()):
+                    writer.write(b"System_Shell: authentication failed\n")
+                    return
+                words = words[2:]
+                if words and (words[0] != 'session' or len(words) != 2):
+                    raise ValueError("expected 'auth TOKEN [session NAME]'")
+                line = ' '.join(words)
+                writer.write(f"Type 'exit' to quit.\n{self.shell.current_dir} $ ".encode())
+            else:
+                writer.write(f"System_Shell server. Type 'exit' to quit.\n{self.shell.current_dir} $ ".encode())
+                await writer.drain()
+                line = await self._readline(reader)
+            words = (line or '').split()
+            if words[:1] == ['session'] and len(words) == 2:
+                name, session = self.open_session(words[1])
+                writer.write(f"session {name}\n".encode())
+                line = ''
+            else:
+                name, session = self.open_session()
+            self.pending -= 1
+            pending = False
+            while line is not None:
+                if line.strip() == 'exit':
+                    break
+                if line.strip():
+                    await loop.run_in_executor(self._pool, self._run_line, session, console, line)
+                if console.closed:
+                    break
+                writer.write(f"{session.current_dir} $ ".encode())
+                await writer.drain()
+                line = await self._readline(reader)
+        except ValueError as e:
+            writer.write(f"System_Shell: {e}\n".encode())
+        except ConnectionError:
+            pass
+        finally:
+            if pending:
+                self.pending -= 1
+            if name in self.sessions:
+                await loop.run_in_executor(self._pool, self.close_session, name)
+            await self._close_writer(writer)
+
+    @staticmethod
+    async def _readline(reader):
+        data = await reader.readline()
+        if not data:
+            return None
+        return data.decode('utf-8', errors='replace').rstrip('\r\n')
+
+    @staticmethod
+    def _run_line(session, console, line):
+        with use_console(console):
+            try:
+                session.execute(line)
+                session.report_jobs()
+            finally:
+                console.flush()
+
+    @staticmethod
+    async def _close_writer(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def load_token(path):
+    '''
+        Функция которая читает токен сервера из файла, а если файла нет - создаёт его
+        с новым случайным токеном и правами 0600.
+
+        Принимает:
+            1. path (str) - Путь файла токена
+
+        Вывод: токен (str).
+    '''
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, encoding='utf-8') as f:
+            token = f.read().strip()
+        if not token:
+            raise ValueError(f"token file '{path}' is empty")
+        return token
+    token = secrets.token_hex(32)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + '\n')
+    return token
+
+
+def serve(shell, address=None):
+    '''
+        Функция режима сервера (main.py --serve): принимает соединения до Ctrl-C.
+        По TCP клиент сначала отправляет "auth TOKEN" с токеном из SERVER_CONFIG['token_file'].
+
+        Принимает:
+            1. shell (System_Shell) - Основной shell
+            2. address (str) - unix:/path или host:port (по умолчанию - из SERVER_CONFIG)
+
+        Вывод: код возврата (int).
+    '''
+    from config import SERVER_CONFIG
+    address = address or SERVER_CONFIG['address']
+    token = None if address.startswith('unix:') else load_token(SERVER_CONFIG['token_file'])
+    server = Server(shell, SERVER_CONFIG['workers'], SERVER_CONFIG['sessions_dir'], SERVER_CONFIG['max_sessions'], token,
+                    SERVER_CONFIG['auth_timeout'])
+
+    async def run():
+        listening = await server.start(address)
+        print(f"System_Shell server listening on {listening}", file=sys.stderr)
+        if token:
+            print(f"Clients must send 'auth TOKEN' with the token from {os.path.abspath(SERVER_CONFIG['token_file'])}",
+                  file=sys.stderr)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,130 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, RotatingFileHandler, TimedRotatingFileHandler
+
+# Поля записи лога, которые команды передают через extra
+LOG_FIELDS = ('command', 'status', 'error', 'duration_ms', 'bytes')
+
+_listener = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    '''Класс форматтера, который пишет каждую запись лога отдельной строкой JSON.'''
+    def format(self, record):
+        data = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')}
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if 'command' not in data:
+            data['message'] = record.getMessage()
+        return json.dumps(data, ensure_ascii=False)
+
+
+class BatchFlushMixin:
+    '''Класс-примесь для файловых обработчиков: пока batching=True, flush после каждой записи не выполняется.'''
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            super().flush()
+
+
+class SizeRotatingFileHandler(BatchFlushMixin, RotatingFileHandler):
+    '''Класс обработчика с ротацией по размеру файла и пакетным сбросом буфера.'''
+
+
+class TimeRotatingFileHandler(BatchFlushMixin, TimedRotatingFileHandler):
+    '''Класс обработчика с ротацией по времени и пакетным сбросом буфера.'''
+
+
+class BatchQueueListener:
+    '''
+        Класс фонового писателя логов.
+
+        Забирает записи из очереди в отдельном потоке пачками до batch_size штук
+        и сбрасывает файлы на диск один раз на пачку.
+    '''
+    def __init__(self, log_queue, handlers, batch_size=256):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        '''Функция которая запускает поток записи.'''
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write(batch)
+                    return
+                batch.append(record)
+            self._write(batch)
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            handler.batching = True
+        try:
+            for record in batch:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+        finally:
+            for handler in self.handlers:
+                handler.batching = False
+                handler.flush()
+
+    def stop(self):
+        '''Функция которая дописывает оставшиеся записи и останавливает поток.'''
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+def stop_queue_logging():
+    '''Функция которая останавливает фоновый писатель логов, дописав все записи из очереди.'''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def start_queue_logging(logger, batch_size=256):
+    '''
+        Функция которая переносит обработчики логгера в фоновый поток: логгер получает
+        QueueHandler, поэтому вызывающий поток никогда не ждёт файлового ввода-вывода.
+
+        Принимает:
+            1. logger (logging.Logger) - Настроенный логгер
+            2. batch_size (int) - Максимальный размер пачки записей
+    '''
+    global _listener
+    handlers = list(logger.handlers)
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    _listener = BatchQueueListener(log_queue, handlers, batch_size)
+    _listener.start()
+
+
+atexit.register(stop_queue_logging)
@@ -0,0 +1,429 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ansi import Colors
+from copy_engine import Progress, transfer_file
+from fileio import write_lines
+from jobs import JobCancelled, current_job, check_cancelled
+from checksum import hash_file, open_cache
+
+
+def _scan_dir(root, rel_dir, state, manifest_name=None):
+    '''
+        Функция которая читает одну директорию дерева в состояние state.
+
+        Принимает:
+            1. root (str) - Корень дерева
+            2. rel_dir (str) - Директория относительно корня ('' - корень)
+            3. state (dict) - Состояние {'files': {rel: [size, mtime_ns]}, 'links': {rel: target}, 'dirs': {rel: ...}}
+            4. manifest_name (str) - Имя файла манифеста в корне (не входит в дерево)
+
+        Вывод: список поддиректорий (rel).
+    '''
+    subdirs = []
+    with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as it:
+        for entry in it:
+            rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            if not rel_dir and manifest_name and entry.name.startswith(manifest_name):
+                continue
+            if entry.is_symlink():
+                state['links'][rel] = os.readlink(entry.path)
+            elif entry.is_dir():
+                state['dirs'][rel] = None
+                subdirs.append(rel)
+            else:
+                stat = entry.stat()
+                state['files'][rel] = [stat.st_size, stat.st_mtime_ns]
+    return subdirs
+
+
+def scan_tree(root, state=None, rel_dir='', manifest_name=None):
+    '''
+        Функция которая обходит дерево (или поддерево rel_dir) и возвращает его состояние:
+        размер и mtime файлов, цели символических ссылок и список директорий.
+    '''
+    state = state or {'files': {}, 'links': {}, 'dirs': {}}
+    stack = [rel_dir]
+    while stack:
+        stack.extend(_scan_dir(root, stack.pop(), state, manifest_name))
+    return state
+
+
+def _parent(rel):
+    return os.path.dirname(rel)
+
+
+def _parents(rel):
+    parent = _parent(rel)
+    while parent:
+        yield parent
+        parent = _parent(parent)
+
+
+def _drop_subtree(state, *rels):
+    '''Функция которая удаляет из состояния элементы rels и всё, что внутри них (за один проход).'''
+    rels = set(rels)
+    for kind in ('files', 'links', 'dirs'):
+        for path in [path for path in state[kind] if path in rels or any(p in rels for p in _parents(path))]:
+            del state[kind][path]
+
+
+class SyncEngine:
+    '''
+        Класс инкрементальной синхронизации дерева src в dst.
+
+        Сравнение файлов - по размеру и mtime или, с checksum, по контрольным суммам (с кэшем).
+        Копируются только новые и изменённые файлы: через временный файл и os.replace,
+        прежняя версия сохраняется в корзине, поэтому синхронизация отменяется undo.
+        После синхронизации в корне dst записывается манифест: состояние файлов dst и mtime
+        его директорий. Следующий запуск не обходит dst, а берёт состояние из манифеста и
+        перечитывает только директории, у которых изменился mtime (в них что-то добавили или удалили).
+        Изменение содержимого файла dst без изменения его директории так не обнаруживается - для
+        этого есть проверка по контрольным суммам.
+    '''
+    def __init__(self, jobs=None, checksum=None, delete=False, progress=None, manifest='.sync_manifest.json'):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. jobs (int) - Количество потоков копирования и хэширования
+                2. checksum (HashCache) - Кэш контрольных сумм для сравнения по содержимому, None - по размеру и mtime
+                3. delete (bool) - Удалять из dst то, чего нет в src
+                4. progress (bool) - Выводить ли прогресс (по умолчанию - если stderr это терминал)
+                5. manifest (str) - Имя файла манифеста в корне dst
+        '''
+        self.jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+        self.checksum = checksum
+        self.delete = delete
+        self.progress = progress
+        self.manifest = manifest
+
+    def load_state(self, src, dst):
+        '''
+            Функция которая возвращает состояние dst: из манифеста с перечитыванием изменённых
+            директорий или, если манифеста нет (или он от другого источника), полным обходом.
+
+            Вывод: кортеж (состояние, использован ли манифест).
+        '''
+        state = {'files': {}, 'links': {}, 'dirs': {}}
+        if not os.path.isdir(dst):
+            return state, False
+        try:
+            with open(os.path.join(dst, self.manifest), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('src') != src:
+                raise ValueError("manifest of another source")
+            state = {kind: dict(manifest[kind]) for kind in ('files', 'links', 'dirs')}
+        except (OSError, ValueError, KeyError, TypeError):
+            return scan_tree(dst, manifest_name=self.manifest), False
+
+        # Элементы по родительской директории, чтобы перечитывать директорию без просмотра всего состояния
+        children = {}
+        for kind in ('files', 'links', 'dirs'):
+            for rel in state[kind]:
+                if rel:
+                    children.setdefault(_parent(rel), []).append((kind, rel))
+
+        for rel_dir, mtime in sorted(state['dirs'].items(), key=lambda item: item[0].count(os.sep)):
+            if rel_dir not in state['dirs']:
+                # Директория исчезла вместе с родительской
+                continue
+            try:
+                if os.stat(os.path.join(dst, rel_dir) if rel_dir else dst).st_mtime_ns == mtime:
+                    continue
+            except FileNotFoundError:
+                _drop_subtree(state, rel_dir)
+                continue
+            old_dirs = set()
+            for kind, rel in children.get(rel_dir, []):
+                if rel in state[kind]:
+                    if kind == 'dirs':
+                        old_dirs.add(rel)
+                    else:
+                        del state[kind][rel]
+            subdirs = _scan_dir(dst, rel_dir, state, self.manifest)
+            for rel in old_dirs - set(subdirs):
+                _drop_subtree(state, rel)
+            for rel in subdirs:
+                if rel not in old_dirs:
+                    # Новая директория dst, которой нет в манифесте, читается целиком
+                    scan_tree(dst, state, rel, self.manifest)
+        # Корень хранится в манифесте только ради его mtime
+        state['dirs'].pop('', None)
+        return state, True
+
+    def plan(self, src, dst):
+        '''
+            Функция которая сравнивает деревья src и dst и составляет план синхронизации.
+
+            Принимает:
+                1. src (str) - Исходная директория
+                2. dst (str) - Целевая директория (может не существовать)
+
+            Вывод: план (dict): src, dst, deletes (rel), mkdirs (rel), copies ((rel, size, заменяется ли)),
+            links ((rel, target, заменяется ли)), touches (rel - содержимое совпало, обновляется только mtime),
+            unchanged (количество), bytes, состояние dst (state) и использован ли манифест (manifest).
+        '''
+        src = os.path.abspath(src)
+        dst = os.path.abspath(dst)
+        source = scan_tree(src, manifest_name=self.manifest)
+        state, from_manifest = self.load_state(src, dst)
+        target_files, target_links, target_dirs = state['files'], state['links'], state['dirs']
+        plan = {'src': src, 'dst': dst, 'deletes': [], 'mkdirs': [], 'copies': [], 'links': [], 'touches': [],
+                'unchanged': 0, 'bytes': 0, 'state': state, 'manifest': from_manifest}
+
+        if not os.path.isdir(dst):
+            plan['mkdirs'].append('')
+        for rel in sorted(source['dirs'], key=lambda rel: rel.count(os.sep)):
+            if rel not in target_dirs:
+                if rel in target_files or rel in target_links:
+                    plan['deletes'].append(rel)
+                plan['mkdirs'].append(rel)
+
+        same_size = []
+        for rel, (size, mtime) in source['files'].items():
+            if rel in target_dirs or rel in target_links:
+                plan['deletes'].append(rel)
+                plan['copies'].append((rel, size, False))
+            elif rel not in target_files or target_files[rel][0] != size:
+                plan['copies'].append((rel, size, rel in target_files))
+            elif self.checksum is not None:
+                same_size.append(rel)
+            elif target_files[rel][1] != mtime:
+                plan['copies'].append((rel, size, True))
+            else:
+                plan['unchanged'] += 1
+
+        if same_size:
+            # Файлы одного размера сравниваются по содержимому пулом потоков (неизменённые берутся из кэша)
+            def differs(rel):
+                return hash_file(os.path.join(src, rel), self.checksum) != \
+                    hash_file(os.path.join(dst, rel), self.checksum)
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                for rel, changed in zip(same_size, pool.map(differs, same_size)):
+                    if changed:
+                        plan['copies'].append((rel, source['files'][rel][0], True))
+                    elif target_files[rel][1] != source['files'][rel][1]:
+                        plan['touches'].append(rel)
+                    else:
+                        plan['unchanged'] += 1
+
+        for rel, link_target in source['links'].items():
+            if target_links.get(rel) == link_target:
+                plan['unchanged'] += 1
+                continue
+            if rel in target_dirs or rel in target_files:
+                plan['deletes'].append(rel)
+            plan['links'].append((rel, link_target, rel in target_links))
+
+        if self.delete:
+            for kind in ('files', 'links', 'dirs'):
+                for rel in state[kind]:
+                    if rel not in source['files'] and rel not in source['links'] and rel not in source['dirs']:
+                        plan['deletes'].append(rel)
+        # Удаляются только верхние элементы: содержимое удалённой директории уходит в корзину вместе с ней
+        deletes = set(plan['deletes'])
+        plan['deletes'] = sorted(rel for rel in deletes if not any(parent in deletes for parent in _parents(rel)))
+        plan['copies'].sort()
+        plan['bytes'] = sum(size for _, size, _ in plan['copies'])
+        return plan
+
+    def apply(self, plan, trash):
+        '''
+            Функция которая выполняет план синхронизации и записывает манифест.
+
+            Принимает:
+                1. plan (dict) - План (см. plan)
+                2. trash (Trash) - Корзина: удаляемые и заменяемые элементы сохраняются в ней для undo
+
+            Вывод: кортеж (items, errors): данные выполненных действий для журнала операций
+            (элементы как у cp и rm, созданные директории - {'dir_path'}) и список ошибок (OSError).
+            Если фоновую задачу отменили, оставшиеся файлы не копируются, а среди ошибок - JobCancelled;
+            выполненная часть записывается в манифест, и повторный запуск её не повторяет.
+        '''
+        src, dst, state = plan['src'], plan['dst'], plan['state']
+        items, errors = [], []
+
+        def full(root, rel):
+            return os.path.join(root, rel) if rel else root
+
+        deleted = []
+        for rel in plan['deletes']:
+            try:
+                entry = trash.put(full(dst, rel))
+                items.append({'path': full(dst, rel), 'trash_path': entry['trash_path'], 'trash_id': entry['id']})
+                deleted.append(rel)
+            except OSError as e:
+                errors.append(e)
+        if deleted:
+            _drop_subtree(state, *deleted)
+        for rel in plan['mkdirs']:
+            try:
+                os.mkdir(full(dst, rel))
+                items.append({'dir_path': full(dst, rel)})
+            except FileExistsError:
+                pass
+            except OSError as e:
+                errors.append(e)
+                continue
+            if rel:
+                state['dirs'][rel] = None
+
+        job = current_job()
+        progress = Progress('sync', len(plan['copies']), plan['bytes'], self.progress)
+
+        def copy(rel, size, replace):
+            if job is not None and job.cancel_event.is_set():
+                return None
+            dst_file = full(dst, rel)
+            # Новая версия пишется рядом и подменяет файл атомарно: частично скопированного файла не бывает
+            tmp_path = os.path.join(os.path.dirname(dst_file), f".{os.path.basename(dst_file)}.sync-tmp")
+            try:
+                nbytes, _ = transfer_file(full(src, rel), tmp_path, size)
+                item = {'src_path': full(src, rel), 'dst_path': dst_file, 'bytes': nbytes}
+                if replace and os.path.lexists(dst_file):
+                    entry = trash.put(dst_file, link=True)
+                    item.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+                os.replace(tmp_path, dst_file)
+            except OSError as e:
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                return e
+            stat = os.stat(dst_file)
+            state['files'][rel] = [stat.st_size, stat.st_mtime_ns]
+            progress.update(1, nbytes)
+            return item
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for result in pool.map(lambda task: copy(*task), plan['copies']):
+                if isinstance(result, OSError):
+                    errors.append(result)
+                elif result is not None:
+                    items.append(result)
+        progress.finish()
+
+        for rel, link_target, replace in plan['links']:
+            dst_link = full(dst, rel)
+            try:
+                item = {'src_path': full(src, rel), 'dst_path': dst_link}
+                if replace and os.path.lexists(dst_link):
+                    entry = trash.put(dst_link)
+                    item.update({'replaced_trash_path': entry['trash_path'], 'replaced_trash_id': entry['id']})
+                os.symlink(link_target, dst_link)
+                state['links'][rel] = link_target
+                items.append(item)
+            except OSError as e:
+                errors.append(e)
+        for rel in plan['touches']:
+            try:
+                shutil.copystat(full(src, rel), full(dst, rel))
+                stat = os.stat(full(dst, rel))
+                state['files'][rel] = [stat.st_size, stat.st_mtime_ns]
+            except OSError as e:
+                errors.append(e)
+
+        try:
+            check_cancelled(job)
+        except JobCancelled as e:
+            errors.append(e)
+        if os.path.isdir(dst):
+            try:
+                self.save_manifest(src, dst, state)
+            except OSError as e:
+                errors.append(e)
+        return items, errors
+
+    def save_manifest(self, src, dst, state):
+        '''Функция которая записывает манифест: состояние dst и текущие mtime его директорий.'''
+        dirs = {}
+        for rel in [''] + sorted(state['dirs']):
+            try:
+                dirs[rel] = os.stat(os.path.join(dst, rel) if rel else dst).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        # Запись манифеста меняет mtime корня, поэтому корень следующий запуск перечитает (одна директория)
+        path = os.path.join(dst, self.manifest)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'src': src, 'time': time.time(), 'files': state['files'], 'links': state['links'],
+                       'dirs': dirs}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+
+def iter_plan(plan):
+    '''
+        Функция которая формирует строки плана синхронизации для --dry-run:
+        "- path" - удаление, "+ path" - новый файл или директория, "* path" - обновление,
+        "~ path" - содержимое совпадает, обновляется только время изменения.
+    '''
+    for rel in plan['deletes']:
+        yield f"- {rel}{os.sep if rel in plan['state']['dirs'] else ''}"
+    for rel in plan['mkdirs']:
+        if rel:
+            yield f"+ {rel}{os.sep}"
+    for rel, _, replace in plan['copies']:
+        yield f"{'*' if replace else '+'} {rel}"
+    for rel, link_target, replace in plan['links']:
+        yield f"{'*' if replace else '+'} {rel} -> {link_target}"
+    for rel in plan['touches']:
+        yield f"~ {rel}"
+
+
+def summary(plan, done=False):
+    '''Функция которая возвращает итоговую строку плана (done - после выполнения): сколько файлов копируется и удаляется.'''
+    copies, size, deletes = len(plan['copies']) + len(plan['links']), plan['bytes'] / 2**20, len(plan['deletes'])
+    if done:
+        return f"copied {copies} files ({size:.1f} MiB), deleted {deletes}, {plan['unchanged']} unchanged"
+    return f"{copies} to copy ({size:.1f} MiB), {deletes} to delete, {plan['unchanged']} unchanged"
+
+
+def sync(shell, src, dst, delete=False, checksum=False, dry_run=False, jobs=None):
+    '''
+        Функция команды sync: инкрементально синхронизирует директорию src в dst -
+        копирует только новые и изменённые файлы. Вся синхронизация - одна операция, которую отменяет undo.
+
+        Принимает:
+            1. shell (System_Shell) - Shell
+            2. src (str) - Исходная директория
+            3. dst (str) - Целевая директория
+            4. delete (bool) - Удалить из dst то, чего нет в src (--delete)
+            5. checksum (bool) - Сравнивать файлы по контрольным суммам, а не по размеру и mtime (--checksum, -c)
+            6. dry_run (bool) - Только вывести план (--dry-run, -n)
+            7. jobs (int) - Количество потоков (--jobs N)
+
+        Вывод: None
+    '''
+    from config import SYNC_CONFIG
+    args = (['--delete'] if delete else []) + (['--checksum'] if checksum else []) + \
+           (['--dry-run'] if dry_run else []) + ([f'--jobs={jobs}'] if jobs else []) + [src, dst]
+    try:
+        src_path = os.path.join(shell.current_dir, src)
+        dst_path = os.path.join(shell.current_dir, dst)
+        if not os.path.isdir(src_path):
+            raise NotADirectoryError(f"'{src}' is not a directory")
+        if os.path.lexists(dst_path) and not os.path.isdir(dst_path):
+            raise NotADirectoryError(f"'{dst}' is not a directory")
+        cache = open_cache(shell) if checksum else None
+        engine = SyncEngine(jobs, cache, delete, manifest=SYNC_CONFIG['manifest'])
+        plan = engine.plan(src_path, dst_path)
+        shell.save_hash_cache(cache)
+
+        if dry_run:
+            write_lines(iter_plan(plan))
+            print(summary(plan))
+            shell.add_log(f"sync {' '.join(args)}")
+            shell.add_to_history('sync', args, other_data={'copies': len(plan['copies']),
+                                                           'deletes': len(plan['deletes']), 'bytes': plan['bytes']})
+            return
+
+        with shell.trash.batch():
+            items, errors = engine.apply(plan, shell.trash)
+        print(summary(plan, done=True))
+        shell.finish_batch('sync', args, items, errors)
+    except OSError as e:
+        error_msg = f"sync: {str(e)}"
+        print(f"{Colors.RED}{error_msg}{Colors.RESET}")
+        shell.add_log(f"sync {' '.join(args)}", False, error_msg)
+        shell.add_to_history('sync', args, False)
@@ -1,9 +1,50 @@
 import unittest
+import asyncio
+import sys
+import unittest.mock
 from unittest.mock import mock_open
 from unittest.mock import patch
 import os
 import shutil
+import io
 import json
+import contextlib
+import tarfile
+import zipfile
+import gzip
+import re
+import errno
+import tempfile
+import logging
+import subprocess
+import threading
+import hashlib
+from journal import Journal
+from history_db import HistoryDB
+from fileio import iter_file, write_chunks, write_lines, parse_range, BinaryFileError
+from listing import iter_listing
+from listing_cache import ListingCache
+from copy_engine import CopyEngine, copy_file, transfer_file
+from trash import Trash
+from move_engine import move_path, checkpoint_path, save_checkpoint
+from shell_logging import JsonLinesFormatter, SizeRotatingFileHandler, start_queue_logging, stop_queue_logging
+from config import LOGGING_CONFIG
+from main import System_Shell
+from commands import Command, UsageError, get_command, expand_globs
+from operations import OperationJournal
+from search import iter_find, scan_file
+from disk_usage import SizeCache, tree_sizes, iter_du
+from metrics import MetricsRegistry, percentile
+from pipeline import split_pipeline
+from jobs import Job, job_context
+from server import Server
+import server as server_module
+from archive import ParallelGzipWriter
+from checksum import ChecksumMismatch, HashCache, hash_file
+import checksum
+import move_engine
+from sync_engine import SyncEngine
+from completion import CompletionIndex, Completer
 
 
 class ShellTests(unittest.TestCase):
@@ -184,5 +225,1428 @@ class ShellTests(unittest.TestCase):
                 with open(".history", "r") as f:
                     json.load(f)
 
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, ".history")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_journal_append_only(self):
+        journal = Journal(self.path)
+        journal.load()
+        for i in range(50):
+            journal.append({"command": "ls", "args": [str(i)]})
+        journal.close()
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(json.loads(lines[-1])["args"], ["49"])
+
+    def test_journal_lazy_tail(self):
+        journal = Journal(self.path)
+        journal.load()
+        for i in range(30):
+            journal.append({"command": "ls", "args": [str(i)]})
+        journal.close()
+
+        journal = Journal(self.path, tail_size=5)
+        journal.load()
+        self.assertEqual(len(journal._tail), 5)
+        self.assertEqual(len(journal.tail(20)), 20)
+        self.assertEqual(journal.append({"command": "cd"})["id"], 31)
+        journal.close()
+
+    def test_journal_remove_and_compact(self):
+        journal = Journal(self.path, compact_every=4)
+        journal.load()
+        first = journal.append({"command": "cp"})
+        second = journal.append({"command": "mv"})
+        journal.remove(second["id"])
+        self.assertEqual([e["command"] for e in journal.iter_reversed()], ["cp"])
+
+        journal.remove(first["id"])
+        journal.close()
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+
+    def test_journal_legacy_migration(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump([{"command": "ls", "args": []}, {"command": "cd", "args": [".."]}], f)
+
+        journal = Journal(self.path)
+        journal.load()
+        self.assertEqual([e["id"] for e in journal.tail(5)], [1, 2])
+        journal.close()
+
+class HistoryDBTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, ".history.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def entry(self, command, args, status=True, time="2025-01-01T12:00:00", current_dir="/home"):
+        return {"time": time, "command": command, "args": args, "status": status,
+                "current_dir": current_dir, "other_data": {}}
+
+    def test_history_search_filters(self):
+        history = HistoryDB(self.path)
+        history.append(self.entry("cp", ["report.txt", "backup"], time="2025-01-01T10:00:00"))
+        history.append(self.entry("rm", ["report.txt"], status=False, time="2025-01-02T10:00:00"))
+        history.append(self.entry("ls", ["-l"], current_dir="/tmp", time="2025-01-03T10:00:00"))
+
+        self.assertEqual([e["command"] for e in history.search("REPORT")], ["cp", "rm"])
+        self.assertEqual([e["command"] for e in history.search("rm")], ["rm"])
+        self.assertEqual([e["command"] for e in history.search(failed=True)], ["rm"])
+        self.assertEqual([e["command"] for e in history.search(since="2025-01-02")], ["rm", "ls"])
+        self.assertEqual([e["command"] for e in history.search(until="2025-01-02")], ["cp"])
+        self.assertEqual([e["command"] for e in history.search(directory="/tmp")], ["ls"])
+        self.assertEqual([e["args"] for e in history.tail(1)], [["-l"]])
+        history.close()
+
+        reopened = HistoryDB(self.path)
+        self.assertEqual(reopened.recent_lines(2), ["rm report.txt", "ls -l"])
+        reopened.close()
+
+    def test_history_legacy_import(self):
+        legacy = os.path.join(self.tmp, ".history")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump([self.entry("ls", []), self.entry("cd", [".."])], f)
+
+        history = HistoryDB(self.path, legacy)
+        self.assertEqual([(e["id"], e["command"]) for e in history.tail(5)], [(1, "ls"), (2, "cd")])
+        history.close()
+        with open(legacy, "r", encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+        # Повторное открытие не импортирует журнал второй раз
+        history = HistoryDB(self.path, legacy)
+        self.assertEqual(len(history.tail(5)), 2)
+        history.close()
+
+class StreamingCatTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "log.txt")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("".join(f"line {i}\n" for i in range(1, 1001)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self, **kwargs):
+        return b"".join(iter_file(self.path, block_size=16, **kwargs)).decode()
+
+    def test_cat_line_ranges(self):
+        self.assertEqual(self.read(line_range=(1, 2)), "line 1\nline 2\n")
+        self.assertEqual(self.read(line_range=(999, None)), "line 999\nline 1000\n")
+        self.assertEqual(self.read(line_range=(-2, None)), "line 999\nline 1000\n")
+
+    def test_cat_byte_ranges(self):
+        self.assertEqual(self.read(byte_range=(0, 5)), "line 1")
+        self.assertEqual(self.read(byte_range=(-5, None)), "1000\n")
+
+    def test_cat_binary_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"ELF\0\1\2")
+
+        with self.assertRaises(BinaryFileError):
+            self.read()
+
+    def test_write_chunks_truncated_utf8(self):
+        out = io.StringIO()
+        self.assertEqual(write_chunks([b"abc", "\u20ac".encode()[:2]], out), 5)
+        self.assertEqual(out.getvalue(), "abc\ufffd\n")
+
+    def test_cat_parse_range(self):
+        self.assertEqual(parse_range("10-20"), (10, 20))
+        self.assertEqual(parse_range("-5"), (-5, None))
+        self.assertEqual(parse_range("7-"), (7, None))
+        with self.assertRaises(ValueError):
+            parse_range("abc")
+        self.assertEqual(get_command("cat").parse(["--bytes=0-2", "f"])[1], {"byte_range": (0, 2)})
+        with self.assertRaisesRegex(UsageError, "numbered from 1"):
+            get_command("cat").parse(["--lines=0-2", "f"])
+
+class ListingTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name, size in (("small", 1), ("big", 100), (".hidden", 10)):
+            with open(os.path.join(self.tmp, name), "w") as f:
+                f.write("x" * size)
+        os.mkdir(os.path.join(self.tmp, "sub"))
+        open(os.path.join(self.tmp, "sub", "inner"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_ls_sorted_without_hidden(self):
+        self.assertEqual(list(iter_listing(self.tmp)), ["big", "small", "sub"])
+        self.assertIn(".hidden", list(iter_listing(self.tmp, flag_a=True)))
+
+    def test_ls_sort_by_size(self):
+        lines = list(iter_listing(self.tmp, sort_by="size"))
+        self.assertLess(lines.index("big"), lines.index("small"))
+
+    def test_ls_recursive(self):
+        lines = list(iter_listing(self.tmp, flag_R=True))
+        self.assertEqual(lines, [".:", "big", "small", "sub", "", "./sub:", "inner"])
+        lines = list(iter_listing(os.path.join(self.tmp, "sub"), flag_R=True, label="sub"))
+        self.assertEqual(lines, ["sub:", "inner"])
+
+    def test_ls_FileNotFoundError(self):
+        with self.assertRaises(FileNotFoundError):
+            list(iter_listing(os.path.join(self.tmp, "missing")))
+
+    def test_ls_write_lines_per_page(self):
+        out = unittest.mock.MagicMock()
+        count = write_lines((str(i) for i in range(10)), out, page_size=4)
+        self.assertEqual(count, 10)
+        self.assertEqual(out.write.call_count, 3)
+
+class ListingCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def names(self, cache, path=None):
+        return sorted(iter_listing(path or self.tmp, cache=cache))
+
+    def check_invalidation(self, cache):
+        open(os.path.join(self.tmp, "a"), "w").close()
+        self.assertEqual(self.names(cache), ["a"])
+        self.assertEqual(self.names(cache), ["a"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        os.mkdir(os.path.join(self.tmp, "b"))
+        # Разные mtime_ns гарантированы не на всех файловых системах
+        os.utime(self.tmp, ns=(0, 1))
+        self.assertEqual(self.names(cache), ["a", "b"])
+        self.assertEqual(cache.misses, 2)
+
+    def test_mtime_invalidation(self):
+        self.check_invalidation(ListingCache(use_inotify=False))
+
+    def test_inotify_invalidation(self):
+        cache = ListingCache()
+        if cache.inotify is None:
+            self.skipTest("inotify is not available")
+        self.check_invalidation(cache)
+
+        with open(os.path.join(self.tmp, "a"), "w") as f:
+            f.write("12345")
+        lines = list(iter_listing(self.tmp, flag_l=True, cache=cache))
+        self.assertIn("\t5\t", lines[0])
+        self.assertEqual(cache.misses, 2)
+
+    def test_streaming_miss_and_limit(self):
+        cache = ListingCache(max_entries=3)
+        for i in range(5):
+            open(os.path.join(self.tmp, str(i)), "w").close()
+        real_scandir = os.scandir
+
+        @contextlib.contextmanager
+        def stalled_scandir(path):
+            # Второй элемент "не приходит": потоковый ls должен вывести первый, не дожидаясь конца чтения
+            def entries(it):
+                yield next(it)
+                raise OSError("stalled")
+            with real_scandir(path) as it:
+                yield entries(it)
+
+        with patch("os.scandir", stalled_scandir):
+            lines = iter_listing(self.tmp, sort_by=None, cache=cache)
+            self.assertIsNotNone(next(lines))
+            with self.assertRaises(OSError):
+                next(lines)
+        self.assertEqual(cache.stats()['dirs'], 0)
+
+        self.assertEqual(len(self.names(cache)), 5)
+        self.assertEqual(cache.stats()['dirs'], 0)
+        self.assertEqual(cache.watches, {})
+
+    def test_lru_bound(self):
+        cache = ListingCache(max_entries=3, use_inotify=False)
+        dirs = []
+        for name in ("x", "y"):
+            path = os.path.join(self.tmp, name)
+            os.mkdir(path)
+            for i in range(2):
+                open(os.path.join(path, str(i)), "w").close()
+            dirs.append(path)
+
+        self.names(cache, dirs[0])
+        self.names(cache, dirs[1])
+        self.assertEqual(cache.stats()['dirs'], 1)
+        self.assertLessEqual(cache.size, 3)
+        cache.invalidate(dirs[1])
+        self.assertEqual(cache.stats()['dirs'], 0)
+
+
+class DiskUsageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, "t")
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        os.makedirs(os.path.join(self.root, "c"))
+        for name, size in ((("a", "f1"), 100), (("a", "b", "f2"), 50), (("c", "f3"), 7)):
+            with open(os.path.join(self.root, *name), "wb") as f:
+                f.write(b"x" * size)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_totals_and_output(self):
+        totals = tree_sizes(self.root, apparent=True, jobs=2)
+        self.assertEqual(totals[self.root], 157)
+        self.assertEqual(totals[os.path.join(self.root, "a")], 150)
+        self.assertEqual(list(iter_du(totals, self.root, "t", max_depth=1, sort_by='size')),
+                         ["157\tt", "150\tt/a", "7\tt/c"])
+
+    def test_cache_rewalks_only_changed_dirs(self):
+        cache = SizeCache(os.path.join(self.tmp, "cache.json"))
+        cache.load()
+        first = tree_sizes(self.root, cache)
+        cache.save()
+
+        cache = SizeCache(cache.path)
+        cache.load()
+        with patch("disk_usage.scan_dir", wraps=__import__("disk_usage").scan_dir) as scan:
+            self.assertEqual(tree_sizes(self.root, cache), first)
+            self.assertEqual(scan.call_count, 0)
+
+            shutil.rmtree(os.path.join(self.root, "c"))
+            totals = tree_sizes(self.root, cache)
+            self.assertEqual(scan.call_count, 1)
+        self.assertNotIn(os.path.join(self.root, "c"), totals)
+        self.assertNotIn(os.path.join(self.root, "c"), cache.dirs)
+
+    def test_cache_save_and_prune_during_put(self):
+        cache = SizeCache(os.path.join(self.tmp, "cache.json"))
+        cache.load()
+        st = os.stat(self.root)
+        done = threading.Event()
+
+        def writer():
+            for i in range(20000):
+                cache.put(os.path.join(self.root, f"d{i}"), st, i, [])
+            done.set()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            while not done.is_set():
+                cache.prune(self.root, set())
+                cache.changed = True
+                cache.save()
+        finally:
+            thread.join()
+        cache.save()
+        with open(cache.path) as f:
+            self.assertEqual(json.load(f), cache.dirs)
+
+
+class CopyEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(os.path.join(self.src, "a", "b"))
+        for i in range(20):
+            with open(os.path.join(self.src, "a", f"file_{i}"), "w") as f:
+                f.write(str(i) * (i + 1))
+        with open(os.path.join(self.src, "a", "b", "deep"), "wb") as f:
+            f.write(os.urandom(200000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cp_tree_parallel(self):
+        dst = os.path.join(self.tmp, "dst")
+        stats = CopyEngine(jobs=4, progress=False).copy_tree(self.src, dst)
+
+        self.assertEqual(stats["files"], 21)
+        for root, _, files in os.walk(self.src):
+            for name in files:
+                src_file = os.path.join(root, name)
+                with open(src_file, "rb") as f1, open(os.path.join(dst, os.path.relpath(src_file, self.src)), "rb") as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    def test_cp_not_enough_space(self):
+        with patch("shutil.disk_usage") as mock_usage:
+            mock_usage.return_value = shutil._ntuple_diskusage(100, 100, 0)
+
+            with self.assertRaises(OSError):
+                CopyEngine(progress=False).copy_tree(self.src, os.path.join(self.tmp, "dst"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "dst")))
+
+    def test_cp_kernel_copy_fallback(self):
+        src_file = os.path.join(self.src, "a", "b", "deep")
+        dst_file = os.path.join(self.tmp, "copy")
+        with patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "cross-device")):
+            copy_file(src_file, dst_file)
+
+        with open(src_file, "rb") as f1, open(dst_file, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_cp_link_tree(self):
+        dst = os.path.join(self.tmp, "dst")
+        with patch("shutil.disk_usage", return_value=shutil._ntuple_diskusage(100, 100, 0)):
+            stats = CopyEngine(progress=False, mode='link').copy_tree(self.src, dst)
+
+        self.assertEqual(stats["strategy"], "link")
+        self.assertTrue(os.path.samefile(os.path.join(self.src, "a", "b", "deep"), os.path.join(dst, "a", "b", "deep")))
+
+    def test_reflink_fallback(self):
+        src_file = os.path.join(self.src, "a", "b", "deep")
+        dst_file = os.path.join(self.tmp, "clone")
+        unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+        with patch("copy_engine.reflink", side_effect=unsupported):
+            with self.assertRaises(OSError):
+                transfer_file(src_file, dst_file, mode='always')
+            self.assertFalse(os.path.exists(dst_file))
+
+            self.assertEqual(transfer_file(src_file, dst_file, mode='auto'), (200000, 'copy'))
+        with open(src_file, "rb") as f1, open(dst_file, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        os.remove(dst_file)
+        with patch("copy_engine.reflink") as mock_reflink:
+            self.assertEqual(transfer_file(src_file, dst_file, mode='auto'), (200000, 'reflink'))
+            mock_reflink.assert_called_once()
+
+    def test_cp_tree_special_file(self):
+        os.mkfifo(os.path.join(self.src, "a", "pipe"))
+        dst = os.path.join(self.tmp, "dst")
+
+        with self.assertRaises(shutil.Error) as ctx:
+            CopyEngine(progress=False).copy_tree(self.src, dst)
+        self.assertIn("special file", str(ctx.exception))
+        self.assertFalse(os.path.exists(dst))
+
+    def test_cp_tree_error_removes_partial_copy(self):
+        dst = os.path.join(self.tmp, "dst")
+        with patch("copy_engine.transfer_file", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+            with self.assertRaises(shutil.Error):
+                CopyEngine(progress=False).copy_tree(self.src, dst)
+        self.assertFalse(os.path.exists(dst))
+
+
+class TrashTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.trash = Trash(os.path.join(self.tmp, ".trash"), max_age=100, max_size=1000, purge_interval=None)
+        self.dir = os.path.join(self.tmp, "dir")
+        os.makedirs(os.path.join(self.dir, "sub"))
+        with open(os.path.join(self.dir, "sub", "file"), "w") as f:
+            f.write("x" * 600)
+
+    def tearDown(self):
+        self.trash.manifest.close()
+        shutil.rmtree(self.tmp)
+
+    def test_rm_rename_and_restore(self):
+        entry = self.trash.put(self.dir)
+        self.assertFalse(os.path.exists(self.dir))
+        self.assertTrue(os.path.exists(os.path.join(entry["trash_path"], "sub", "file")))
+
+        self.trash.restore(entry["id"], entry["trash_path"], entry["path"])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "sub", "file")))
+        self.assertEqual(self.trash.entries(), [])
+
+    def test_rm_restore_FileExistsError(self):
+        entry = self.trash.put(self.dir)
+        os.mkdir(self.dir)
+
+        with self.assertRaises(FileExistsError):
+            self.trash.restore(entry["id"], entry["trash_path"], entry["path"])
+
+    def test_rm_purge_by_age(self):
+        entry = self.trash.put(self.dir)
+        self.assertEqual(self.trash.purge(now=entry["time"] + 50), 0)
+        self.assertEqual(self.trash.purge(now=entry["time"] + 500), 1)
+        self.assertFalse(os.path.exists(entry["trash_path"]))
+
+    def test_rm_purge_by_size(self):
+        first = self.trash.put(self.dir)
+        second_path = os.path.join(self.tmp, "second")
+        with open(second_path, "w") as f:
+            f.write("y" * 600)
+        second = self.trash.put(second_path)
+
+        self.assertEqual(self.trash.purge(now=second["time"]), 1)
+        self.assertFalse(os.path.exists(first["trash_path"]))
+        self.assertTrue(os.path.exists(second["trash_path"]))
+
+    def test_rm_purge_keeps_newest_and_referenced(self):
+        with open(os.path.join(self.dir, "sub", "big"), "w") as f:
+            f.write("z" * 2000)
+        first = self.trash.put(self.dir)
+        # Одна запись больше квоты - самая новая, её по квоте не удалить
+        self.assertEqual(self.trash.purge(now=first["time"]), 0)
+        self.assertTrue(os.path.exists(first["trash_path"]))
+
+        second_path = os.path.join(self.tmp, "second")
+        with open(second_path, "w") as f:
+            f.write("y" * 600)
+        self.trash.referenced.append(lambda: {first["trash_path"]})
+        second = self.trash.put(second_path)
+        self.assertEqual(self.trash.purge(now=second["time"]), 0)
+
+        self.trash.restore(first["id"], first["trash_path"], first["path"])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "sub", "big")))
+        # По возрасту ссылка не спасает
+        self.assertEqual(self.trash.purge(now=second["time"] + 500), 1)
+
+class MoveEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(os.path.join(self.src, "sub"))
+        for name in ("one", os.path.join("sub", "two")):
+            with open(os.path.join(self.src, name), "w") as f:
+                f.write(f"data of {name}")
+        self.dst = os.path.join(self.tmp, "dst")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_mv_same_device_rename(self):
+        stats = move_path(self.src, self.dst)
+
+        self.assertEqual(stats["strategy"], "rename")
+        self.assertFalse(os.path.exists(self.src))
+        self.assertTrue(os.path.exists(os.path.join(self.dst, "sub", "two")))
+
+    def test_mv_cross_device_stream(self):
+        with patch("move_engine.same_device", return_value=False):
+            stats = move_path(self.src, self.dst, progress=False)
+
+        self.assertEqual(stats["strategy"], "stream")
+        self.assertEqual(stats["files"], 2)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(checkpoint_path(self.dst)))
+        with open(os.path.join(self.dst, "sub", "two")) as f:
+            self.assertEqual(f.read(), "data of " + os.path.join("sub", "two"))
+
+    def test_mv_cross_device_resume(self):
+        src_file = os.path.join(self.src, "sub", "two")
+        os.makedirs(os.path.join(self.dst, "sub"))
+        with open(os.path.join(self.dst, "sub", "two.part"), "w") as f:
+            f.write("data of XXXXXXX")
+        save_checkpoint(self.dst, {"src": self.src, "dst": self.dst, "done_files": 0,
+                                   "current": src_file, "offset": 5})
+
+        with patch("move_engine.same_device", return_value=False):
+            stats = move_path(self.src, self.dst, progress=False)
+
+        self.assertTrue(stats["resumed"])
+        with open(os.path.join(self.dst, "sub", "two")) as f:
+            self.assertEqual(f.read(), "data of " + os.path.join("sub", "two"))
+        self.assertFalse(os.path.exists(os.path.join(self.dst, "sub", "two.part")))
+
+class LoggingTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "shell.log")
+        self.logger = logging.getLogger("test_shell_logger")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        stop_queue_logging()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        shutil.rmtree(self.tmp)
+
+    def test_log_json_lines(self):
+        handler = SizeRotatingFileHandler(self.path, encoding="utf-8")
+        handler.setFormatter(JsonLinesFormatter())
+        self.logger.addHandler(handler)
+        start_queue_logging(self.logger)
+
+        self.logger.info("cat a - SUCCESS", extra={"command": "cat a", "status": "SUCCESS", "duration_ms": 1.5, "bytes": 10})
+        stop_queue_logging()
+
+        with open(self.path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["command"], "cat a")
+        self.assertEqual(record["bytes"], 10)
+        self.assertEqual(record["duration_ms"], 1.5)
+
+    def test_log_rotation(self):
+        handler = SizeRotatingFileHandler(self.path, maxBytes=200, backupCount=2, encoding="utf-8")
+        self.logger.addHandler(handler)
+        start_queue_logging(self.logger)
+
+        for i in range(50):
+            self.logger.info(f"ls {i} - SUCCESS")
+        stop_queue_logging()
+
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        self.assertLessEqual(os.path.getsize(self.path), 200)
+
+    def test_log_config_rotates(self):
+        handler = LOGGING_CONFIG["handlers"]["file"]
+        self.assertGreater(handler["maxBytes"], 0)
+        self.assertGreater(handler["backupCount"], 0)
+
+class CommandRegistryTests(unittest.TestCase):
+    def test_registry_flag_clusters(self):
+        args, kwargs = get_command("ls").parse(["-laS", "dir"])
+
+        self.assertEqual(args, ["dir"])
+        self.assertEqual(kwargs, {"flag_l": True, "flag_a": True, "sort_by": "size"})
+
+    def test_registry_options(self):
+        self.assertEqual(get_command("cp").parse(["-rj4", "a", "b"]), (["a", "b"], {"flag_r": True, "jobs": 4}))
+        self.assertEqual(get_command("cp").parse(["--jobs", "2", "a", "b"])[1], {"jobs": 2})
+        self.assertEqual(get_command("cat").parse(["--tail=3", "f"])[1], {"line_range": (-3, None)})
+        self.assertEqual(get_command("rm").parse(["-rf", "--", "-dir"]), (["-dir"], {"flag_r": True, "flag_f": True}))
+
+    def test_registry_usage_errors(self):
+        with self.assertRaises(UsageError):
+            get_command("mv").parse(["only_one"])
+        with self.assertRaises(UsageError):
+            get_command("ls").parse(["-z"])
+        with self.assertRaises(UsageError):
+            get_command("cp").parse(["--jobs=0", "a", "b"])
+        with self.assertRaises(UsageError):
+            get_command("cat").parse(["--bytes=1-2", "--lines=1-2", "f"])
+
+    def test_registry_lazy_import(self):
+        command = Command("fake", "json:dumps")
+        self.assertIsNone(command._handler)
+
+        handler = command.resolve(None)
+        self.assertIs(command._handler, json.dumps)
+        self.assertEqual(handler(), "null")
+
+    def test_startup_skips_subsystems(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        code = ("import sys, main; main.System_Shell(); "
+                "print(' '.join(sorted(m for m in ('checksum', 'pipeline', 'jobs', 'metrics', 'operations', "
+                "'concurrent.futures') if m in sys.modules)))")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=tmp, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+
+class ShellTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.shell = System_Shell()
+
+    def tearDown(self):
+        self.shell.history.close()
+        stop_queue_logging()
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.tmp)
+
+
+class BatchModeTests(ShellTestCase):
+    def test_batch_exit_codes(self):
+        with open("file.txt", "w") as f:
+            f.write("text")
+
+        self.assertEqual(self.shell.run_script(["cat file.txt", "# comment", ""]), 0)
+        self.assertEqual(self.shell.run_script(["cat missing.txt", "cat file.txt"]), 1)
+        self.assertEqual(self.shell.run_script(["cat file.txt", "exit 3", "cat missing.txt"]), 3)
+
+    def test_batch_stop_on_error(self):
+        code = self.shell.run_script(["set -e", "cd missing", "cd .."])
+
+        self.assertEqual(code, 1)
+        self.assertEqual(self.shell.current_dir, self.tmp)
+
+    def test_batch_history_written_once(self):
+        with patch.object(self.shell.history, "sync", wraps=self.shell.history.sync) as mock_sync:
+            self.shell.run_script(["ls"] * 100)
+
+        mock_sync.assert_called_once()
+        self.assertEqual(len(self.shell.history.tail(200)), 100)
+
+    def test_batch_unknown_command(self):
+        self.assertFalse(self.shell.execute("bogus"))
+        self.assertFalse(self.shell.execute("mv only_one"))
+
+    def test_history_command_filters(self):
+        self.shell.execute("cat missing.txt")
+        self.shell.execute("ls")
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.shell.execute("history --failed")
+        self.assertIn("ERROR", out.getvalue())
+        self.assertIn("cat missing.txt", out.getvalue())
+        self.assertNotIn(" ls", out.getvalue())
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.shell.execute("history grep miss --since 1h")
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+        self.assertFalse(self.shell.execute("history grep"))
+
+class UndoRedoTests(ShellTestCase):
+    def test_journal_stacks_and_reload(self):
+        journal = OperationJournal("ops.jsonl")
+        for i in range(1, 5):
+            journal.record('rm', [str(i)], {'n': i})
+        self.assertEqual([op['id'] for op in journal.undo_targets(2)], [4, 3])
+        self.assertEqual([op['id'] for op in journal.undo_targets(to_id=2)], [4, 3, 2])
+        journal.mark_undone(4, {'n': 4, 'undone': True})
+        self.assertEqual([op['id'] for op in journal.redo_targets(5)], [4])
+
+        reloaded = OperationJournal("ops.jsonl")
+        self.assertEqual([op['id'] for op in reloaded.undo_targets(10)], [3, 2, 1])
+        self.assertEqual(reloaded.redo_targets()[0]['data'], {'n': 4, 'undone': True})
+        reloaded.record('rm', ['5'], {})
+        self.assertEqual(reloaded.redo_targets(), [])
+        with self.assertRaises(ValueError):
+            reloaded.undo_targets(to_id=4)
+
+    def test_cp_undo_redo(self):
+        with open("a.txt", "w") as f:
+            f.write("new")
+        with open("b.txt", "w") as f:
+            f.write("old")
+
+        self.shell.execute("cp a.txt b.txt")
+        self.assertTrue(self.shell.execute("undo"))
+        with open("b.txt") as f:
+            self.assertEqual(f.read(), "old")
+
+        self.assertTrue(self.shell.execute("redo"))
+        with open("b.txt") as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_cp_failure_restores_replaced(self):
+        with open("a.txt", "w") as f:
+            f.write("new")
+        with open("b.txt", "w") as f:
+            f.write("old")
+
+        def partial_copy(src, dst):
+            with open(dst, "w") as f:
+                f.write("ne")
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        with patch("main.shutil.copy2", side_effect=partial_copy):
+            self.assertFalse(self.shell.execute("cp a.txt b.txt"))
+        with open("b.txt") as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(self.shell.trash.entries(), [])
+
+    def test_cp_undo_keeps_copy_if_replaced_purged(self):
+        with open("a.txt", "w") as f:
+            f.write("new")
+        with open("b.txt", "w") as f:
+            f.write("old")
+        self.shell.execute("cp a.txt b.txt")
+        os.remove(self.shell.operations.undo_targets()[0]['data']['replaced_trash_path'])
+
+        self.assertFalse(self.shell.execute("undo"))
+        with open("b.txt") as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_rm_larger_than_trash_quota_can_be_undone(self):
+        self.shell.trash.max_size = 100
+        os.makedirs(os.path.join("big", "sub"))
+        with open(os.path.join("big", "sub", "data"), "w") as f:
+            f.write("x" * 1000)
+        open("small.txt", "w").close()
+        with patch("sys.stdout", new_callable=io.StringIO):
+            self.assertTrue(self.shell.execute("rm -r -f big"))
+            self.assertTrue(self.shell.execute("rm small.txt"))
+            self.shell.trash.purge()
+            self.assertTrue(self.shell.execute("undo 2"))
+        self.assertTrue(os.path.exists(os.path.join("big", "sub", "data")))
+        self.assertTrue(os.path.exists("small.txt"))
+
+    def test_undo_count_and_to(self):
+        for name in ("1", "2", "3"):
+            open(name, "w").close()
+        for name in ("1", "2", "3"):
+            self.shell.execute(f"rm {name}")
+        ids = [op['id'] for op in self.shell.operations.undo_targets(3)]
+
+        self.assertTrue(self.shell.execute("undo 2"))
+        self.assertFalse(os.path.exists("1"))
+        self.assertTrue(os.path.exists("2") and os.path.exists("3"))
+
+        self.assertTrue(self.shell.execute(f"undo --to={ids[-1]}"))
+        self.assertTrue(os.path.exists("1"))
+        self.assertTrue(self.shell.execute("redo 3"))
+        self.assertFalse(any(os.path.exists(name) for name in ("1", "2", "3")))
+        self.assertTrue(self.shell.execute("undo 0"))
+        self.assertFalse(self.shell.execute("undo --to=999"))
+
+    def test_batch_undo_is_atomic(self):
+        for name in ("1", "2", "3"):
+            open(name, "w").close()
+        self.assertTrue(self.shell.execute("rm 1 2 3"))
+        open("1", "w").close()
+
+        self.assertFalse(self.shell.execute("undo"))
+        self.assertFalse(os.path.exists("2") or os.path.exists("3"))
+        self.assertEqual(len(self.shell.operations.undo_targets(10)), 1)
+        reloaded = OperationJournal(self.shell.operations.path)
+        self.assertEqual(reloaded.undo_targets()[0]['data'], self.shell.operations.undo_targets()[0]['data'])
+
+        os.remove("1")
+        self.assertTrue(self.shell.execute("undo"))
+        self.assertTrue(all(os.path.exists(name) for name in ("1", "2", "3")))
+        self.assertTrue(self.shell.execute("redo"))
+        self.assertFalse(any(os.path.exists(name) for name in ("1", "2", "3")))
+
+    def test_glob_batch_is_one_operation(self):
+        os.makedirs(os.path.join("logs", "sub"))
+        os.mkdir("out")
+        for name in ("a.log", "b.log", os.path.join("sub", "c.tmp"), os.path.join("sub", "d.tmp")):
+            open(os.path.join("logs", name), "w").close()
+        self.assertEqual(expand_globs(["logs/**/*.tmp", "x*"], self.shell.current_dir),
+                         ["logs/sub/c.tmp", "logs/sub/d.tmp", "x*"])
+
+        self.assertTrue(self.shell.execute("cp logs/*.log out"))
+        self.assertEqual(sorted(os.listdir("out")), ["a.log", "b.log"])
+        self.assertTrue(self.shell.execute("rm logs/**/*.tmp"))
+        self.assertEqual(os.listdir(os.path.join("logs", "sub")), [])
+        self.assertEqual(len(self.shell.operations.undo_targets(10)), 2)
+
+        self.assertTrue(self.shell.execute("undo 2"))
+        self.assertEqual(sorted(os.listdir(os.path.join("logs", "sub"))), ["c.tmp", "d.tmp"])
+        self.assertEqual(os.listdir("out"), [])
+
+    def test_batch_partial_failure(self):
+        open("a", "w").close()
+        self.assertFalse(self.shell.execute("cp a a nowhere"))
+        self.assertFalse(self.shell.execute("rm a missing"))
+        self.assertFalse(os.path.exists("a"))
+        self.assertTrue(self.shell.execute("undo"))
+        self.assertTrue(os.path.exists("a"))
+
+    def test_ls_recursive_headers_use_path(self):
+        os.makedirs(os.path.join("deep", "b"))
+        open(os.path.join("deep", "b", "c.txt"), "w").close()
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("ls -R deep"))
+        self.assertEqual(out.getvalue().splitlines(), ["deep:", "b", "", os.path.join("deep", "b") + ":", "c.txt"])
+
+    def test_ls_after_rm_is_not_stale(self):
+        open("file.txt", "w").close()
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.shell.execute("ls")
+            self.assertIn("file.txt", out.getvalue())
+            out.truncate(0)
+            self.shell.execute("rm -f file.txt")
+            self.shell.execute("ls")
+            self.assertNotIn("file.txt", out.getvalue())
+
+
+class SearchTests(ShellTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join("src", "sub"))
+        with open(os.path.join("src", "a.txt"), "w") as f:
+            f.write("hello\nworld\nsay hello hello\n")
+        with open(os.path.join("src", "sub", "b.py"), "w") as f:
+            f.write("x" * 100)
+
+    def test_find_filters(self):
+        root = os.path.abspath("src")
+        self.assertEqual(sorted(iter_find(root, "src")), ["src/a.txt", "src/sub", "src/sub/b.py"])
+        self.assertEqual(list(iter_find(root, "src", name="*.py")), ["src/sub/b.py"])
+        self.assertEqual(list(iter_find(root, "src", file_type="d")), ["src/sub"])
+        self.assertEqual(list(iter_find(root, "src", file_type="f", size=("+", 50))), ["src/sub/b.py"])
+        self.assertEqual(list(iter_find(root, "src", file_type="f", mtime=('+', 1))), [])
+
+    def test_find_quoted_name(self):
+        os.mkdir("top.py")
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("find src --name '*.py'"))
+            self.assertTrue(self.shell.execute('find src --name="*.txt"'))
+        self.assertEqual(out.getvalue().splitlines(), ["src/sub/b.py", "src/a.txt"])
+
+    def test_scan_file_line_numbers(self):
+        binary, matches = scan_file(os.path.join("src", "a.txt"), re.compile(b"hello"), line_numbers=True)
+        self.assertFalse(binary)
+        self.assertEqual(matches, [(1, b"hello"), (3, b"say hello hello")])
+
+    def test_grep_command(self):
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("grep -rn hello src"))
+            self.assertFalse(self.shell.execute("grep hello src"))
+            self.assertFalse(self.shell.execute("grep missing src/a.txt"))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[:2], ["src/a.txt:1:hello", "src/a.txt:3:say hello hello"])
+        self.assertIn("is a directory", lines[2])
+
+    def test_grep_anchored_patterns(self):
+        with open("g.txt", "w") as f:
+            f.write("start\nERROR one\nan ERROR\nERROR\n")
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("grep -n ^ERROR g.txt"))
+            self.assertTrue(self.shell.execute("grep -n ERROR$ g.txt"))
+        self.assertEqual(out.getvalue().splitlines(), ["g.txt:2:ERROR one", "g.txt:4:ERROR",
+                                                       "g.txt:3:an ERROR", "g.txt:4:ERROR"])
+
+    def test_grep_match_stays_within_line(self):
+        with open("fb.txt", "w") as f:
+            f.write("xfoo\nbar foo bar\nfoo\nbar\n")
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute(r"grep -n foo\sbar fb.txt"))
+        self.assertEqual(out.getvalue().splitlines(), ["fb.txt:2:bar foo bar"])
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute(r"cat fb.txt | grep foo\sbar"))
+        self.assertEqual(out.getvalue().splitlines(), ["bar foo bar"])
+
+    def test_du_command(self):
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("du -bs src"))
+            self.assertTrue(self.shell.execute("du --no-cache -d 0 src"))
+        self.assertEqual(out.getvalue().splitlines()[0], "128\tsrc")
+        self.assertTrue(os.path.exists(".du_cache.json"))
+        self.assertEqual(get_command('du').parse(["--no-cache"]), ([], {'no_cache': True}))
+
+    def test_find_size_option(self):
+        self.assertEqual(get_command('find').parse(["src", "--size", "-1k", "--type=f"]),
+                         (["src"], {'size': ('-', 1024), 'file_type': 'f'}))
+        with self.assertRaises(UsageError):
+            get_command('find').parse(["--type=x"])
+
+
+class MetricsTests(ShellTestCase):
+    def test_registry_percentiles_and_prometheus(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 0.99), 99)
+
+        registry = MetricsRegistry(samples=3)
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            registry.record('cp', seconds, nbytes=10, files=2)
+        registry.record('cp', 0.5, status=False)
+        data = registry.snapshot()['commands']['cp']
+        self.assertEqual((data['count'], data['errors'], data['bytes'], data['files']), (5, 1, 40, 8))
+        self.assertEqual(data['p50'], 0.4)
+        self.assertIn('shell_command_errors_total{command="cp"} 1', registry.to_prometheus())
+
+    def test_stats_command_export(self):
+        open("a", "w").close()
+        self.shell.execute("cp a b")
+        self.shell.execute("cat missing")
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("stats --export=metrics.json --reset"))
+        self.assertIn("cp", out.getvalue())
+
+        with open("metrics.json") as f:
+            commands = json.load(f)['commands']
+        self.assertEqual(commands['cp']['files'], 1)
+        self.assertEqual(commands['cat']['errors'], 1)
+        self.assertEqual(list(self.shell.metrics.snapshot()['commands']), ['stats'])
+
+
+
+class PipelineTests(ShellTestCase):
+    def test_pipeline_split(self):
+        self.assertEqual(split_pipeline("cat a.log | grep ERROR | head 20 > out.txt"),
+                         (["cat a.log", "grep ERROR", "head 20"], ("out.txt", False)))
+        self.assertEqual(split_pipeline("ls >>list.txt"), (["ls"], ("list.txt", True)))
+        with self.assertRaises(UsageError):
+            split_pipeline("ls | | head")
+        with self.assertRaises(UsageError):
+            split_pipeline("ls > a.txt | head")
+
+    def test_quoted_operators(self):
+        self.assertEqual(split_pipeline("grep 'a|b' f.txt | head 1 > \"out file.txt\""),
+                         (["grep 'a|b' f.txt", "head 1"], ("out file.txt", False)))
+        with self.assertRaises(UsageError):
+            split_pipeline("grep 'a|b")
+        with open("log.txt", "w") as f:
+            f.write("ERROR one\nok\nWARN two\nx>y\n")
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("grep 'ERROR|WARN' log.txt"))
+            self.assertTrue(self.shell.execute('grep "x>y" log.txt'))
+            self.assertTrue(self.shell.execute("cat log.txt | grep 'ERROR|WARN' > 'errors out.txt'"))
+            self.assertFalse(self.shell.execute("cat 'log.txt"))
+        self.assertEqual(out.getvalue().splitlines()[:3], ["log.txt:ERROR one", "log.txt:WARN two", "log.txt:x>y"])
+        self.assertIn("unterminated quote", out.getvalue())
+        self.assertFalse(os.path.exists("y"))
+        with open("errors out.txt") as f:
+            self.assertEqual(f.read(), "ERROR one\nWARN two\n")
+
+    def test_pipeline_head_stops_upstream(self):
+        with open("big.log", "w") as f:
+            for i in range(100000):
+                f.write(f"line {i} {'ERROR' if i % 5 == 0 else 'ok'}\n")
+
+        self.assertTrue(self.shell.execute("cat big.log | grep ERROR | head 3 > out.txt"))
+
+        with open("out.txt") as f:
+            self.assertEqual(f.read(), "line 0 ERROR\nline 5 ERROR\nline 10 ERROR\n")
+        # cat прочитал только начало файла
+        self.assertLess(self.shell.metrics.snapshot()["commands"]["cat"]["bytes"], os.path.getsize("big.log"))
+
+    def test_pipeline_redirect_append(self):
+        with open("a.txt", "w") as f:
+            f.write("one\ntwo\n")
+
+        self.shell.execute("ls > list.txt")
+        self.shell.execute("cat a.txt | head 1 >> list.txt")
+        with open("list.txt") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[:2], ["a.txt", "list.txt"])
+        self.assertEqual(lines[-1], "one")
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertFalse(self.shell.execute("ls | grep missing"))
+            self.assertFalse(self.shell.execute("ls |"))
+            self.assertFalse(self.shell.execute("head 2"))
+        self.assertIn("syntax error", out.getvalue())
+
+    def test_head_file_only(self):
+        with open("a.txt", "w") as f:
+            f.write("".join(f"line {i}\n" for i in range(20)))
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("head a.txt"))
+        self.assertEqual(len(out.getvalue().splitlines()), 10)
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("head 2 a.txt"))
+            self.assertFalse(self.shell.execute("head a.txt a.txt"))
+        self.assertEqual(out.getvalue().splitlines()[:2], ["line 0", "line 1"])
+        self.assertIn("invalid count", out.getvalue())
+
+
+class JobsTests(ShellTestCase):
+    def make_tree(self, files=50):
+        os.mkdir("src")
+        for i in range(files):
+            with open(os.path.join("src", f"f{i}.txt"), "w") as f:
+                f.write("x" * 1000)
+
+    def test_job_copy_and_wait(self):
+        self.make_tree()
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("cp -r src dst &"))
+            self.assertTrue(self.shell.execute("ls | head 1 &"))
+            self.assertTrue(self.shell.execute("wait"))
+        self.assertEqual(len(os.listdir("dst")), 50)
+        self.assertIn("[1] Done", out.getvalue())
+        self.assertIn("dst", out.getvalue())
+        self.assertEqual(self.shell.jobs.list(), [])
+        self.assertIn("cp", [entry['command'] for entry in self.shell.history.tail(5)])
+
+    def test_job_shares_caches_with_shell(self):
+        self.make_tree(files=3)
+        with patch("sys.stdout", new_callable=io.StringIO):
+            self.assertTrue(self.shell.execute("du -s src &"))
+            self.assertTrue(self.shell.execute("cp -r --verify src dst &"))
+            self.assertTrue(self.shell.execute("wait"))
+            # Кэши, заполненные задачами, - это кэши shell: повторный du их не перечитывает
+            self.assertIn(os.path.join(self.tmp, "src"), self.shell.size_cache.dirs)
+            self.assertTrue(self.shell.hash_cache.files)
+            self.assertTrue(self.shell.execute("cp src/f0.txt f0.txt &"))
+            self.assertTrue(self.shell.execute("wait"))
+        self.assertEqual(self.shell.operations.undo_targets()[0]['command'], 'cp')
+
+    def test_job_cancel_rolls_back_copy(self):
+        self.make_tree()
+        job = Job(1, "cp -r src dst", 10)
+        job.cancel()
+        with patch("sys.stdout", new_callable=io.StringIO) as out, job_context(job):
+            self.assertFalse(self.shell.execute("cp -r src dst"))
+        self.assertIn("cancelled", out.getvalue())
+        self.assertFalse(os.path.exists("dst"))
+        self.assertEqual(len(os.listdir("src")), 50)
+
+    def test_job_unknown(self):
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertFalse(self.shell.execute("fg"))
+            self.assertFalse(self.shell.execute("kill %3"))
+            self.assertFalse(self.shell.execute("&"))
+        self.assertIn("no such job", out.getvalue())
+
+
+class VerifyTests(ShellTestCase):
+    def make_tree(self):
+        os.makedirs(os.path.join("src", "sub"))
+        for name in ("a.txt", os.path.join("sub", "b.txt")):
+            with open(os.path.join("src", name), "wb") as f:
+                f.write(os.urandom(200000))
+
+    def test_hash_cache_reuses_digest(self):
+        with open("a.bin", "wb") as f:
+            f.write(b"data" * 1000)
+        cache = HashCache("cache.json")
+        digest = hash_file("a.bin", cache)
+        with patch("checksum.hashlib.new") as new:
+            self.assertEqual(hash_file("a.bin", cache), digest)
+            new.assert_not_called()
+
+        cache.save()
+        cache = HashCache("cache.json")
+        os.utime("a.bin", ns=(0, 0))
+        self.assertIsNone(cache.get(os.stat("a.bin")))
+
+    def test_cp_verify_and_verify_command(self):
+        self.make_tree()
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("cp -r --verify src dst"))
+            self.assertEqual(self.shell.history.tail(1)[0]['other_data']['verified'], 'sha256')
+            # Обе стороны уже в кэше - повторная проверка не читает файлы
+            with patch("checksum.hashlib.new") as new:
+                self.assertTrue(self.shell.execute("verify src dst"))
+                new.assert_not_called()
+            with open(os.path.join("dst", "sub", "b.txt"), "ab") as f:
+                f.write(b"x")
+            self.assertFalse(self.shell.execute("verify src dst"))
+        self.assertIn("differs: sub/b.txt", out.getvalue())
+        self.assertTrue(os.path.exists(".hash_cache.json"))
+
+    def test_cp_verify_reads_each_byte_once(self):
+        self.make_tree()
+        real_new = hashlib.new
+        with patch("sys.stdout", new_callable=io.StringIO), \
+                patch("checksum.hashlib.new", side_effect=real_new) as new:
+            self.assertTrue(self.shell.execute("cp -r --verify src dst"))
+        # Одна сумма на файл: копия хэшируется по ходу записи и заново не читается
+        self.assertEqual(new.call_count, 2)
+
+    def test_verify_reports_unreadable_file(self):
+        self.make_tree()
+        shutil.copytree("src", "dst")
+        real_hash = checksum.hash_file
+
+        def denied(path, cache, refresh=False):
+            if path.endswith("a.txt"):
+                raise PermissionError(13, "Permission denied", path)
+            return real_hash(path, cache, refresh)
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out, patch("checksum.hash_file", side_effect=denied):
+            self.assertFalse(self.shell.execute("verify src dst"))
+        # Ошибка одного файла не прерывает проверку остальных
+        self.assertIn("error: a.txt: Permission denied", out.getvalue())
+        self.assertNotIn("sub/b.txt", out.getvalue())
+        self.assertIn("1 of 2 files differ", out.getvalue())
+
+    def test_cp_verify_mismatch_rolls_back(self):
+        self.make_tree()
+        os.mkdir("dst")
+        with open(os.path.join("dst", "old.txt"), "w") as f:
+            f.write("old")
+        with patch("sys.stdout", new_callable=io.StringIO) as out, \
+                patch("copy_engine.verify_copy", side_effect=ChecksumMismatch("checksum mismatch: 'a' -> 'b'")):
+            self.assertFalse(self.shell.execute("cp -r --verify src dst"))
+        self.assertIn("checksum mismatch", out.getvalue())
+        self.assertEqual(os.listdir("dst"), ["old.txt"])
+        self.assertEqual(self.shell.operations.undo_targets(), [])
+
+    def test_mv_verify_across_devices(self):
+        self.make_tree()
+        real_hash = move_engine.hash_file
+        calls = []
+
+        def corrupt_second(path, cache, refresh=False):
+            calls.append(path)
+            return "bad" if len(calls) == 2 else real_hash(path, cache, refresh)
+
+        with patch("sys.stdout", new_callable=io.StringIO), patch("move_engine.same_device", return_value=False):
+            with patch("move_engine.hash_file", side_effect=corrupt_second):
+                self.assertFalse(self.shell.execute("mv --verify src dst"))
+            # Откат вернул уже перенесённый файл: дерево на месте, копии и контрольной точки нет
+            self.assertEqual(sorted(os.listdir("src")), ["a.txt", "sub"])
+            self.assertFalse(os.path.exists("dst"))
+            self.assertFalse(os.path.exists(move_engine.checkpoint_path(os.path.abspath("dst"))))
+
+            self.assertTrue(self.shell.execute("mv --verify src dst"))
+        self.assertFalse(os.path.exists("src"))
+        self.assertEqual(self.shell.history.tail(1)[0]['other_data']['verified'], 'sha256')
+
+
+class SyncTests(ShellTestCase):
+    def make_tree(self):
+        os.makedirs(os.path.join("src", "sub"))
+        for name in ("a.txt", "b.txt", os.path.join("sub", "c.txt")):
+            with open(os.path.join("src", name), "w") as f:
+                f.write(name)
+
+    def test_sync_copies_only_changes(self):
+        self.make_tree()
+        with patch("sys.stdout", new_callable=io.StringIO):
+            self.assertTrue(self.shell.execute("sync src dst"))
+        with open(os.path.join("src", "sub", "c.txt"), "w") as f:
+            f.write("changed content")
+        with open(os.path.join("dst", "extra.txt"), "w") as f:
+            f.write("extra")
+
+        engine = SyncEngine()
+        plan = engine.plan("src", "dst")
+        self.assertTrue(plan['manifest'])
+        self.assertEqual(plan['copies'], [(os.path.join("sub", "c.txt"), 15, True)])
+        self.assertEqual(plan['deletes'], [])
+        self.assertEqual(plan['unchanged'], 2)
+        # Новый файл в dst найден перечитыванием корня, хотя остальное состояние взято из манифеста
+        self.assertIn("extra.txt", plan['state']['files'])
+
+        with patch("sys.stdout", new_callable=io.StringIO):
+            self.assertTrue(self.shell.execute("sync src dst"))
+        with open(os.path.join("dst", "sub", "c.txt")) as f:
+            self.assertEqual(f.read(), "changed content")
+        self.assertTrue(os.path.exists(os.path.join("dst", "extra.txt")))
+
+    def test_sync_delete_dry_run_and_undo(self):
+        self.make_tree()
+        os.makedirs(os.path.join("dst", "old"))
+        with open(os.path.join("dst", "old", "x.txt"), "w") as f:
+            f.write("x")
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertTrue(self.shell.execute("sync -n --delete src dst"))
+            self.assertEqual(os.listdir("dst"), ["old"])
+            self.assertTrue(self.shell.execute("sync --delete src dst"))
+            self.assertEqual(sorted(os.listdir("dst")), [".sync_manifest.json", "a.txt", "b.txt", "sub"])
+            self.assertTrue(self.shell.execute("undo"))
+        self.assertIn(f"- old{os.sep}", out.getvalue())
+        self.assertIn("+ a.txt", out.getvalue())
+        self.assertEqual(sorted(os.listdir("dst")), [".sync_manifest.json", "old"])
+
+    def test_cp_update(self):
+        self.make_tree()
+        os.mkdir("backup")
+        with patch("sys.stdout", new_callable=io.StringIO):
+            self.assertTrue(self.shell.execute("cp -r -u src backup"))
+            with open(os.path.join("src", "b.txt"), "w") as f:
+                f.write("new b")
+            with patch("sync_engine.transfer_file", wraps=transfer_file) as transfer:
+                self.assertTrue(self.shell.execute("cp -r --update src backup"))
+        self.assertEqual(transfer.call_count, 1)
+        with open(os.path.join("backup", "src", "b.txt")) as f:
+            self.assertEqual(f.read(), "new b")
+
+
+class CompletionTests(ShellTestCase):
+    def test_prefix_index_refresh(self):
+        os.mkdir("wide")
+        for i in range(2000):
+            open(os.path.join("wide", f"file_{i:04d}"), "w").close()
+        os.mkdir(os.path.join("wide", "file_dir"))
+        index = CompletionIndex()
+
+        self.assertEqual(index.complete_path("wide/file_001", self.tmp)[:2],
+                         [os.path.join("wide", "file_0010"), os.path.join("wide", "file_0011")])
+        self.assertEqual(len(index.complete_path("wide/file_1", self.tmp)), 1000)
+        self.assertEqual(index.complete_path("wide/file_d", self.tmp), [os.path.join("wide", "file_dir") + os.sep])
+        self.assertEqual((index.hits, index.misses), (2, 1))
+
+        open(os.path.join("wide", "file_new"), "w").close()
+        os.utime("wide", ns=(0, 0))
+        self.assertEqual(index.complete_path("wide/file_n", self.tmp), [os.path.join("wide", "file_new")])
+        self.assertEqual(index.misses, 2)
+
+    def test_completer_candidates(self):
+        open("notes.txt", "w").close()
+        open(".hidden", "w").close()
+        completer = Completer(self.shell)
+        self.assertEqual(completer.candidates("hi", 0, "hi"), ["history "])
+        self.assertEqual(completer.candidates("ls | he", 5, "he"), ["head "])
+        self.assertIn("--verify ", completer.candidates("cp --ve", 3, "--ve"))
+        self.assertEqual(completer.candidates("cat no", 4, "no"), ["notes.txt"])
+        self.assertEqual(completer.candidates("cat .hid", 4, ".hid"), [".hidden"])
+        self.assertNotIn(".hidden", completer.candidates("cat ", 4, ""))
+
+
+
+class ServerTests(ShellTestCase):
+    async def _command(self, reader, writer, line):
+        writer.write(line.encode() + b"\n")
+        await writer.drain()
+        return (await reader.readuntil(b"$ ")).decode()
+
+    def test_sessions_are_independent(self):
+        os.mkdir("sub")
+        open(os.path.join("sub", "inner.txt"), "w").close()
+        open("top.txt", "w").close()
+        server = Server(self.shell, workers=4, sessions_dir=".sessions")
+        stdout = sys.stdout
+        address = "unix:" + os.path.join(self.tmp, "shell.sock")
+
+        async def scenario():
+            await server.start(address)
+            try:
+                first = await asyncio.open_unix_connection(address[len("unix:"):])
+                second = await asyncio.open_unix_connection(address[len("unix:"):])
+                for reader, _ in (first, second):
+                    await reader.readuntil(b"$ ")
+                await self._command(*first, "session work")
+                await self._command(*first, "cd sub")
+                outputs = await asyncio.gather(self._command(*first, "ls"), self._command(*second, "ls"))
+                third_reader, third_writer = await asyncio.open_unix_connection(address[len("unix:"):])
+                await third_reader.readuntil(b"$ ")
+                third_writer.write(b"session work\n")
+                busy = (await third_reader.read()).decode()
+                third_writer.close()
+                for _, writer in (first, second):
+                    writer.write(b"exit\n")
+                    await writer.drain()
+                    writer.close()
+                return outputs, busy
+            finally:
+                await server.close()
+
+        (first_ls, second_ls), second_reply = asyncio.run(scenario())
+        self.assertIn("inner.txt", first_ls)
+        self.assertNotIn("top.txt", first_ls)
+        self.assertIn("top.txt", second_ls)
+        self.assertTrue(first_ls.endswith(os.path.join(self.tmp, "sub") + " $ "))
+        self.assertIn("'work' is already in use", second_reply)
+        self.assertEqual(os.getcwd(), self.tmp)
+        self.assertEqual(self.shell.current_dir, self.tmp)
+        self.assertTrue(os.path.exists(os.path.join(".sessions", "work", ".history.db")))
+        self.assertIs(sys.stdout, stdout)
+
+    def test_unix_socket_is_private(self):
+        server = Server(self.shell, workers=2, sessions_dir=".sessions")
+        path = os.path.join(self.tmp, "shell.sock")
+
+        async def scenario():
+            await server.start("unix:" + path)
+            try:
+                return os.stat(path).st_mode & 0o777
+            finally:
+                await server.close()
+
+        self.assertEqual(asyncio.run(scenario()), 0o600)
+        self.assertFalse(os.path.exists(path))
+
+    def test_tcp_requires_token(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(Server(self.shell, workers=2).start("127.0.0.1:0"))
+        token = server_module.load_token(".server_token")
+        self.assertEqual(os.stat(".server_token").st_mode & 0o777, 0o600)
+        self.assertEqual(server_module.load_token(".server_token"), token)
+        server = Server(self.shell, workers=2, sessions_dir=".sessions", token=token)
+
+        async def connect(address, first_line):
+            host, port = address.rsplit(":", 1)
+            reader, writer = await asyncio.open_connection(host, int(port))
+            await reader.readline()
+            writer.write(first_line.encode() + b"\n")
+            await writer.drain()
+            return reader, writer
+
+        async def scenario():
+            address = await server.start("127.0.0.1:0")
+            try:
+                reader, writer = await connect(address, "auth wrong session work")
+                denied = (await reader.read()).decode()
+                writer.close()
+                reader, writer = await connect(address, f"auth {token} session work")
+                await reader.readuntil(b"$ ")
+                named = "work" in server.sessions
+                writer.write(b"exit\n")
+                await writer.drain()
+                await reader.read()
+                writer.close()
+                return denied, named
+            finally:
+                await server.close()
+
+        denied, named = asyncio.run(scenario())
+        self.assertIn("authentication failed", denied)
+        self.assertNotIn(self.tmp, denied)
+        self.assertTrue(named)
+
+    def test_pending_connections_are_limited(self):
+        server = Server(self.shell, workers=2, sessions_dir=".sessions", max_sessions=1, token="secret",
+                        auth_timeout=0.3)
+
+        async def scenario():
+            address = await server.start("127.0.0.1:0")
+            host, port = address.rsplit(":", 1)
+            try:
+                idle_reader, idle_writer = await asyncio.open_connection(host, int(port))
+                await idle_reader.readline()
+                reader, writer = await asyncio.open_connection(host, int(port))
+                busy = (await reader.read()).decode()
+                writer.close()
+                timed_out = (await asyncio.wait_for(idle_reader.read(), 5)).decode()
+                idle_writer.close()
+                return busy, timed_out, server.pending
+            finally:
+                await server.close()
+
+        busy, timed_out, pending = asyncio.run(scenario())
+        self.assertIn("too many sessions", busy)
+        self.assertIn("authentication timed out", timed_out)
+        self.assertEqual(pending, 0)
+
+
+class ArchiveTests(ShellTestCase):
+    def test_parallel_gzip_members(self):
+        data = os.urandom(50000) + b"x" * 100000
+        out = io.BytesIO()
+        writer = ParallelGzipWriter(out, level=6, jobs=3, block_size=4096)
+        for i in range(0, len(data), 1000):
+            writer.write(data[i:i + 1000])
+        writer.close()
+
+        self.assertEqual(gzip.decompress(out.getvalue()), data)
+        self.assertGreater(out.getvalue().count(b"\x1f\x8b\x08"), len(data) // 4096)
+
+    def test_pack_unpack_undo(self):
+        os.makedirs(os.path.join("src", "sub"))
+        with open(os.path.join("src", "sub", "a.txt"), "w") as f:
+            f.write("content")
+        for archive in ("src.tar.gz", "src.zip"):
+            self.assertTrue(self.shell.execute(f"pack {archive} src"))
+        self.assertTrue(self.shell.execute("unpack src.tar.gz out"))
+        with open(os.path.join("out", "src", "sub", "a.txt")) as f:
+            self.assertEqual(f.read(), "content")
+
+        with open(os.path.join("src", "sub", "a.txt"), "w") as f:
+            f.write("changed")
+        open(os.path.join("src", "extra.txt"), "w").close()
+        self.assertTrue(self.shell.execute("unpack src.zip"))
+        with open(os.path.join("src", "sub", "a.txt")) as f:
+            self.assertEqual(f.read(), "content")
+
+        self.shell.execute("undo 2")
+        self.assertFalse(os.path.exists("out"))
+        self.assertTrue(os.path.exists(os.path.join("src", "extra.txt")))
+        with open(os.path.join("src", "sub", "a.txt")) as f:
+            self.assertEqual(f.read(), "changed")
+
+    def test_unpack_unsafe_member_rolls_back(self):
+        with tarfile.open("evil.tar", "w") as archive:
+            for name in ("ok.txt", "../evil.txt"):
+                info = tarfile.TarInfo(name)
+                info.size = 2
+                archive.addfile(info, io.BytesIO(b"hi"))
+
+        self.assertFalse(self.shell.execute("unpack evil.tar dest"))
+        self.assertFalse(os.path.exists("dest"))
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.tmp), "evil.txt")))
+
+    def test_unpack_zip_through_symlinked_dir(self):
+        os.makedirs("dest")
+        os.mkdir("outside")
+        os.symlink(os.path.join("..", "outside"), os.path.join("dest", "link"))
+        with zipfile.ZipFile("evil.zip", "w") as archive:
+            archive.writestr("ok.txt", "ok")
+            archive.writestr("link/pwned.txt", "pwned")
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertFalse(self.shell.execute("unpack evil.zip dest"))
+        self.assertIn("unsafe path in archive", out.getvalue())
+        self.assertEqual(os.listdir("outside"), [])
+        self.assertEqual(sorted(os.listdir("dest")), ["link"])
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
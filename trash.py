@@ -0,0 +1,252 @@
+import contextlib
+import errno
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from journal import Journal
+
+
+def mount_point(path):
+    '''Функция которая находит точку монтирования файловой системы, на которой лежит path.'''
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def tree_size(path):
+    '''Функция которая считает суммарный размер файла или дерева директорий (без перехода по ссылкам).'''
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    total = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class Trash:
+    '''
+        Класс корзины для rm.
+
+        Удаляемый файл или директория переименовывается (os.rename) в корзину на той же
+        файловой системе, поэтому удаление выполняется за O(1) независимо от размера дерева
+        и может быть отменено. Содержимое корзины описывается журналом manifest.jsonl,
+        а фоновый поток очищает корзину по возрасту записей и квоте на размер.
+    '''
+    def __init__(self, trash_dir, max_age=7 * 24 * 3600, max_size=1024 ** 3, purge_interval=60.0):
+        '''
+            Функция инициализатор.
+
+            Принимает:
+                1. trash_dir (str) - Основная директория корзины
+                2. max_age (float) - Максимальный возраст записи в секундах
+                3. max_size (int) - Квота на суммарный размер корзины в байтах
+                4. purge_interval (float) - Период фоновой очистки в секундах. None - без фонового потока.
+        '''
+        self.trash_dir = os.path.abspath(trash_dir)
+        self.max_age = max_age
+        self.max_size = max_size
+        self.purge_interval = purge_interval
+        self.manifest = Journal(os.path.join(self.trash_dir, 'manifest.jsonl'))
+        self._lock = threading.RLock()
+        self._sizes = {}
+        self._loaded = False
+        self._purger = None
+        self._wakeup = threading.Event()
+        # Функции, возвращающие пути в корзине, на которые ссылаются стеки undo журналов операций:
+        # такие записи не удаляются по квоте (OperationJournal.trash_paths)
+        self.referenced = []
+
+    def _load(self):
+        if not self._loaded:
+            os.makedirs(self.trash_dir, exist_ok=True)
+            self.manifest.load()
+            self._loaded = True
+
+    def _trash_dir_for(self, path):
+        '''
+            Функция которая выбирает директорию корзины на той же файловой системе, что и path.
+            Если основная корзина на другом устройстве, используется <точка монтирования>/.trash-<uid>.
+
+            Вывод: путь к директории корзины (str).
+        '''
+        parent = os.path.dirname(os.path.abspath(path))
+        device = os.stat(parent).st_dev
+        if os.stat(self.trash_dir).st_dev == device:
+            return self.trash_dir
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        mount_trash = os.path.join(mount_point(parent), f".trash-{uid}")
+        try:
+            os.makedirs(mount_trash, exist_ok=True)
+            return mount_trash
+        except OSError:
+            # Нет прав на корень файловой системы - остаётся медленное перемещение в основную корзину
+            return self.trash_dir
+
+    def put(self, path, link=False):
+        '''
+            Функция которая перемещает файл или директорию в корзину.
+
+            Принимает:
+                1. path (str) - Абсолютный путь
+                2. link (bool) - Не перемещать файл, а создать на него жёсткую ссылку в корзине.
+                   Используется перед атомарной заменой файла через os.replace.
+
+            Вывод: запись манифеста (dict) с полями id, path, trash_path, time.
+        '''
+        with self._lock:
+            self._load()
+            name = os.path.basename(os.path.normpath(path))
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            trash_path = os.path.join(self._trash_dir_for(path), f"{name}_{timestamp}_{time.time_ns() % 10 ** 9}")
+            # Пакетное удаление может положить в корзину несколько одноимённых файлов за одну наносекунду
+            base, suffix = trash_path, 0
+            while os.path.lexists(trash_path):
+                suffix += 1
+                trash_path = f"{base}~{suffix}"
+            try:
+                if link:
+                    os.link(path, trash_path, follow_symlinks=False)
+                else:
+                    os.rename(path, trash_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                if link:
+                    shutil.copy2(path, trash_path, follow_symlinks=False)
+                else:
+                    shutil.move(path, trash_path)
+            entry = self.manifest.append({'path': path, 'trash_path': trash_path, 'time': time.time()})
+        self._start_purger()
+        return entry
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Функция-контекстный менеджер: записи манифеста внутри блока сбрасываются на диск один раз в конце.'''
+        with self._lock:
+            self._load()
+            self.manifest.begin_batch()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.manifest.end_batch()
+
+    def restore(self, entry_id, trash_path, path):
+        '''
+            Функция которая возвращает элемент из корзины на исходное место.
+
+            Принимает:
+                1. entry_id (int) - id записи манифеста (может быть None для старых записей истории)
+                2. trash_path (str) - Путь в корзине
+                3. path (str) - Исходный путь
+
+            Вывод: None. Если элемент уже удалён из корзины или исходный путь занят - FileExistsError / FileNotFoundError.
+        '''
+        with self._lock:
+            if not trash_path or not os.path.lexists(trash_path):
+                raise FileNotFoundError(f"'{path}' is no longer in trash")
+            if os.path.lexists(path):
+                raise FileExistsError(f"'{path}' already exists")
+            try:
+                os.rename(trash_path, path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(trash_path, path)
+            if entry_id is not None:
+                self._load()
+                self.manifest.remove(entry_id)
+                self._sizes.pop(entry_id, None)
+
+    def entries(self):
+        '''Функция которая возвращает список записей корзины от старых к новым.'''
+        with self._lock:
+            self._load()
+            return list(reversed(list(self.manifest.iter_reversed())))
+
+    def purge(self, now=None):
+        '''
+            Функция которая удаляет из корзины записи старше max_age, а затем самые старые записи,
+            пока суммарный размер корзины превышает max_size. По квоте не удаляются самая новая запись
+            (иначе одно удаление больше квоты нельзя было бы отменить) и записи, на которые ссылается
+            стек undo журнала операций.
+
+            Вывод: количество удалённых записей (int).
+        '''
+        now = now or time.time()
+        entries = self.entries()
+        newest = entries[-1]['id'] if entries else None
+        referenced = set()
+        for trash_paths in list(self.referenced):
+            referenced.update(trash_paths())
+        total = 0
+        for entry in entries:
+            if entry['id'] not in self._sizes:
+                try:
+                    self._sizes[entry['id']] = tree_size(entry['trash_path'])
+                except OSError:
+                    self._sizes[entry['id']] = 0
+            total += self._sizes[entry['id']]
+
+        purged = 0
+        for entry in entries:
+            if now - entry['time'] <= self.max_age:
+                if total <= self.max_size:
+                    break
+                if entry['id'] == newest or entry['trash_path'] in referenced:
+                    continue
+            with self._lock:
+                # Запись могла быть восстановлена, пока считались размеры
+                if not os.path.lexists(entry['trash_path']) and entry['id'] not in self._sizes:
+                    continue
+                self.manifest.remove(entry['id'])
+                total -= self._sizes.pop(entry['id'], 0)
+                # Переименовываем перед удалением, чтобы restore не увидел наполовину удалённое дерево
+                doomed = entry['trash_path'] + '.purging'
+                try:
+                    os.rename(entry['trash_path'], doomed)
+                except OSError:
+                    continue
+            if os.path.isdir(doomed) and not os.path.islink(doomed):
+                from copy_engine import remove_tree
+                try:
+                    remove_tree(doomed)
+                except OSError:
+                    shutil.rmtree(doomed, ignore_errors=True)
+            else:
+                try:
+                    os.remove(doomed)
+                except OSError:
+                    pass
+            purged += 1
+        return purged
+
+    def _start_purger(self):
+        '''Функция которая запускает фоновый поток очистки (один раз) и будит его.'''
+        if not self.purge_interval:
+            return
+        if self._purger is None:
+            self._purger = threading.Thread(target=self._purge_loop, name='trash-purger', daemon=True)
+            self._purger.start()
+        self._wakeup.set()
+
+    def _purge_loop(self):
+        while True:
+            self._wakeup.wait(self.purge_interval)
+            self._wakeup.clear()
+            try:
+                self.purge()
+            except OSError:
+                pass